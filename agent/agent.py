@@ -2,14 +2,16 @@ import os
 import json
 import re
 import shlex
-import shutil
 from pathlib import Path
 from datetime import datetime
 import requests
 from dotenv import load_dotenv
 
-from .utils import _create_github_pr, _create_pr_record_via_backend, _run_or_raise, _stdout, _on_rm_error, sh, _exit_code, _looks_like_confirmation_request
+from .benchmark import format_verification, verify_from_env
+from .utils import _create_github_pr, _create_pr_record_via_backend, _run_or_raise, _stdout, sh, _exit_code, _looks_like_confirmation_request
 from .git_interactions import _has_uncommitted_changes, _ahead_commit_count, _owner_repo_from_url
+from .stages import StageGraph
+from .workspaces import remove_in_background, workspace_pool
 
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
@@ -50,6 +52,13 @@ def _claude_code_command(task: str) -> list[str]:
     return parts
 
 
+def warm_workspaces(repo_url: str):
+    """Start cloning and installing workspaces for `repo_url` before the first `generate_pr`."""
+    pool = workspace_pool(_inject_token_into_url(repo_url), os.getenv("BASE_BRANCH", "main"))
+    if pool is not None:
+        pool.warm()
+
+
 def _inject_token_into_url(repo_url: str) -> str:
     """Inject GITHUB_TOKEN into an HTTPS GitHub URL for authenticated git operations."""
     token = os.getenv("GITHUB_TOKEN", "").strip()
@@ -64,43 +73,88 @@ def _inject_token_into_url(repo_url: str) -> str:
 
 
 # Entry point
-def generate_pr(repo_url: str, prompt: str, create_tests: bool = False):
+def generate_pr(
+    repo_url: str,
+    prompt: str,
+    create_tests: bool = False,
+    benchmark_env: dict | None = None,
+    incident_prompts: dict | None = None,
+):
+    """Clone, let the agent change the code, verify the speedup and open a PR.
+
+    Returns the backend PullRequest record (with the benchmark `verification`, if any),
+    None when the agent changed nothing, or `{"id": None, "rejected": ..., "verification": ...}`
+    when the benchmark did not show the required improvement.
+
+    Once the change is verified, the push and PR creation run alongside incident text
+    generation for each of `incident_prompts` (key -> detection prompt), which only needs
+    the agent's report. The record carries those fields (or the error) in `incidentFields`
+    and how long each step took in `stageTimings`.
+    """
     run_id = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
-    workdir = Path("agent/cloned_repos") / run_id
-    workdir.mkdir(parents=True, exist_ok=True)
-
     base_branch = os.getenv("BASE_BRANCH", "main")
     branch = f"claude/fix-{run_id}"
+    stages = StageGraph()
 
     # Use an authenticated URL for clone so that origin inherits it for push too.
     clone_url = _inject_token_into_url(repo_url)
 
-    try:
-        _run_or_raise(workdir, "git", "clone", clone_url, ".")
-        _run_or_raise(workdir, "git", "checkout", base_branch)
-        _run_or_raise(workdir, "git", "checkout", "-b", branch)
+    # A pooled workspace is already cloned, on the base branch and has its dependencies installed.
+    pool = workspace_pool(clone_url, base_branch)
+    with stages.timed("workspace"):
+        if pool is not None:
+            workdir = pool.acquire()
+        else:
+            workdir = Path("agent/cloned_repos") / run_id
+            workdir.mkdir(parents=True, exist_ok=True)
 
-        final_report = run_agent(prompt, workdir, create_tests)
+    try:
+        with stages.timed("checkout"):
+            if pool is None:
+                _run_or_raise(workdir, "git", "clone", clone_url, ".")
+                _run_or_raise(workdir, "git", "checkout", base_branch)
+            _run_or_raise(workdir, "git", "checkout", "-b", branch)
+
+        with stages.timed("agent"):
+            final_report = run_agent(prompt, workdir, create_tests)
         print(final_report)
 
-        if _has_uncommitted_changes(workdir):
-            _run_or_raise(workdir, "git", "add", "-A")
-            _run_or_raise(workdir, "git", "commit", "-m", f"Claude Code updates ({run_id})")
-
-        ahead = _ahead_commit_count(workdir, base_branch, branch)
+        with stages.timed("commit"):
+            if _has_uncommitted_changes(workdir):
+                _run_or_raise(workdir, "git", "add", "-A")
+                _run_or_raise(workdir, "git", "commit", "-m", f"Claude Code updates ({run_id})")
+            ahead = _ahead_commit_count(workdir, base_branch, branch)
         if ahead == 0:
             print("No commits ahead of base branch; skipping push and PR creation.")
             return None
 
-        _run_or_raise(workdir, "git", "push", "-u", "origin", branch)
+        # Only changes that measurably help get pushed.
+        with stages.timed("verify"):
+            verification = verify_from_env(workdir, base_branch, branch, env=benchmark_env)
+        if verification is not None:
+            print(format_verification(verification))
+            if not verification["accepted"]:
+                print("Benchmark did not show the required improvement; skipping push and PR creation.")
+                return {
+                    "id": None,
+                    "rejected": "benchmark_failed" if verification.get("error") else "insufficient_speedup",
+                    "verification": verification,
+                    "stageTimings": stages.timings,
+                }
+            final_report = f"{final_report}\n\n{format_verification(verification)}"
 
         owner, repo = _owner_repo_from_url(repo_url)
         title = f"Claude Code updates ({run_id})"
-
-        # Create a real GitHub PR so it can be merged via the GitHub API later.
         github_token = os.getenv("GITHUB_TOKEN", "").strip()
-        github_pr_url = None
-        if github_token:
+
+        def push(_inputs):
+            _run_or_raise(workdir, "git", "push", "-u", "origin", branch)
+
+        def create_github_pr(_inputs):
+            # A real GitHub PR, so it can be merged via the GitHub API later.
+            if not github_token:
+                print("Warning: GITHUB_TOKEN not set; skipping GitHub PR creation.")
+                return None
             try:
                 gh_pr = _create_github_pr(
                     owner=owner,
@@ -111,35 +165,58 @@ def generate_pr(repo_url: str, prompt: str, create_tests: bool = False):
                     head=branch,
                     base=base_branch,
                 )
-                github_pr_url = gh_pr.get("html_url")
-                print(f"Created GitHub PR: {github_pr_url}")
             except Exception as e:
                 print(f"Warning: could not create GitHub PR: {e}")
-        else:
-            print("Warning: GITHUB_TOKEN not set; skipping GitHub PR creation.")
-
-        try:
-            pr = _create_pr_record_via_backend(
-                repo_url=repo_url,
-                owner=owner,
-                repo=repo,
-                base_branch=base_branch,
-                head_branch=branch,
-                title=title,
-                body=final_report,
-            )
-        except Exception as e:
-            manual_url = github_pr_url or f"https://github.com/{owner}/{repo}/compare/{base_branch}...{branch}?expand=1"
-            raise RuntimeError(
-                f"Failed to create PullRequest record via backend API: {e}\n"
-                f"PR URL: {manual_url}"
-            ) from e
+                return None
+            print(f"Created GitHub PR: {gh_pr.get('html_url')}")
+            return gh_pr.get("html_url")
+
+        def create_pr_record(_inputs):
+            try:
+                return _create_pr_record_via_backend(
+                    repo_url=repo_url,
+                    owner=owner,
+                    repo=repo,
+                    base_branch=base_branch,
+                    head_branch=branch,
+                    title=title,
+                    body=final_report,
+                    verification=verification,
+                )
+            except Exception as e:
+                # The GitHub PR is created alongside, so point at the branch comparison.
+                manual_url = f"https://github.com/{owner}/{repo}/compare/{base_branch}...{branch}?expand=1"
+                raise RuntimeError(
+                    f"Failed to create PullRequest record via backend API: {e}\n"
+                    f"PR URL: {manual_url}"
+                ) from e
+
+        def incident_fields(detection_prompt):
+            def stage(_inputs):
+                try:
+                    return generate_incident_fields(detection_prompt, title, final_report)
+                except Exception as e:
+                    return {"error": str(e)}
+            return stage
+
+        stages.add("push", push)
+        stages.add("github_pr", create_github_pr, after=("push",))
+        stages.add("pr_record", create_pr_record, after=("push",))
+        for key, detection_prompt in (incident_prompts or {}).items():
+            stages.add(f"incident_fields:{key}", incident_fields(detection_prompt))
+        results = stages.run()
+        pr = results["pr_record"]
         print(f"Created PullRequest record via backend API: id={pr.get('id')}")
+        pr["verification"] = verification
+        pr["incidentFields"] = {key: results[f"incident_fields:{key}"] for key in incident_prompts or {}}
+        pr["stageTimings"] = stages.timings
+        print(f"Stage timings (s): {stages.timings}")
         return pr
     finally:
-        if os.path.exists(workdir):
-            # Need a bit of a workaround
-            shutil.rmtree(workdir, onerror=_on_rm_error)
+        if pool is not None:
+            pool.release(workdir)
+        else:
+            remove_in_background(workdir)
 
 
 def run_agent(task: str, workdir: Path, create_tests: bool = False) -> str:
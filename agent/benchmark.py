@@ -0,0 +1,117 @@
+import os
+import re
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+from .utils import run_process
+
+
+# A benchmark command may print its own measurement; otherwise its wall time is used.
+RESULT_RE = re.compile(r"^BENCHMARK_MS\s*[=:]\s*([0-9]+(?:\.[0-9]+)?)\s*$", re.MULTILINE)
+
+
+class BenchmarkFailed(RuntimeError):
+    pass
+
+
+def _checkout(workdir: Path, ref: str):
+    result = subprocess.run(["git", "checkout", "--quiet", ref], cwd=workdir, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise BenchmarkFailed(f"git checkout {ref} failed: {result.stderr.strip()}")
+
+
+def _measure(workdir: Path, command: str, env: dict, timeout: int) -> float:
+    """Milliseconds one run of `command` took (or reported via a BENCHMARK_MS=<ms> line)."""
+    started = time.perf_counter()
+    try:
+        result = run_process(command, cwd=workdir, timeout=timeout, env=env, shell=True)
+    except subprocess.TimeoutExpired as exc:
+        raise BenchmarkFailed(f"Benchmark timed out after {timeout}s.") from exc
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise BenchmarkFailed(
+            f"Benchmark exited with {result.returncode}.\nSTDOUT:\n{result.stdout[-2000:]}\nSTDERR:\n{result.stderr[-2000:]}"
+        )
+    reported = RESULT_RE.findall(result.stdout)
+    return float(reported[-1]) if reported else elapsed_ms
+
+
+def verify_speedup(
+    workdir: Path,
+    base_ref: str,
+    head_ref: str,
+    command: str,
+    env: dict | None = None,
+    runs: int = 3,
+    warmup_runs: int = 1,
+    timeout: int = 600,
+) -> dict:
+    """Run `command` in `workdir` on `base_ref`, then on `head_ref`, and compare median times.
+
+    The command sees BENCHMARK_REF=base|head plus `env`. Warmup runs (caches, JIT,
+    connection pools) are not measured. `head_ref` is checked out again afterwards,
+    also when the benchmark fails.
+    """
+
+    samples = {}
+    try:
+        for label, ref in (("base", base_ref), ("head", head_ref)):
+            _checkout(workdir, ref)
+            run_env = {**os.environ, **(env or {}), "BENCHMARK_REF": label}
+            for _ in range(warmup_runs):
+                _measure(workdir, command, run_env, timeout)
+            samples[label] = [_measure(workdir, command, run_env, timeout) for _ in range(max(1, runs))]
+    finally:
+        _checkout(workdir, head_ref)
+
+    base_ms = statistics.median(samples["base"])
+    head_ms = statistics.median(samples["head"])
+    return {
+        "command": command,
+        "baseMs": round(base_ms, 3),
+        "headMs": round(head_ms, 3),
+        "baseSamples": samples["base"],
+        "headSamples": samples["head"],
+        "speedup": round(base_ms / head_ms, 4) if head_ms > 0 else None,
+    }
+
+
+def verify_from_env(workdir: Path, base_ref: str, head_ref: str, env: dict | None = None) -> dict | None:
+    """`verify_speedup` configured by BENCHMARK_* env vars, plus the verdict; None without BENCHMARK_CMD.
+
+    A failing benchmark is a verdict too: the change is not accepted.
+    """
+
+    command = os.getenv("BENCHMARK_CMD", "").strip()
+    if not command:
+        return None
+    min_speedup = float(os.getenv("BENCHMARK_MIN_SPEEDUP", "1.05"))
+    try:
+        verification = verify_speedup(
+            workdir,
+            base_ref,
+            head_ref,
+            command,
+            env=env,
+            runs=int(os.getenv("BENCHMARK_RUNS", "3")),
+            warmup_runs=int(os.getenv("BENCHMARK_WARMUP_RUNS", "1")),
+            timeout=int(os.getenv("BENCHMARK_TIMEOUT", "600")),
+        )
+    except BenchmarkFailed as exc:
+        return {"command": command, "minSpeedup": min_speedup, "accepted": False, "error": str(exc), "speedup": None}
+    verification["minSpeedup"] = min_speedup
+    verification["accepted"] = verification["speedup"] is not None and verification["speedup"] >= min_speedup
+    return verification
+
+
+def format_verification(verification: dict) -> str:
+    """Markdown section for the PR body."""
+    if verification.get("error"):
+        return f"Benchmark `{verification['command']}` failed:\n\n```\n{verification['error'][-1500:]}\n```"
+    return (
+        f"Benchmark `{verification['command']}` (median of {len(verification['headSamples'])} runs): "
+        f"{verification['baseMs']:.1f} ms on the base branch, {verification['headMs']:.1f} ms with this change "
+        f"({verification['speedup']:.2f}x, required {verification['minSpeedup']:.2f}x)."
+    )
@@ -0,0 +1,77 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+
+class StageGraph:
+    """Named stages with dependencies, run concurrently as soon as their dependencies are done.
+
+    Each stage is called with a dict of the results of the stages it depends on. How long
+    every stage took, in seconds, ends up in `timings`; `timed(name)` adds steps that run
+    inline (before or after the graph) to the same timings. Stages run in the caller's
+    context, so `process_limits` deadlines apply to their commands too.
+
+    When a stage raises, stages that depend on it are skipped, the ones already running
+    are waited for, and the first error is raised from `run()`.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.stages = {}  # name -> (fn, dependencies)
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, fn, after: tuple[str, ...] = ()):
+        missing = [dependency for dependency in after if dependency not in self.stages]
+        if missing:
+            raise ValueError(f"Stage {name!r} depends on unknown stage(s): {', '.join(missing)}")
+        self.stages[name] = (fn, tuple(after))
+
+    @contextmanager
+    def timed(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._record(name, started)
+
+    def run(self) -> dict:
+        """Run every stage; returns their results by name."""
+        results = {}
+        waiting = dict(self.stages)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage") as pool:
+            while waiting or running:
+                if error is None:
+                    for name, (fn, after) in list(waiting.items()):
+                        if all(dependency in results for dependency in after):
+                            del waiting[name]
+                            inputs = {dependency: results[dependency] for dependency in after}
+                            context = contextvars.copy_context()
+                            running[pool.submit(context.run, self._call, name, fn, inputs)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as exc:
+                        error = error or exc
+        if error is not None:
+            raise error
+        return results
+
+    def _call(self, name: str, fn, inputs: dict):
+        started = time.monotonic()
+        try:
+            return fn(inputs)
+        finally:
+            self._record(name, started)
+
+    def _record(self, name: str, started: float):
+        with self._lock:
+            self.timings[name] = round(time.monotonic() - started, 3)
@@ -1,4 +1,7 @@
+import contextvars
+import signal
 import subprocess
+from contextlib import contextmanager
 from pathlib import Path
 import requests
 import os
@@ -7,17 +10,108 @@ import time
 import re
 
 
-def sh(cwd: Path, *cmd: str, timeout: int = 120) -> str:
+class ProcessStopped(RuntimeError):
+    """A command was stopped because its run was cancelled or reached a deadline."""
+
+    def __init__(self, reason: str, output: str = ""):
+        super().__init__(f"Stopped: {reason}")
+        self.reason = reason
+        self.output = output
+
+
+# (monotonic deadline or None, reason, callable returning a cancel reason or None)
+_process_limits = contextvars.ContextVar("process_limits", default=None)
+
+
+@contextmanager
+def process_limits(deadline: float | None = None, reason: str = "deadline", stop_reason=None):
+    """Within this block, commands run via `run_process` are stopped at the monotonic `deadline`
+    (raising ProcessStopped(`reason`)) or as soon as `stop_reason()` returns a reason."""
+    token = _process_limits.set((deadline, reason, stop_reason))
     try:
-        p = subprocess.run(
-            cmd,
-            cwd=cwd,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-            timeout=timeout,
-        )
+        yield
+    finally:
+        _process_limits.reset(token)
+
+
+_WINDOWS = os.name == "nt"
+# Start every command in a process group of its own, so its whole tree can be stopped.
+_NEW_GROUP = (
+    {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP} if _WINDOWS else {"start_new_session": True}
+)
+
+
+def _kill_group(proc: subprocess.Popen, grace: float = 5):
+    """SIGTERM the child's whole process group, then SIGKILL whatever is left after `grace`.
+
+    On Windows the tree is killed with `taskkill /T /F`, or just the child when that fails.
+    """
+    if _WINDOWS:
+        try:
+            killed = subprocess.run(
+                ["taskkill", "/T", "/F", "/PID", str(proc.pid)], capture_output=True, timeout=grace
+            ).returncode == 0
+        except (OSError, subprocess.TimeoutExpired):
+            killed = False
+        if not killed and proc.poll() is None:
+            proc.kill()
+        return
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return
+        try:
+            proc.wait(timeout=grace)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def run_process(cmd, cwd: Path, timeout: float, env: dict | None = None, shell: bool = False, poll: float = 0.5):
+    """`subprocess.run` that runs `cmd` in its own process group and kills the whole group.
+
+    Unlike `subprocess.run`, the timeout also stops grandchildren (the agent's own tool
+    processes, a shell's children). Raises subprocess.TimeoutExpired on `timeout` and
+    ProcessStopped when the enclosing `process_limits` deadline or cancellation hits.
+    """
+    deadline, reason, stop_reason = _process_limits.get() or (None, "deadline", None)
+    started = time.monotonic()
+    proc = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        env=env,
+        shell=shell,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        **_NEW_GROUP,
+    )
+    while True:
+        try:
+            stdout, stderr = proc.communicate(timeout=poll)
+            return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+        except subprocess.TimeoutExpired:
+            pass
+        stopped = stop_reason() if stop_reason else None
+        if stopped is None and deadline is not None and time.monotonic() >= deadline:
+            stopped = reason
+        if stopped is None and time.monotonic() - started < timeout:
+            continue
+        _kill_group(proc)
+        stdout, stderr = proc.communicate()
+        if stopped is not None:
+            raise ProcessStopped(stopped, output=f"STDOUT:\n{stdout}\nSTDERR:\n{stderr}")
+        raise subprocess.TimeoutExpired(cmd, timeout, output=stdout, stderr=stderr)
+
+
+def sh(cwd: Path, *cmd: str, timeout: int = 120, env: dict | None = None, shell: bool = False) -> str:
+    """Run `cmd` and return its output for the logs; with `shell`, `cmd` is one command line
+    for the platform's shell."""
+    try:
+        p = run_process(" ".join(cmd) if shell else cmd, cwd=cwd, timeout=timeout, env=env, shell=shell)
         return f"$ {' '.join(cmd)}\n(exit {p.returncode})\nSTDOUT:\n{p.stdout}\nSTDERR:\n{p.stderr}"
     except FileNotFoundError as e:
         return f"$ {' '.join(cmd)}\n(exit 127)\nSTDOUT:\n\nSTDERR:\n{e}"
@@ -51,6 +145,7 @@ def _create_pr_record_via_backend(
     head_branch: str,
     title: str,
     body: str,
+    verification: dict | None = None,
 ):
     backend_api_base = os.getenv("BACKEND_API_BASE_URL").rstrip("/")
     url = f"{backend_api_base}/pull-requests/"
@@ -66,6 +161,12 @@ def _create_pr_record_via_backend(
         "body": body,
         "compare_url": compare_url,
     }
+    if verification is not None:
+        payload.update({
+            "benchmark_base_ms": verification.get("baseMs"),
+            "benchmark_head_ms": verification.get("headMs"),
+            "speedup": verification.get("speedup"),
+        })
     response = requests.post(url, json=payload, timeout=30)
     if not response.ok:
         raise RuntimeError(
@@ -0,0 +1,355 @@
+import hashlib
+import os
+import queue
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from .utils import _exit_code, _on_rm_error, _run_or_raise, _stdout, sh
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+# Files that decide what ends up in node_modules (the Prisma client is generated into it).
+DEPENDENCY_FILES = (
+    "package.json",
+    "package-lock.json",
+    "pnpm-lock.yaml",
+    "yarn.lock",
+    "prisma/schema.prisma",
+)
+
+
+def remove_in_background(path: Path):
+    """Delete a directory tree without blocking the caller.
+
+    The tree is first renamed to a hidden sibling (cheap on the same filesystem), so its
+    path can be reused at once; the `rmtree` runs in a daemon thread.
+    """
+    path = Path(path)
+    if not path.exists() and not path.is_symlink():
+        return
+    trash = path.with_name(f".trash-{path.name}-{uuid.uuid4().hex[:8]}")
+    try:
+        path.rename(trash)
+    except OSError:
+        trash = path
+    threading.Thread(
+        target=shutil.rmtree, args=(trash,), kwargs={"onerror": _on_rm_error}, daemon=True
+    ).start()
+
+
+def dependency_key(project: Path) -> str | None:
+    """Hash of the lockfile, manifest and Prisma schema; None when `project` has no package.json."""
+    if not (project / "package.json").exists():
+        return None
+    digest = hashlib.sha256()
+    for name in DEPENDENCY_FILES:
+        path = project / name
+        if path.exists():
+            digest.update(name.encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:20]
+
+
+def install_command(project: Path) -> str:
+    command = os.getenv("DEPENDENCY_INSTALL_CMD", "").strip()
+    if not command:
+        if (project / "pnpm-lock.yaml").exists():
+            command = "pnpm install --frozen-lockfile"
+        elif (project / "yarn.lock").exists():
+            command = "yarn install --frozen-lockfile"
+        elif (project / "package-lock.json").exists():
+            command = "npm ci"
+        else:
+            command = "npm install"
+        if (project / "prisma" / "schema.prisma").exists():
+            command += " && npx prisma generate"
+    return command
+
+
+class WorkspacePool:
+    """Clones of one repository, kept checked out on the base branch with dependencies installed.
+
+    `acquire` hands out a ready workspace; `release` resets it with `git reset --hard` /
+    `git clean` in the background and puts it back, so only the first runs pay for the
+    clone. Each workspace's `install_subdir/node_modules` is a symlink into a cache shared
+    by all workspaces and keyed by `dependency_key`, and package managers share one
+    download cache, so an install only happens when the lockfile or schema changes.
+    The pool is refilled to `size` ready workspaces in background threads.
+
+    A cache entry is never deleted while a workspace links to it: a session that changed
+    the dependencies only retires the entry, the next install builds a new one, and
+    `acquire` re-links ready workspaces to it. Installs and links take a file lock per
+    key, so several processes (e.g. agent workers) can share one pool directory.
+    """
+
+    def __init__(self, root: Path, clone_url: str, base_branch: str, size: int = 2, install_subdir: str = "demo2/backend"):
+        self.root = Path(root)
+        self.clone_url = clone_url
+        self.base_branch = base_branch
+        self.size = size
+        self.install_subdir = install_subdir
+        self.cache_dir = self.root / "cache"
+        self.workspaces_dir = self.root / hashlib.sha256(f"{clone_url}#{base_branch}".encode()).hexdigest()[:12]
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._preparing = 0
+        self._leased = {}  # workspace path -> (dependency key, cache entry) it was handed out with
+
+    @classmethod
+    def from_env(cls, clone_url: str, base_branch: str) -> "WorkspacePool":
+        return cls(
+            Path(os.getenv("WORKSPACE_POOL_DIR", "agent/workspaces")),
+            clone_url,
+            base_branch,
+            size=int(os.getenv("WORKSPACE_POOL_SIZE", "2")),
+            install_subdir=os.getenv("WORKSPACE_INSTALL_SUBDIR", "demo2/backend"),
+        )
+
+    def warm(self):
+        """Start preparing workspaces up to `size` in the background."""
+        with self._lock:
+            missing = max(0, self.size - self._ready.qsize() - self._preparing)
+            self._preparing += missing
+        for _ in range(missing):
+            threading.Thread(target=self._prepare_new, daemon=True).start()
+
+    def acquire(self) -> Path:
+        """A clean workspace on the base branch; waits for one being prepared, else prepares one."""
+        self.warm()
+        while True:
+            try:
+                path = self._ready.get(timeout=0.5)
+                break
+            except queue.Empty:
+                with self._lock:
+                    idle = self._preparing == 0
+                if idle and self._ready.empty():
+                    # Background preparation failed (or size is 0): do it here and let errors surface.
+                    path = self._new_path()
+                    try:
+                        self._prepare(path)
+                    except Exception:
+                        remove_in_background(path)
+                        raise
+                    break
+        try:
+            # The cache entry it was linked to may have been retired while it waited.
+            self._link_dependencies(path)
+        except Exception:
+            remove_in_background(path)
+            raise
+        node_modules = path / self.install_subdir / "node_modules"
+        entry = os.readlink(node_modules) if node_modules.is_symlink() else None
+        self._leased[path] = (self._dependency_key(path), entry)
+        self.warm()
+        return path
+
+    def release(self, path: Path):
+        """Reset `path` for reuse in the background, or delete it when the pool is full."""
+        key, entry = self._leased.pop(path, (None, None))
+        threading.Thread(target=self._recycle, args=(path, key, entry), daemon=True).start()
+
+    def _recycle(self, path: Path, key: str | None, entry: str | None):
+        # The shared node_modules is only safe while the lockfile it was built from is unchanged.
+        if key is not None and entry is not None and self._dependency_key(path) != key:
+            self._retire(key, entry)
+        try:
+            if self._ready.qsize() >= self.size:
+                raise RuntimeError("pool is full")
+            self._prepare(path)
+        except Exception as exc:
+            print(f"Discarding workspace {path}: {exc}")
+            remove_in_background(path)
+            return
+        self._ready.put(path)
+
+    def _new_path(self) -> Path:
+        return self.workspaces_dir / uuid.uuid4().hex[:12]
+
+    def _prepare_new(self):
+        path = self._new_path()
+        try:
+            self._prepare(path)
+            self._ready.put(path)
+        except Exception as exc:
+            print(f"Warning: could not prepare workspace {path}: {exc}")
+            remove_in_background(path)
+        finally:
+            with self._lock:
+                self._preparing -= 1
+
+    def _prepare(self, path: Path):
+        if not (path / ".git").exists():
+            path.mkdir(parents=True, exist_ok=True)
+            _run_or_raise(path, "git", "clone", self.clone_url, ".", timeout=600)
+        else:
+            _run_or_raise(path, "git", "fetch", "--prune", "origin", timeout=600)
+        _run_or_raise(path, "git", "checkout", "--force", "-B", self.base_branch, f"origin/{self.base_branch}")
+        _run_or_raise(path, "git", "reset", "--hard", f"origin/{self.base_branch}")
+        _run_or_raise(path, "git", "clean", "-ffdx", "-e", "node_modules")
+        # A `node_modules/` ignore rule does not match the symlink, so it must never be committed.
+        exclude = path / ".git" / "info" / "exclude"
+        if "node_modules" not in (exclude.read_text() if exclude.exists() else "").splitlines():
+            exclude.parent.mkdir(parents=True, exist_ok=True)
+            with open(exclude, "a") as fh:
+                fh.write("node_modules\n")
+        branches = _stdout(_run_or_raise(path, "git", "for-each-ref", "--format=%(refname:short)", "refs/heads"))
+        stale = [branch for branch in branches.split() if branch != self.base_branch]
+        if stale:
+            _run_or_raise(path, "git", "branch", "-D", *stale)
+        self._link_dependencies(path)
+
+    def _dependency_key(self, path: Path) -> str | None:
+        return dependency_key(path / self.install_subdir)
+
+    def _link_dependencies(self, path: Path):
+        project = path / self.install_subdir
+        key = dependency_key(project)
+        if key is None:
+            return
+        target = project / "node_modules"
+        with self._key_lock(key):
+            entry = self._current_entry(key)
+            if entry is None:
+                _clear(target)
+                self._install(project)
+                entry = self.cache_dir / "node_modules" / f"{key}.{uuid.uuid4().hex[:8]}"
+                (project / "node_modules").rename(entry)
+                pointer = self._pointer(key)
+                pointer.with_suffix(".tmp").write_text(entry.name)
+                os.replace(pointer.with_suffix(".tmp"), pointer)
+            if not (target.is_symlink() and Path(os.readlink(target)) == entry.resolve()):
+                _clear(target)
+                target.symlink_to(entry.resolve(), target_is_directory=True)
+            self._collect(key)
+
+    def _pointer(self, key: str) -> Path:
+        return self.cache_dir / "node_modules" / f"{key}.current"
+
+    def _current_entry(self, key: str) -> Path | None:
+        pointer = self._pointer(key)
+        if not pointer.exists():
+            return None
+        entry = pointer.parent / pointer.read_text().strip()
+        return entry if entry.is_dir() else None
+
+    @contextmanager
+    def _key_lock(self, key: str):
+        lock_path = self.cache_dir / "node_modules" / f"{key}.lock"
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                return
+            # msvcrt locks a byte range; LK_LOCK gives up after ~10 seconds, so keep trying.
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _retire(self, key: str, entry: str):
+        """Stop handing out cache `entry`; workspaces still linked to it keep working."""
+        with self._key_lock(key):
+            current = self._current_entry(key)
+            if current is not None and current.resolve() == Path(entry).resolve():
+                self._pointer(key).unlink(missing_ok=True)
+
+    def _collect(self, key: str):
+        """Delete retired entries of `key` that no workspace links to any more (key lock held)."""
+        current = self._current_entry(key)
+        linked = set()
+        if self.workspaces_dir.exists():
+            for workspace in self.workspaces_dir.iterdir():
+                if workspace.name.startswith(".trash-"):
+                    continue
+                node_modules = workspace / self.install_subdir / "node_modules"
+                if node_modules.is_symlink():
+                    linked.add(Path(os.readlink(node_modules)))
+        for entry in (self.cache_dir / "node_modules").glob(f"{key}.*"):
+            if not entry.is_dir() or entry.is_symlink() or (current is not None and entry == current):
+                continue
+            if entry.resolve() not in linked:
+                remove_in_background(entry)
+
+    def _install(self, project: Path):
+        command = install_command(project)
+        downloads = (self.cache_dir / "downloads").resolve()
+        env = {
+            **os.environ,
+            "npm_config_cache": str(downloads / "npm"),
+            "npm_config_store_dir": str(downloads / "pnpm"),
+            "YARN_CACHE_FOLDER": str(downloads / "yarn"),
+        }
+        timeout = int(os.getenv("DEPENDENCY_INSTALL_TIMEOUT", "900"))
+        out = sh(project, command, timeout=timeout, env=env, shell=True)
+        print(out)
+        if _exit_code(out) != 0:
+            raise RuntimeError(f"Dependency install failed ({_exit_code(out)}): {command}")
+
+
+def _clear(path: Path):
+    if path.is_symlink():
+        path.unlink()
+    elif path.exists():
+        remove_in_background(path)
+
+
+def pool_supported(root: Path) -> bool:
+    """Whether a pool can live under `root`: it needs a file lock and directory symlinks
+    (on Windows those take Developer Mode or admin rights)."""
+    if fcntl is None and msvcrt is None:
+        return False
+    root = Path(root)
+    probe = root / f".symlink-probe-{uuid.uuid4().hex[:8]}"
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+        probe.symlink_to(root.resolve(), target_is_directory=True)
+    except (OSError, NotImplementedError):
+        return False
+    probe.unlink()
+    return True
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def workspace_pool(clone_url: str, base_branch: str) -> WorkspacePool | None:
+    """The process-wide pool for a repository and base branch.
+
+    None, meaning a fresh clone per run, when WORKSPACE_POOL_SIZE=0 or the platform cannot
+    host a pool (see `pool_supported`).
+    """
+    if int(os.getenv("WORKSPACE_POOL_SIZE", "2")) <= 0:
+        return None
+    with _pools_lock:
+        key = (clone_url, base_branch)
+        if key not in _pools:
+            pool = WorkspacePool.from_env(clone_url, base_branch)
+            if not pool_supported(pool.root):
+                print("Warning: workspace pool unavailable here (no file locks or symlinks); cloning per run.")
+                pool = None
+            _pools[key] = pool
+        return _pools[key]
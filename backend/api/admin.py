@@ -1,5 +1,16 @@
 from django.contrib import admin
-from .models import DetectionRun, Incident, Log, PullRequest
+from .models import (
+    AgentJob,
+    DeferredCandidate,
+    DetectionRun,
+    Incident,
+    LatencyBaseline,
+    Log,
+    MergedFix,
+    PullRequest,
+    RunCandidate,
+    StatsSummary,
+)
 
 
 @admin.register(PullRequest)
@@ -10,7 +21,7 @@ class PullRequestAdmin(admin.ModelAdmin):
 
 @admin.register(Incident)
 class IncidentAdmin(admin.ModelAdmin):
-    list_display = ("id", "title", "severity", "pullRequest", "timeImpact", "impactCount")
+    list_display = ("id", "title", "severity", "pullRequest", "timeImpact", "impactCount", "meanAddedLatency")
     list_filter = ("severity",)
     search_fields = ("title", "problemDescription", "solutionDescription")
 
@@ -27,3 +38,48 @@ class DetectionRunAdmin(admin.ModelAdmin):
     list_display = ("id", "date", "runType", "status", "incidentCount")
     list_filter = ("runType", "status", "date")
     search_fields = ("errorMessage",)
+
+
+@admin.register(StatsSummary)
+class StatsSummaryAdmin(admin.ModelAdmin):
+    list_display = ("id", "key", "version", "computed_version", "computed_at")
+
+
+@admin.register(LatencyBaseline)
+class LatencyBaselineAdmin(admin.ModelAdmin):
+    list_display = ("id", "route", "callSite", "count", "p50", "p95", "p99", "updated_at")
+    search_fields = ("route", "callSite")
+    exclude = ("sketch",)
+
+
+@admin.register(DeferredCandidate)
+class DeferredCandidateAdmin(admin.ModelAdmin):
+    list_display = ("id", "callSite", "severity", "score", "deferrals", "runId", "updated_at")
+    list_filter = ("severity",)
+    search_fields = ("callSite", "traceId")
+    exclude = ("payload",)
+
+
+@admin.register(MergedFix)
+class MergedFixAdmin(admin.ModelAdmin):
+    list_display = ("id", "callSite", "mergedAt", "status", "beforeP95", "afterP95", "p95Change", "afterCount")
+    list_filter = ("status",)
+    search_fields = ("callSite", "repo", "headBranch")
+    exclude = ("beforeSketch", "afterSketch")
+
+
+@admin.register(RunCandidate)
+class RunCandidateAdmin(admin.ModelAdmin):
+    list_display = ("id", "detectionRun", "position", "callSite", "status", "attempts", "pullRequest", "updated_at")
+    list_filter = ("status",)
+    search_fields = ("callSite", "traceId", "errorMessage")
+    exclude = ("payload",)
+
+
+@admin.register(AgentJob)
+class AgentJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "runId", "groupIndex", "status", "attempts", "leaseOwner", "leaseExpiresAt", "updated_at")
+    list_filter = ("status",)
+    search_fields = ("runId", "leaseOwner", "errorMessage")
+    exclude = ("candidates", "prompt")
+
@@ -0,0 +1,76 @@
+from collections import defaultdict
+
+from .n_plus_one import find_n_plus_one
+
+
+def analyze_trace(trace, tree, callOperations, route, regressions=(), n_plus_one_min_repeats=3):
+    """Per-trace incident candidate: call operations by critical-path time, N+1 patterns and context.
+
+    `callOperations` maps span ids of the trace's prisma:call-operation spans to the spans.
+    """
+
+    # stacktrace = None
+    # for tag in getSpan.get("tags"):
+    #     if tag.get("key") == "code.stacktrace":
+    #         stacktrace = tag
+
+    # Latency on the request's critical path, attributed to the call operation it happened under.
+    critical_by_call_operation = defaultdict(int)
+    for span_id, micros in tree.critical_path().items():
+        owner = tree.nearest(span_id, "prisma:call-operation")
+        if owner is not None:
+            critical_by_call_operation[owner] += micros
+
+    summaries = {}
+    critical_by_call_site = defaultdict(int)
+    for span_id in callOperations:
+        curr = {
+            "duration": callOperations[span_id].get("duration"),
+            "selfTime": tree.self_time(span_id),
+            "criticalTime": critical_by_call_operation.get(span_id, 0),
+        }
+        for tag in callOperations[span_id].get("tags"):
+            if tag.get("key") == "prisma.args":
+                curr["args"] = tag.get("value")
+            if tag.get("key") == "prisma.frame":
+                curr["tag"] = tag.get("value")
+
+        critical_by_call_site[curr.get("tag")] += curr["criticalTime"]
+        summaries[span_id] = curr
+
+    n_plus_one = find_n_plus_one(trace.get("spans"), min_repeats=n_plus_one_min_repeats)
+
+    return {
+        "httpTarget": route,
+        # "stacktrace": stacktrace.get("value"),
+        "duration": tree.duration,
+        "callOperations": sorted([{
+            "callOperation": summaries[span_id],
+        } for span_id in summaries], key=lambda co: (
+            co.get("callOperation").get("criticalTime"),
+            co.get("callOperation").get("duration"),
+        ), reverse=True),
+        "criticalByCallSite": dict(critical_by_call_site),
+        "nPlusOne": n_plus_one,
+        "regressions": list(regressions),
+    }
+
+
+def incident_call_site(incident):
+    """Call site an incident is keyed on: the worst N+1 pattern, else the slowest call operation."""
+    n_plus_one = incident.get("nPlusOne") or []
+    if n_plus_one and n_plus_one[0].get("callSite"):
+        return n_plus_one[0]["callSite"]
+    slowCallOperation = incident.get("callOperations")[0]
+    return slowCallOperation.get("callOperation").get("tag")
+
+
+def call_site_latency(incident):
+    """Critical-path microseconds attributed to the incident's call site in its trace."""
+    return (incident.get("criticalByCallSite") or {}).get(incident_call_site(incident), 0)
+
+
+def incident_rank(incident):
+    n_plus_one = incident.get("nPlusOne") or []
+    repeated_time = n_plus_one[0]["totalDuration"] if n_plus_one else 0
+    return (repeated_time, call_site_latency(incident), incident.get("duration") or 0)
@@ -2,9 +2,12 @@ from django.apps import AppConfig
 
 
 class ApiConfig(AppConfig):
+    # What the migrations were generated with, whatever the Django default.
+    default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
 
     def ready(self):
+        from . import signals  # noqa: F401
         from .scheduler import start_hourly_detection_scheduler
 
         start_hourly_detection_scheduler()
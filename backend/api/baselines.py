@@ -0,0 +1,92 @@
+from django.db import transaction
+
+from .latency_sketch import LatencySketch
+from .models import LatencyBaseline
+
+
+REQUEST = ""  # callSite key for whole-request latency
+
+
+def record_latency(sketches: dict, route: str, call_site: str, micros, weight: float = 1):
+    sketch = sketches.get((route, call_site))
+    if sketch is None:
+        sketch = sketches[(route, call_site)] = LatencySketch()
+    sketch.add(micros, weight)
+
+
+class BaselineComparison:
+    """Outcome of comparing one run's sketches against the persisted baselines."""
+
+    def __init__(self, baselines: dict, regressions: dict, min_samples: int):
+        # Both keyed by (route, callSite); `baselines` holds the pre-run p95/p99/count.
+        self.baselines = baselines
+        self.regressions = regressions
+        self.min_samples = min_samples
+
+    def is_mature(self, route: str, call_site: str = REQUEST) -> bool:
+        baseline = self.baselines.get((route, call_site))
+        return baseline is not None and baseline["count"] >= self.min_samples
+
+    def route_regressions(self, route: str, call_sites) -> list[dict]:
+        keys = [(route, REQUEST), *((route, call_site) for call_site in call_sites)]
+        return [self.regressions[key] for key in keys if key in self.regressions]
+
+
+def compare_and_update_baselines(
+    run_sketches: dict, tolerance: float = 0.2, min_samples: int = 10, save: bool = True
+) -> BaselineComparison:
+    """Flag keys whose run p95/p99 exceed the baseline by more than `tolerance`, then fold the run in.
+
+    Only keys with at least `min_samples` observations on both sides are compared. With
+    `save=False` the baselines are compared against but left untouched.
+    """
+
+    routes = {route for route, _call_site in run_sketches}
+    existing = {
+        (row.route, row.callSite): row
+        for row in LatencyBaseline.objects.filter(route__in=routes)
+        if (row.route, row.callSite) in run_sketches
+    }
+
+    baselines, regressions = {}, {}
+    with transaction.atomic():
+        for key, run_sketch in run_sketches.items():
+            row = existing.get(key)
+            if row is not None:
+                baselines[key] = {"p95": row.p95, "p99": row.p99, "count": row.count}
+                regression = _regression(key, row, run_sketch, tolerance, min_samples)
+                if regression:
+                    regressions[key] = regression
+                sketch = LatencySketch.from_dict(row.sketch)
+            else:
+                row = LatencyBaseline(route=key[0], callSite=key[1])
+                sketch = LatencySketch()
+
+            if not save:
+                continue
+            sketch.merge(run_sketch)
+            row.sketch = sketch.to_dict()
+            row.count = sketch.count
+            row.p50, row.p95, row.p99 = sketch.quantile(0.5), sketch.quantile(0.95), sketch.quantile(0.99)
+            row.save()
+
+    return BaselineComparison(baselines, regressions, min_samples)
+
+
+def _regression(key, row, run_sketch, tolerance, min_samples):
+    if row.count < min_samples or run_sketch.count < min_samples or not row.p95:
+        return None
+    run_p95, run_p99 = run_sketch.quantile(0.95), run_sketch.quantile(0.99)
+    p95_regressed = run_p95 > row.p95 * (1 + tolerance)
+    p99_regressed = bool(row.p99) and run_p99 > row.p99 * (1 + tolerance)
+    if not (p95_regressed or p99_regressed):
+        return None
+    return {
+        "route": key[0],
+        "callSite": key[1],
+        "baselineP95": row.p95,
+        "baselineP99": row.p99,
+        "runP95": run_p95,
+        "runP99": run_p99,
+        "runCount": run_sketch.count,
+    }
@@ -0,0 +1,89 @@
+from django.db.models import F
+from django.utils import timezone
+
+from .models import AgentJob, DeferredCandidate, RunCandidate
+
+
+# Candidates a resumed run works on again. Deferred ones only while no later run has taken them.
+RESUMABLE_STATUSES = ("pending", "failed", "deferred")
+
+
+class RunCheckpoint:
+    """The analyzed, grouped candidates of one DetectionRun and how far each of them got.
+
+    Written once analysis is done, then updated after every agent session, so a run that
+    failed, was cancelled or timed out can be resumed without fetching and analyzing the
+    traces again. Without a `detection_run` (replays, dry runs) nothing is recorded.
+    """
+
+    def __init__(self, detection_run=None):
+        self.detection_run = detection_run
+
+    @classmethod
+    def save_groups(cls, detection_run, groups: list[list[dict]]) -> "RunCheckpoint":
+        checkpoint = cls(detection_run)
+        if detection_run is None:
+            return checkpoint
+        RunCandidate.objects.filter(detectionRun=detection_run).delete()
+        position = 0
+        rows = []
+        for group_index, group in enumerate(groups):
+            for candidate in group:
+                rows.append(RunCandidate(
+                    detectionRun=detection_run,
+                    position=position,
+                    groupIndex=group_index,
+                    callSite=candidate["callSite"],
+                    traceId=candidate.get("traceId") or "",
+                    score=candidate.get("score") or 0,
+                    payload=candidate,
+                ))
+                position += 1
+        RunCandidate.objects.bulk_create(rows)
+        return checkpoint
+
+    @property
+    def exists(self) -> bool:
+        return self.detection_run is not None and RunCandidate.objects.filter(detectionRun=self.detection_run).exists()
+
+    def mark(self, candidates: list[dict], status: str, error: str = "", pull_request_id: int | None = None):
+        if self.detection_run is None or not candidates:
+            return
+        fields = {"status": status, "errorMessage": error[:4000], "updated_at": timezone.now()}
+        if pull_request_id is not None:
+            fields["pullRequest_id"] = pull_request_id
+        RunCandidate.objects.filter(
+            detectionRun=self.detection_run,
+            callSite__in=[candidate["callSite"] for candidate in candidates],
+        ).update(**fields)
+
+    def start(self, candidates: list[dict]):
+        if self.detection_run is None:
+            return
+        RunCandidate.objects.filter(
+            detectionRun=self.detection_run,
+            callSite__in=[candidate["callSite"] for candidate in candidates],
+        ).update(attempts=F("attempts") + 1, updated_at=timezone.now())
+
+    def resumable_groups(self) -> list[list[dict]]:
+        """The groups still to be worked on, in their original order."""
+        still_deferred = set(DeferredCandidate.objects.values_list("callSite", flat=True))
+        # Queued sessions are still to be picked up by a worker.
+        queued = {
+            candidate["callSite"]
+            for job in AgentJob.objects.filter(detectionRun=self.detection_run, status__in=("queued", "running"))
+            for candidate in job.candidates
+        }
+        groups = {}
+        for row in RunCandidate.objects.filter(detectionRun=self.detection_run, status__in=RESUMABLE_STATUSES):
+            if (row.status == "deferred" and row.callSite not in still_deferred) or row.callSite in queued:
+                continue
+            groups.setdefault(row.groupIndex, []).append(row.payload)
+        return [groups[index] for index in sorted(groups)]
+
+    def counts(self) -> dict:
+        counts = {}
+        if self.detection_run is not None:
+            for status in RunCandidate.objects.filter(detectionRun=self.detection_run).values_list("status", flat=True):
+                counts[status] = counts.get(status, 0) + 1
+        return counts
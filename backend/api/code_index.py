@@ -0,0 +1,592 @@
+import bisect
+import gzip
+import json
+import os
+import re
+import subprocess
+from pathlib import Path
+
+from django.conf import settings
+
+
+SOURCE_SUFFIXES = (".ts", ".tsx", ".js", ".mjs", ".cjs")
+SKIPPED_DIRS = ("node_modules/", "generated/", "dist/")
+PRISMA_SCHEMA = "prisma/schema.prisma"
+PRISMA_OPERATIONS = (
+    "findMany", "findFirst", "findFirstOrThrow", "findUnique", "findUniqueOrThrow", "create", "createMany",
+    "createManyAndReturn", "update", "updateMany", "upsert", "delete", "deleteMany", "count", "aggregate", "groupBy",
+)
+_KEYWORDS = {"if", "for", "while", "switch", "catch", "function", "return", "with", "typeof", "await", "new", "async"}
+
+_IDENT = r"[A-Za-z_$][\w$]*"
+_FUNCTION_RE = re.compile(rf"\bfunction\b\s*\*?\s*({_IDENT})?")
+_ARROW_RE = re.compile(r"=>")
+_METHOD_RE = re.compile(
+    rf"^[ \t]*(?:(?:public|private|protected|static|async|get|set|override)\s+)*\*?\s*({_IDENT})\s*(?:<[^>\n]*>)?\(",
+    re.MULTILINE,
+)
+_DECLARATION_RE = re.compile(rf"\b(?:const|let|var)\s+({_IDENT})\s*(?::[^=]+)?=\s*(?:async\s+)?$")
+_PROPERTY_RE = re.compile(rf"({_IDENT})\s*:\s*(?:async\s+)?$")
+_CALL_RE = re.compile(rf"(?<![\w$.])({_IDENT})\s*\(")
+_PRISMA_CALL_RE = re.compile(rf"\.({_IDENT})\s*\.\s*({'|'.join(PRISMA_OPERATIONS)})\s*\(")
+_ROUTE_CALL_RE = re.compile(rf"\b({_IDENT})\.(get|post|put|delete|patch|all|use)\s*\($")
+
+_LOCATION_RE = re.compile(r"([^\s()]+?):(\d+)(?::\d+)?\)?\s*$")
+_MODEL_RE = re.compile(r"^\s*model\s+(\w+)\s*\{(.*?)^\s*\}", re.MULTILINE | re.DOTALL)
+_FIELD_RE = re.compile(r"^\s*(\w+)\s+(\w+)(\[\])?(\?)?(.*)$")
+
+
+def _blank_comments_and_strings(text: str) -> str:
+    """Same-length copy of JS/TS source with comments, string and regex contents blanked out.
+
+    Newlines are kept so offsets map to the same lines; quotes are kept so string
+    literals stay recognizable.
+    """
+
+    out = list(text)
+    i, n = 0, len(text)
+    previous = ""  # last non-space character of code, to tell a regex literal from a division
+    while i < n:
+        char = text[i]
+        if not char.isspace() and not text.startswith("//", i) and not text.startswith("/*", i):
+            if char == "/" and (not previous or previous in "(,=:[!&|?{};"):
+                j, in_class = i + 1, False
+                while j < n and text[j] != "\n" and (in_class or text[j] != "/"):
+                    if text[j] == "\\":
+                        j += 1
+                    elif text[j] == "[":
+                        in_class = True
+                    elif text[j] == "]":
+                        in_class = False
+                    j += 1
+                out[i + 1:j] = " " * (j - i - 1)
+                previous = "/"
+                i = j + 1
+                continue
+            previous = char
+        if text.startswith("//", i):
+            end = text.find("\n", i)
+            end = n if end < 0 else end
+            out[i:end] = " " * (end - i)
+            i = end
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            end = n if end < 0 else end + 2
+            out[i:end] = [c if c == "\n" else " " for c in text[i:end]]
+            i = end
+        elif char in "'\"`":
+            j = i + 1
+            while j < n and text[j] != char:
+                if text[j] == "\\":
+                    j += 1
+                elif text[j] == "\n" and char != "`":
+                    break
+                j += 1
+            out[i + 1:j] = [c if c == "\n" else " " for c in text[i + 1:j]]
+            i = j + 1
+        else:
+            i += 1
+    return "".join(out)
+
+
+def _match_forward(code, start, open_char, close_char):
+    """Offset just past the bracket closing the one at `start`."""
+    depth = 0
+    for i in range(start, len(code)):
+        if code[i] == open_char:
+            depth += 1
+        elif code[i] == close_char:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return len(code)
+
+
+def _match_backward(code, end, open_char, close_char):
+    """Offset of the bracket opening the one at `end`."""
+    depth = 0
+    for i in range(end, -1, -1):
+        if code[i] == close_char:
+            depth += 1
+        elif code[i] == open_char:
+            depth -= 1
+            if depth == 0:
+                return i
+    return 0
+
+
+def _skip_space(code, pos):
+    while pos < len(code) and code[pos].isspace():
+        pos += 1
+    return pos
+
+
+def _body_end(code, pos):
+    """End of a function body starting at `pos`: a braced block, or an expression."""
+    pos = _skip_space(code, pos)
+    if pos < len(code) and code[pos] == "{":
+        return _match_forward(code, pos, "{", "}")
+    depth = 0
+    for i in range(pos, len(code)):
+        if code[i] in "([{":
+            depth += 1
+        elif code[i] in ")]}":
+            depth -= 1
+            if depth < 0:
+                return i
+        elif depth == 0 and code[i] in ",;":
+            return i
+    return len(code)
+
+
+def _block_after(code, pos):
+    """Offset of the `{` opening the body that follows a parameter list at `pos` (a `(`)."""
+    pos = _match_forward(code, pos, "(", ")")
+    depth = 0
+    for i in range(pos, len(code)):
+        if code[i] == "{" and depth == 0:
+            return i
+        if code[i] in "<([":
+            depth += 1
+        elif code[i] in ">)]":
+            depth -= 1
+        elif code[i] in ";=" and depth == 0:
+            return None
+    return None
+
+
+def _callee_name(text, code, paren):
+    """Name for a callback passed to the call whose `(` is at `paren`."""
+    before = code[:paren + 1]
+    route = _ROUTE_CALL_RE.search(before[-80:])
+    if route:
+        path = re.match(r"\s*([\"'`])(.*?)\1", text[paren + 1:paren + 200])
+        method = route.group(2).upper()
+        return f"{method} {path.group(2)} handler" if path else f"{route.group(1)}.{route.group(2)} callback"
+    callee = re.search(rf"({_IDENT})\s*(?:<[^>]*>)?\s*\($", before)
+    return f"<anonymous> in {callee.group(1)}()" if callee else "<anonymous>"
+
+
+def _arrow_function(text, code, arrow):
+    """(name, start offset, end offset) of the arrow function whose `=>` is at `arrow`."""
+    pos = arrow - 1
+    while pos > 0 and code[pos].isspace():
+        pos -= 1
+    if code[pos] == ")":
+        start = _match_backward(code, pos, "(", ")")
+    else:
+        match = re.search(rf"{_IDENT}$", code[:pos + 1])
+        start = match.start() if match else pos
+    # Return type annotations sit between the parameters and the arrow: `(a): Promise<X> =>`.
+    head = code[:start].rstrip()
+    if head.endswith(":"):
+        close = head.rfind(")")
+        if close >= 0:
+            start = _match_backward(code, close, "(", ")")
+            head = code[:start].rstrip()
+    if head.endswith("async"):
+        head = head[:-5].rstrip()
+        start = len(head)
+        start = _skip_space(code, start)
+
+    name = None
+    prefix = code[max(0, start - 200):start]
+    declaration = _DECLARATION_RE.search(prefix)
+    prop = _PROPERTY_RE.search(prefix)
+    if declaration:
+        name = declaration.group(1)
+    elif prop:
+        name = prop.group(1)
+    else:
+        stripped = code[:start].rstrip()
+        if stripped.endswith("(") or stripped.endswith(","):
+            depth = 0
+            for i in range(len(stripped) - 1, -1, -1):
+                if stripped[i] in ")]}":
+                    depth += 1
+                elif stripped[i] in "([{":
+                    if depth == 0:
+                        if stripped[i] == "(":
+                            name = _callee_name(text, code, i)
+                        break
+                    depth -= 1
+    return name or "<anonymous>", start, _body_end(code, arrow + 2)
+
+
+def parse_source(text: str) -> list[dict]:
+    """Functions in a JS/TS file: name, 1-based start/end lines, Prisma models and free calls.
+
+    A regex and bracket-matching scan, not a parser; good enough to map a stack frame
+    line to the function around it.
+    """
+
+    code = _blank_comments_and_strings(text)
+    line_starts = [0] + [i + 1 for i, char in enumerate(code) if char == "\n"]
+
+    def line_of(offset):
+        return bisect.bisect_right(line_starts, offset)
+
+    spans = []
+    for match in _FUNCTION_RE.finditer(code):
+        paren = code.find("(", match.end())
+        if paren < 0:
+            continue
+        block = _block_after(code, paren)
+        if block is None:
+            continue
+        name = match.group(1)
+        if not name:
+            declaration = _DECLARATION_RE.search(code[max(0, match.start() - 200):match.start()])
+            name = declaration.group(1) if declaration else "<anonymous>"
+        spans.append((name, match.start(), _match_forward(code, block, "{", "}")))
+    for match in _ARROW_RE.finditer(code):
+        spans.append(_arrow_function(text, code, match.start()))
+    for match in _METHOD_RE.finditer(code):
+        name = match.group(1)
+        if name in _KEYWORDS:
+            continue
+        block = _block_after(code, match.end() - 1)
+        # A method's body follows its parameters on the same line (modulo a return type);
+        # anything else is a call statement.
+        if block is None or "\n" in code[_match_forward(code, match.end() - 1, "(", ")"):block]:
+            continue
+        start = match.start(1)
+        if any(start == existing_start for _name, existing_start, _end in spans):
+            continue
+        spans.append((name, start, _match_forward(code, block, "{", "}")))
+
+    functions = []
+    spans.sort(key=lambda span: (span[1], -span[2]))
+    for position, (name, start, end) in enumerate(spans):
+        # Calls and queries of nested functions belong to those functions.
+        body = list(code[start:end])
+        for _nested, nested_start, nested_end in spans[position + 1:]:
+            if nested_start >= end:
+                break
+            if nested_start > start and nested_end <= end:
+                body[nested_start - start:nested_end - start] = " " * (nested_end - nested_start)
+        body = "".join(body)
+        functions.append({
+            "name": name,
+            "start": line_of(start),
+            "end": line_of(max(start, end - 1)),
+            "prismaAccessors": sorted({match.group(1) for match in _PRISMA_CALL_RE.finditer(body)}),
+            "calls": sorted({match.group(1) for match in _CALL_RE.finditer(body)} - _KEYWORDS - {name}),
+        })
+    return functions
+
+
+def parse_prisma_schema(text: str) -> dict:
+    """Models of a Prisma schema with their scalar fields and relations to other models."""
+    blocks = [(name, body) for name, body in _MODEL_RE.findall(text)]
+    names = {name for name, _body in blocks}
+    models = {}
+    for name, body in blocks:
+        fields, relations = [], []
+        for line in body.splitlines():
+            line = line.split("//")[0].strip()
+            match = _FIELD_RE.match(line)
+            if not match or line.startswith("@@"):
+                continue
+            field, field_type, is_list, optional, attributes = match.groups()
+            if field_type in names:
+                foreign_key = re.search(r"fields:\s*\[([^\]]*)\]", attributes)
+                relations.append({
+                    "field": field,
+                    "model": field_type,
+                    "list": bool(is_list),
+                    "optional": bool(optional),
+                    "foreignKey": [key.strip() for key in foreign_key.group(1).split(",")] if foreign_key else [],
+                })
+            else:
+                fields.append(f"{field} {field_type}{is_list or ''}{optional or ''}")
+        models[name] = {"fields": fields, "relations": relations}
+    return models
+
+
+def _accessor(model: str) -> str:
+    """Client property of a Prisma model: `AIModel` -> `aIModel`."""
+    return model[:1].lower() + model[1:]
+
+
+class CodeIndex:
+    """Source map of one commit of the application repository.
+
+    Maps file:line to the function around it and records, per function, the Prisma
+    models it queries and the free functions it calls, so callers can be listed.
+    Indexes are cached per commit SHA as gzipped JSON; indexing a new commit starts
+    from the most recent cached one and reparses only the files `git diff` reports
+    as changed.
+    """
+
+    FORMAT = 1
+
+    def __init__(self, repo, sha: str, prefix: str, files: dict, models: dict):
+        self.repo = Path(repo)
+        self.sha = sha
+        self.prefix = prefix.strip("/")
+        self.files = files  # path relative to prefix -> list of functions
+        self.models = models
+        self.reparsed = 0
+        self._callers = None
+
+    @classmethod
+    def from_env(cls) -> "CodeIndex | None":
+        """Index of `CODE_INDEX_REF` in the `CODE_INDEX_REPO` checkout, or None when not configured."""
+        repo = os.getenv("CODE_INDEX_REPO")
+        if not repo:
+            return None
+        return cls.load(
+            repo,
+            ref=os.getenv("CODE_INDEX_REF", "HEAD"),
+            prefix=os.getenv("CODE_INDEX_PREFIX", "demo2/backend"),
+            cache_dir=os.getenv("CODE_INDEX_DIR") or Path(settings.BASE_DIR) / "code_index",
+            keep=int(os.getenv("CODE_INDEX_KEEP", "10")),
+        )
+
+    @classmethod
+    def load(cls, repo, ref: str = "HEAD", prefix: str = "", cache_dir=None, keep: int = 10) -> "CodeIndex":
+        repo = Path(repo)
+        sha = _git(repo, "rev-parse", "--verify", f"{ref}^{{commit}}").strip()
+        prefix = prefix.strip("/")
+        cache_dir = Path(cache_dir) if cache_dir else None
+        if cache_dir is not None:
+            cached = cls._read(repo, cache_dir, sha, prefix)
+            if cached is not None:
+                return cached
+
+        previous = cls._latest(repo, cache_dir, prefix) if cache_dir is not None else None
+        index = cls.build(repo, sha, prefix, previous=previous)
+        if cache_dir is not None:
+            index._write(cache_dir)
+            cls._prune(cache_dir, keep)
+        return index
+
+    @classmethod
+    def build(cls, repo, sha: str, prefix: str = "", previous: "CodeIndex | None" = None) -> "CodeIndex":
+        repo = Path(repo)
+        prefix = prefix.strip("/")
+        listing = _git(repo, "ls-tree", "-r", "--full-tree", sha, "--", prefix or ".")
+        blobs = {}
+        for line in listing.splitlines():
+            meta, path = line.split("\t", 1)
+            if meta.split()[1] != "blob":
+                continue
+            relative = path[len(prefix) + 1:] if prefix else path
+            if relative == PRISMA_SCHEMA or (
+                relative.endswith(SOURCE_SUFFIXES) and not relative.endswith(".d.ts")
+                and not any(f"/{skipped}" in f"/{relative}" for skipped in SKIPPED_DIRS)
+            ):
+                blobs[relative] = meta.split()[2]
+
+        changed = None
+        if previous is not None:
+            try:
+                changed = _git(repo, "diff", "--name-only", previous.sha, sha, "--", prefix or ".").splitlines()
+                changed = {path[len(prefix) + 1:] if prefix else path for path in changed}
+            except RuntimeError:
+                changed = None  # The cached commit is gone from the repository: start over.
+
+        files, to_parse = {}, []
+        for path in blobs:
+            if path == PRISMA_SCHEMA:
+                continue
+            if changed is not None and path not in changed and path in previous.files:
+                files[path] = previous.files[path]
+            else:
+                to_parse.append(path)
+        models = {}
+        if changed is not None and PRISMA_SCHEMA not in changed:
+            models = previous.models
+        elif PRISMA_SCHEMA in blobs:
+            to_parse.append(PRISMA_SCHEMA)
+
+        for path, source in zip(to_parse, _read_blobs(repo, [blobs[path] for path in to_parse])):
+            if path == PRISMA_SCHEMA:
+                models = parse_prisma_schema(source)
+            else:
+                files[path] = parse_source(source)
+        index = cls(repo, sha, prefix, files, models)
+        index.reparsed = len(to_parse)
+        return index
+
+    @classmethod
+    def _cache_path(cls, cache_dir, sha):
+        return Path(cache_dir) / f"{sha}.json.gz"
+
+    @classmethod
+    def _read(cls, repo, cache_dir, sha, prefix):
+        path = cls._cache_path(cache_dir, sha)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as cached:
+                data = json.load(cached)
+        except (OSError, ValueError):
+            return None
+        if data.get("format") != cls.FORMAT or data.get("prefix") != prefix:
+            return None
+        return cls(repo, data["sha"], prefix, data["files"], data["models"])
+
+    @classmethod
+    def _latest(cls, repo, cache_dir, prefix):
+        cached = sorted(Path(cache_dir).glob("*.json.gz"), key=lambda path: path.stat().st_mtime, reverse=True)
+        for path in cached:
+            index = cls._read(repo, cache_dir, path.name.split(".")[0], prefix)
+            if index is not None:
+                return index
+        return None
+
+    @classmethod
+    def _prune(cls, cache_dir, keep):
+        cached = sorted(Path(cache_dir).glob("*.json.gz"), key=lambda path: path.stat().st_mtime, reverse=True)
+        for path in cached[max(1, keep):]:
+            path.unlink(missing_ok=True)
+
+    def _write(self, cache_dir):
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._cache_path(cache_dir, self.sha)
+        tmp = path.with_suffix(".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as output:
+            json.dump({
+                "format": self.FORMAT, "sha": self.sha, "prefix": self.prefix,
+                "files": self.files, "models": self.models,
+            }, output)
+        os.replace(tmp, path)
+
+    def callers(self) -> dict[str, list[dict]]:
+        """Function name -> functions calling it by name, across the indexed files."""
+        if self._callers is None:
+            self._callers = {}
+            for path, functions in self.files.items():
+                for function in functions:
+                    for name in function["calls"]:
+                        self._callers.setdefault(name, []).append(
+                            {"file": path, "function": function["name"], "line": function["start"]}
+                        )
+        return self._callers
+
+    def enclosing(self, path: str, line: int) -> list[dict]:
+        """Functions around `path:line`, outermost first."""
+        return [
+            function for function in self.files.get(path, [])
+            if function["start"] <= line <= function["end"]
+        ]
+
+    def context(self, path: str, line: int, max_lines: int = 80) -> dict | None:
+        """Prompt-ready context of `path:line`: enclosing functions, an excerpt, models and callers."""
+        chain = self.enclosing(path, line)
+        if not chain:
+            return None
+        # The largest enclosing function that still fits the excerpt budget.
+        shown = next((function for function in chain if function["end"] - function["start"] < max_lines), chain[-1])
+        start, end = shown["start"], shown["end"]
+        if end - start >= max_lines:
+            start, end = max(shown["start"], line - max_lines // 2), min(shown["end"], line + max_lines // 2)
+        try:
+            source = _git(self.repo, "show", f"{self.sha}:{f'{self.prefix}/' if self.prefix else ''}{path}")
+            lines = source.splitlines()[start - 1:end]
+        except RuntimeError:
+            lines = []
+        excerpt = "\n".join(
+            f"{'>' if number == line else ' '}{number:5d}  {text}" for number, text in enumerate(lines, start)
+        )
+
+        accessors = {accessor for function in chain for accessor in function["prismaAccessors"]}
+        models = {}
+        for name, model in self.models.items():
+            if _accessor(name) in accessors:
+                models[name] = model
+        for name in list(models):
+            for relation in models[name]["relations"]:
+                models.setdefault(relation["model"], self.models.get(relation["model"], {"fields": [], "relations": []}))
+
+        callers = []
+        named = [function for function in chain if not function["name"].startswith("<")]
+        if named:
+            callers = [
+                caller for caller in self.callers().get(named[-1]["name"], [])
+                if not (caller["file"] == path and caller["line"] == named[-1]["start"])
+            ]
+        return {
+            "commit": self.sha,
+            "file": path,
+            "line": line,
+            "functions": [
+                {"name": function["name"], "start": function["start"], "end": function["end"]} for function in chain
+            ],
+            "excerpt": excerpt,
+            "queriedModels": sorted(accessors & {_accessor(name) for name in self.models}),
+            "models": models,
+            "callers": callers[:10],
+        }
+
+
+def parse_location(text: str | None) -> tuple[str, int] | None:
+    """`(path, line)` of a stack frame or location: "at fn (src/index.ts:51:38)" -> ("src/index.ts", 51)."""
+    match = _LOCATION_RE.search(text or "")
+    return (match.group(1), int(match.group(2))) if match else None
+
+
+def candidate_contexts(index: CodeIndex, candidate: dict, max_lines: int = 80) -> list[dict]:
+    """Source context of a candidate's call site and, when it is elsewhere, of its hotspot."""
+    contexts = []
+    for location in (candidate.get("callSite"), (candidate.get("hotspot") or {}).get("location")):
+        parsed = parse_location(location)
+        if parsed is None:
+            continue
+        context = index.context(*parsed, max_lines=max_lines)
+        if context and all(context["functions"][-1] != seen["functions"][-1] for seen in contexts):
+            contexts.append(context)
+    return contexts
+
+
+def render_context(context: dict) -> str:
+    """Prompt text for one `CodeIndex.context`."""
+    chain = " > ".join(
+        f"{function['name']} (lines {function['start']}-{function['end']})" for function in context["functions"]
+    )
+    text = (
+        f"Source of {context['file']}:{context['line']} at commit {context['commit'][:12]}, inside {chain}:\n"
+        f"```\n{context['excerpt']}\n```\n"
+    )
+    if context["models"]:
+        text += "Prisma models involved (from prisma/schema.prisma):\n"
+        for name, model in context["models"].items():
+            relations = ", ".join(
+                f"{relation['field']} -> {relation['model']}{'[]' if relation['list'] else ''}"
+                + (f" via {', '.join(relation['foreignKey'])}" if relation["foreignKey"] else "")
+                for relation in model["relations"]
+            )
+            text += f"- {name}: {', '.join(model['fields'])}" + (f"; relations: {relations}" if relations else "") + "\n"
+    if context["callers"]:
+        text += "Called from: " + ", ".join(
+            f"{caller['function']} ({caller['file']}:{caller['line']})" for caller in context["callers"]
+        ) + "\n"
+    return text
+
+
+def _git(repo, *args) -> str:
+    result = subprocess.run(["git", "-C", str(repo), *args], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+    return result.stdout
+
+
+def _read_blobs(repo, blob_ids) -> list[str]:
+    """Contents of many blobs through one `git cat-file --batch` process."""
+    if not blob_ids:
+        return []
+    result = subprocess.run(
+        ["git", "-C", str(repo), "cat-file", "--batch"],
+        input="".join(f"{blob_id}\n" for blob_id in blob_ids).encode(),
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"git cat-file failed: {result.stderr.decode(errors='replace').strip()}")
+    output, pos, contents = result.stdout, 0, []
+    for _blob_id in blob_ids:
+        header_end = output.index(b"\n", pos)
+        size = int(output[pos:header_end].split()[2])
+        contents.append(output[header_end + 1:header_end + 1 + size].decode("utf-8", errors="replace"))
+        pos = header_end + 1 + size + 1
+    return contents
@@ -0,0 +1,70 @@
+import hashlib
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def queryset_validators(queryset, last_modified_field: str, *, vary: str = "") -> tuple[str, int | None]:
+    """Return an (ETag, Last-Modified timestamp) pair for a list queryset.
+
+    Uses a single aggregate query over the (filtered, possibly sliced) queryset, so
+    it stays cheap no matter how many rows would be serialized. The sum of primary keys
+    catches a row deleted inside a sliced window, where the next row slides in and
+    leaves the count and maxima unchanged. Sums of the nullable foreign keys catch
+    `on_delete=SET_NULL` cascades, which Django applies with an UPDATE that leaves the
+    timestamps alone.
+    """
+
+    if not queryset.query.is_sliced:
+        # Ordering does not change the aggregate; a sliced queryset needs it for the LIMIT.
+        queryset = queryset.order_by()
+    nullable_fks = [
+        field.attname for field in queryset.model._meta.concrete_fields if field.is_relation and field.null
+    ]
+    stats = queryset.aggregate(
+        row_count=Count("pk"),
+        max_id=Max("pk"),
+        id_sum=Sum("pk"),
+        last_modified=Max(last_modified_field),
+        **{f"fk_sum_{attname}": Sum(attname) for attname in nullable_fks},
+    )
+    last_modified = stats["last_modified"]
+    fingerprint = "|".join(
+        [
+            queryset.model._meta.label,
+            str(stats["row_count"]),
+            str(stats["max_id"]),
+            str(stats["id_sum"]),
+            *(str(stats[f"fk_sum_{attname}"]) for attname in nullable_fks),
+            last_modified.isoformat() if last_modified else "",
+            vary,
+        ]
+    )
+    etag = f'"{hashlib.sha1(fingerprint.encode()).hexdigest()}"'
+    return etag, int(last_modified.timestamp()) if last_modified else None
+
+
+class ConditionalListMixin:
+    """Answer list requests with `304 Not Modified` when nothing changed.
+
+    Set `last_modified_field` to the model's update (or creation) timestamp.
+    """
+
+    last_modified_field = "updated_at"
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        vary = f"{request.get_full_path()}|{request.headers.get('Accept', '')}"
+        etag, last_modified = queryset_validators(queryset, self.last_modified_field, vary=vary)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+        # Let browsers keep the body but always revalidate, instead of guessing freshness.
+        patch_cache_control(response, no_cache=True)
+        return response
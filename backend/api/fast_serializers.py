@@ -0,0 +1,155 @@
+import math
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+
+# Integers orjson can encode natively (signed 64-bit up to unsigned 64-bit).
+_MIN_INT = -(2**63)
+_MAX_INT = 2**64
+
+
+class FastRows(list):
+    """Serialized list rows, tagged with whether orjson reproduces the stdlib JSON bytes."""
+
+    def __init__(self, rows, orjson_safe: bool = False):
+        super().__init__(rows)
+        self.orjson_safe = orjson_safe
+
+
+def _orjson_safe(value) -> bool:
+    # orjson and json.dumps only agree on floats repr() writes without an exponent.
+    kind = type(value)
+    if kind is float:
+        return value == 0.0 or (math.isfinite(value) and 1e-4 <= abs(value) < 1e16)
+    if kind is int:
+        return _MIN_INT <= value < _MAX_INT
+    if kind is dict:
+        return all(_orjson_safe(v) for v in value.values())
+    if kind is list:
+        return all(_orjson_safe(v) for v in value)
+    return True
+
+
+def _iso_datetime(value, tz):
+    # DateTimeField.to_representation for aware values, minus the per-value timezone lookup.
+    value = value.astimezone(tz).isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+class RowMapper:
+    """Compiled `values_list()` rows -> dicts mapper equivalent to a ModelSerializer's output."""
+
+    def __init__(self, columns, map_rows, checked_indexes):
+        self.columns = columns
+        self.map_rows = map_rows
+        self.checked_indexes = checked_indexes
+
+    def serialize(self, queryset) -> FastRows:
+        rows = list(queryset.values_list(*self.columns))
+        data = self.map_rows(rows, timezone.get_current_timezone())
+        checked = self.checked_indexes
+        safe = all(_orjson_safe(row[i]) for row in rows for i in checked)
+        return FastRows(data, orjson_safe=safe)
+
+
+def _column_for(model, field):
+    """Return (column, converter) for a serializer field, or None if it needs an instance."""
+
+    if "." in field.source or field.source == "*":
+        return None
+    try:
+        model_field = model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        return None
+
+    if isinstance(field, PrimaryKeyRelatedField):
+        if field.pk_field is not None or not model_field.many_to_one:
+            return None
+        return model_field.attname, None
+    if model_field.is_relation:
+        return None
+
+    # These hand database values back unchanged, so skip the per-value call.
+    if isinstance(field, serializers.ChoiceField):
+        if all(isinstance(key, str) for key in field.choice_strings_to_values.values()):
+            return model_field.attname, None
+    elif isinstance(field, (serializers.CharField, serializers.IntegerField, serializers.BooleanField)):
+        return model_field.attname, None
+    elif isinstance(field, serializers.JSONField) and not field.binary:
+        return model_field.attname, None
+    elif isinstance(field, serializers.FloatField):
+        return model_field.attname, float
+    elif (
+        isinstance(field, serializers.DateTimeField)
+        and settings.USE_TZ
+        and not hasattr(field, "timezone")
+        and str(getattr(field, "format", api_settings.DATETIME_FORMAT)).lower() == ISO_8601
+    ):
+        return model_field.attname, _iso_datetime
+
+    return model_field.attname, field.to_representation
+
+
+_mappers = {}
+
+
+def get_row_mapper(serializer_class):
+    """Compile (once per serializer class) a row mapper, or return None if unsupported."""
+
+    if serializer_class in _mappers:
+        return _mappers[serializer_class]
+
+    serializer = serializer_class()
+    model = serializer.Meta.model
+    columns, items, namespace, checked = [], [], {}, []
+    mapper = None
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        resolved = _column_for(model, field)
+        if resolved is None:
+            break
+        column, converter = resolved
+        index = len(columns)
+        columns.append(column)
+        if converter is None:
+            items.append(f"{name!r}: row[{index}]")
+        elif converter is _iso_datetime:
+            namespace["iso"] = converter
+            items.append(f"{name!r}: None if row[{index}] is None else iso(row[{index}], tz)")
+        else:
+            namespace[f"c{index}"] = converter
+            items.append(f"{name!r}: None if row[{index}] is None else c{index}(row[{index}])")
+        if isinstance(field, (serializers.FloatField, serializers.JSONField)):
+            checked.append(index)
+    else:
+        source = "def map_rows(rows, tz):\n    return [{" + ", ".join(items) + "} for row in rows]\n"
+        exec(compile(source, f"<row mapper {serializer_class.__name__}>", "exec"), namespace)
+        mapper = RowMapper(tuple(columns), namespace["map_rows"], tuple(checked))
+
+    _mappers[serializer_class] = mapper
+    return mapper
+
+
+class FastListMixin:
+    """Serve list responses from `values_list()` tuples instead of model instances.
+
+    Falls back to the regular serializer path for serializers with fields that need a
+    model instance (method fields, nested relations, dotted sources) and when paginating.
+    """
+
+    def list(self, request, *args, **kwargs):
+        mapper = get_row_mapper(self.get_serializer_class())
+        if mapper is None or self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(mapper.serialize(queryset))
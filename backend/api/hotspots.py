@@ -0,0 +1,179 @@
+import re
+
+from .spans import SpanTree, span_tags
+
+
+STACKTRACE = "code.stacktrace"
+
+# "at fn (file:line:col)" or "at file:line:col", as V8 prints them.
+_FRAME_RE = re.compile(r"at (?:(.+?) \()?(.+?):(\d+):\d+\)?\s*$")
+
+
+def parse_frame(line: str) -> tuple[str, str] | None:
+    """`(function, "file:line")` of one stack trace line, or None if it is not a code frame."""
+    match = _FRAME_RE.search(line.strip())
+    if not match:
+        return None
+    function, path, line_number = match.groups()
+    return function or "<anonymous>", f"{path}:{line_number}"
+
+
+def stack_latency(tree: SpanTree) -> dict[str, int]:
+    """Critical-path microseconds of a trace per `code.stacktrace`.
+
+    Each span's share of the critical path goes to the stack of the nearest
+    ancestor-or-self span that carries one, so time spent in uninstrumented
+    children (engine and driver spans) counts toward the code that started them.
+    """
+
+    latency = {}
+    owners = {}  # span id -> stack trace it reports under
+    for span_id, micros in tree.critical_path().items():
+        path = []
+        current, stack = span_id, None
+        while current is not None:
+            if current in owners:
+                stack = owners[current]
+                break
+            path.append(current)
+            stack = span_tags(tree.spans[current]).get(STACKTRACE)
+            if stack:
+                break
+            current = tree.parents.get(current)
+        for visited in path:
+            owners[visited] = stack
+        if stack and micros:
+            latency[stack] = latency.get(stack, 0) + micros
+    return latency
+
+
+class HotspotTree:
+    """Flame-graph style prefix tree of latency per call stack.
+
+    Frames are interned to ints and each node stores its frame and children by frame
+    id, so many traces sharing the same stacks cost one node per distinct prefix.
+    Inclusive time is everything spent at or below a node; exclusive time is what was
+    spent with that node's frame on top of the stack.
+    """
+
+    def __init__(self):
+        self.frames = []  # frame id -> (function, location)
+        self._frame_ids = {}
+        self._stacks = {}  # code.stacktrace string -> tuple of frame ids, outermost first
+        # Node 0 is the synthetic root; node ids index these parallel lists.
+        self._node_frame = [-1]
+        self._children = [{}]
+        self._inclusive = [0.0]
+        self._exclusive = [0.0]
+
+    def _intern(self, stacktrace: str) -> tuple[int, ...]:
+        stack = self._stacks.get(stacktrace)
+        if stack is None:
+            frame_ids = []
+            # Stack traces list the innermost frame first.
+            for line in reversed(stacktrace.splitlines()):
+                frame = parse_frame(line)
+                if frame is None:
+                    continue
+                if frame not in self._frame_ids:
+                    self._frame_ids[frame] = len(self.frames)
+                    self.frames.append(frame)
+                frame_ids.append(self._frame_ids[frame])
+            stack = self._stacks[stacktrace] = tuple(frame_ids)
+        return stack
+
+    def add(self, stacktrace: str, micros: float, weight: float = 1):
+        stack = self._intern(stacktrace)
+        if not stack:
+            return
+        micros *= weight
+        node = 0
+        self._inclusive[0] += micros
+        for frame_id in stack:
+            child = self._children[node].get(frame_id)
+            if child is None:
+                child = self._children[node][frame_id] = len(self._node_frame)
+                self._node_frame.append(frame_id)
+                self._children.append({})
+                self._inclusive.append(0.0)
+                self._exclusive.append(0.0)
+            node = child
+            self._inclusive[node] += micros
+        self._exclusive[node] += micros
+
+    def add_trace(self, tree: SpanTree, weight: float = 1):
+        for stacktrace, micros in stack_latency(tree).items():
+            self.add(stacktrace, micros, weight)
+
+    @property
+    def total_micros(self) -> float:
+        return self._inclusive[0]
+
+    def frame_totals(self) -> list[dict]:
+        """Inclusive and exclusive microseconds per frame across all stacks.
+
+        A frame that recurses is counted once per stack for inclusive time.
+        """
+
+        inclusive = [0.0] * len(self.frames)
+        exclusive = [0.0] * len(self.frames)
+        pending = [(child, frozenset()) for child in self._children[0].values()]
+        while pending:
+            node, on_stack = pending.pop()
+            frame_id = self._node_frame[node]
+            exclusive[frame_id] += self._exclusive[node]
+            if frame_id not in on_stack:
+                inclusive[frame_id] += self._inclusive[node]
+                on_stack = on_stack | {frame_id}
+            pending.extend((child, on_stack) for child in self._children[node].values())
+        return [
+            {
+                "function": function,
+                "location": location,
+                "inclusiveMicros": inclusive[frame_id],
+                "exclusiveMicros": exclusive[frame_id],
+            }
+            for frame_id, (function, location) in enumerate(self.frames)
+        ]
+
+    def top_inclusive(self, limit: int = 10) -> list[dict]:
+        return sorted(self.frame_totals(), key=lambda frame: frame["inclusiveMicros"], reverse=True)[:limit]
+
+    def top_exclusive(self, limit: int = 10) -> list[dict]:
+        return sorted(self.frame_totals(), key=lambda frame: frame["exclusiveMicros"], reverse=True)[:limit]
+
+    def dominant_frame(self) -> dict | None:
+        """The frame with the most exclusive time: the function the latency is actually spent in."""
+        top = self.top_exclusive(1)
+        return top[0] if top and top[0]["exclusiveMicros"] > 0 else None
+
+    def render(self, min_fraction: float = 0.05, max_lines: int = 30) -> str:
+        """Indented call tree of the stacks holding at least `min_fraction` of the time, hottest first."""
+        total = self.total_micros
+        if not total:
+            return ""
+        lines = []
+        pending = [(child, 0) for child in sorted(
+            self._children[0].values(), key=lambda child: self._inclusive[child])]
+        while pending and len(lines) < max_lines:
+            node, depth = pending.pop()
+            inclusive = self._inclusive[node]
+            if inclusive < total * min_fraction:
+                continue
+            function, location = self.frames[self._node_frame[node]]
+            lines.append(
+                f"{'  ' * depth}{function} ({location}) "
+                f"{inclusive / 1000:.1f} ms total, {self._exclusive[node] / 1000:.1f} ms self "
+                f"({inclusive / total:.0%})"
+            )
+            pending.extend((child, depth + 1) for child in sorted(
+                self._children[node].values(), key=lambda child: self._inclusive[child]))
+        return "\n".join(lines)
+
+    def summary(self, limit: int = 10) -> dict:
+        return {
+            "totalMicros": self.total_micros,
+            "dominantFrame": self.dominant_frame(),
+            "topInclusive": self.top_inclusive(limit),
+            "topExclusive": self.top_exclusive(limit),
+        }
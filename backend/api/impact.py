@@ -0,0 +1,61 @@
+import heapq
+
+
+class CallSiteImpact:
+    """Running impact totals for one call site across the slow traces of a run.
+
+    `add` is O(log max_examples) and keeps only the worst example traces plus the
+    single most representative incident, so memory stays flat however many traces
+    hit the call site.
+    """
+
+    def __init__(self, call_site: str, max_examples: int = 5):
+        self.call_site = call_site
+        self.max_examples = max_examples
+        self.sampled_occurrences = 0
+        self.occurrences = 0
+        self.total_added_micros = 0
+        self.routes = {}
+        self.incident = None
+        self.trace_id = None
+        self._rank = None
+        self._examples = []  # min-heap of (added_micros, trace_id)
+
+    def add(self, trace_id: str, incident: dict, added_micros: int, rank=None, weight: float = 1):
+        """Count one analyzed trace; `weight` is how many traces it stands for after sampling."""
+        self.sampled_occurrences += 1
+        self.occurrences += weight
+        self.total_added_micros += added_micros * weight
+        route = incident.get("httpTarget") or "unknown"
+        self.routes[route] = self.routes.get(route, 0) + weight
+
+        example = (added_micros, trace_id)
+        if len(self._examples) < self.max_examples:
+            heapq.heappush(self._examples, example)
+        elif example > self._examples[0]:
+            heapq.heapreplace(self._examples, example)
+
+        rank = (added_micros,) if rank is None else rank
+        if self._rank is None or rank > self._rank:
+            self.incident, self.trace_id, self._rank = incident, trace_id, rank
+
+    @property
+    def mean_added_micros(self) -> float:
+        return self.total_added_micros / self.occurrences if self.occurrences else 0.0
+
+    def example_trace_ids(self) -> list[str]:
+        return [trace_id for _added, trace_id in sorted(self._examples, reverse=True)]
+
+    def affected_routes(self) -> list[str]:
+        return sorted(self.routes, key=lambda route: (-self.routes[route], route))
+
+    def summary(self) -> dict:
+        return {
+            "callSite": self.call_site,
+            "occurrences": self.occurrences,
+            "sampledOccurrences": self.sampled_occurrences,
+            "totalAddedMicros": self.total_added_micros,
+            "meanAddedMicros": self.mean_added_micros,
+            "exampleTraceIds": self.example_trace_ids(),
+            "affectedRoutes": self.affected_routes(),
+        }
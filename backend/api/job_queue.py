@@ -0,0 +1,169 @@
+import os
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AgentJob, DetectionRun, RunCandidate
+from .stats import invalidate_stats
+
+# Jobs a worker may still pick up (again).
+OUTSTANDING_STATUSES = ("queued", "running")
+
+
+def queue_enabled() -> bool:
+    """AGENT_QUEUE=db hands agent sessions to `run_agent_worker` processes instead of running them inline."""
+    return os.getenv("AGENT_QUEUE", "").strip().lower() == "db"
+
+
+def enqueue(detection_run, run_id: str, group_index: int, candidates: list[dict], prompt: str, benchmark_env: dict) -> AgentJob:
+    return AgentJob.objects.create(
+        detectionRun=detection_run,
+        runId=run_id,
+        groupIndex=group_index,
+        candidates=candidates,
+        prompt=prompt,
+        benchmarkEnv=benchmark_env,
+        maxAttempts=int(os.getenv("AGENT_JOB_MAX_ATTEMPTS", "3")),
+    )
+
+
+def _claimable(now):
+    # Queued jobs, and running ones whose worker stopped renewing its lease.
+    return AgentJob.objects.filter(
+        Q(status="queued") | Q(status="running", leaseExpiresAt__lt=now),
+        attempts__lt=F("maxAttempts"),
+    ).order_by("id")
+
+
+def claim(worker_id: str, lease_seconds: float) -> AgentJob | None:
+    """Lease the oldest claimable job to `worker_id`, or None when there is nothing to do.
+
+    Uses `SELECT ... FOR UPDATE SKIP LOCKED` where the database supports it, so workers
+    never wait on each other's rows. Elsewhere (SQLite) the claim is a conditional
+    UPDATE on the row's previous lease; losing that race just moves on to the next row.
+    """
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = _claimable(timezone.now()).select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            _lease(job, worker_id, lease_seconds)
+            job.save(update_fields=["status", "attempts", "leaseOwner", "leaseExpiresAt", "heartbeatAt", "updated_at"])
+            return job
+
+    for job in _claimable(timezone.now())[:20]:
+        previous = {"status": job.status, "leaseOwner": job.leaseOwner, "leaseExpiresAt": job.leaseExpiresAt}
+        _lease(job, worker_id, lease_seconds)
+        updated = AgentJob.objects.filter(id=job.id, attempts=job.attempts - 1, **previous).update(
+            status=job.status,
+            attempts=job.attempts,
+            leaseOwner=job.leaseOwner,
+            leaseExpiresAt=job.leaseExpiresAt,
+            heartbeatAt=job.heartbeatAt,
+            updated_at=job.heartbeatAt,
+        )
+        if updated:
+            return job
+    return None
+
+
+def _lease(job: AgentJob, worker_id: str, lease_seconds: float):
+    now = timezone.now()
+    job.status = "running"
+    job.attempts += 1
+    job.leaseOwner = worker_id
+    job.leaseExpiresAt = now + timedelta(seconds=lease_seconds)
+    job.heartbeatAt = now
+
+
+def heartbeat(job: AgentJob, worker_id: str, lease_seconds: float) -> bool:
+    """Extend the lease; False when the worker no longer holds it (it expired and was re-claimed)."""
+    now = timezone.now()
+    return bool(
+        AgentJob.objects.filter(id=job.id, status="running", leaseOwner=worker_id, attempts=job.attempts).update(
+            leaseExpiresAt=now + timedelta(seconds=lease_seconds), heartbeatAt=now, updated_at=now
+        )
+    )
+
+
+def record_session(job: AgentJob, session):
+    """Keep the `generate_pr` result of a job's agent session, whoever holds the lease now.
+
+    Once the session pushed a branch and opened a PR it must not run again: a later
+    attempt adopts this result instead.
+    """
+    job.result = {**(job.result or {}), "session": session}
+    AgentJob.objects.filter(id=job.id).update(result=job.result, updated_at=timezone.now())
+
+
+def finish(job: AgentJob, worker_id: str, result: dict | None = None, error: str = "", retry: bool = True) -> str | None:
+    """Record the outcome of a claimed job; returns its new status, or None when the lease was lost.
+
+    A failed attempt is queued again until `maxAttempts` is reached (never without `retry`).
+    Without `result` the job keeps the one it has (e.g. its recorded session).
+    """
+    if error:
+        status = "queued" if retry and job.attempts < job.maxAttempts else "failed"
+    else:
+        status = "done"
+    fields = {
+        "status": status,
+        "errorMessage": error[:4000],
+        "leaseOwner": "",
+        "leaseExpiresAt": None,
+        "updated_at": timezone.now(),
+    }
+    if result is not None:
+        fields["result"] = result
+    updated = AgentJob.objects.filter(id=job.id, status="running", leaseOwner=worker_id, attempts=job.attempts).update(
+        **fields
+    )
+    if not updated:
+        return None
+    job.status = status
+    return status
+
+
+def outstanding_jobs(detection_run_id: int):
+    return AgentJob.objects.filter(detectionRun_id=detection_run_id, status__in=OUTSTANDING_STATUSES)
+
+
+def settle_run(detection_run_id: int | None) -> str | None:
+    """Finish a "queued" DetectionRun once none of its agent jobs is outstanding.
+
+    Called by the detection itself when it is done dispatching and by workers after every
+    job, so whichever comes last finishes the run. The status is set with a conditional
+    UPDATE, so it happens once. Returns the run's final status, or None.
+    """
+    if detection_run_id is None or outstanding_jobs(detection_run_id).exists():
+        return None
+    cancel_requested = DetectionRun.objects.filter(id=detection_run_id).values_list("cancelRequested", flat=True).first()
+    failed = RunCandidate.objects.filter(detectionRun_id=detection_run_id, status="failed").count()
+    if cancel_requested:
+        run_status, message = "cancelled", "Cancelled while agent jobs were queued."
+    elif failed:
+        run_status, message = "partial", f"{failed} candidate(s) failed; resume the run to retry them."
+    else:
+        run_status, message = "success", ""
+    updated = DetectionRun.objects.filter(id=detection_run_id, status="queued").update(
+        status=run_status, errorMessage=message, updated_at=timezone.now(),
+    )
+    if not updated:
+        return None
+    invalidate_stats()
+    return run_status
+
+
+def expire_abandoned() -> list[AgentJob]:
+    """Fail running jobs whose lease expired on their last allowed attempt."""
+    jobs = list(
+        AgentJob.objects.filter(status="running", leaseExpiresAt__lt=timezone.now(), attempts__gte=F("maxAttempts"))
+    )
+    for job in jobs:
+        updated = AgentJob.objects.filter(id=job.id, status="running", leaseOwner=job.leaseOwner).update(
+            status="failed", errorMessage="Lease expired on the last attempt.", leaseOwner="", updated_at=timezone.now()
+        )
+        job.status = "failed" if updated else job.status
+    return [job for job in jobs if job.status == "failed"]
@@ -0,0 +1,97 @@
+import math
+
+
+class LatencySketch:
+    """Mergeable quantile sketch with bounded relative error (DDSketch-style).
+
+    Values land in logarithmic bins `ceil(log_gamma(v))`, so `add` is O(1) and any
+    quantile is within `relative_accuracy` of the true value. Sketches with the same
+    accuracy merge by summing bin counts. When more than `max_bins` bins exist the
+    lowest ones are collapsed, which only costs accuracy at the fast end.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float, weight: float = 1):
+        if value is None:
+            return
+        if value < 1:
+            self.zero_count += weight
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + weight
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        self.count += weight
+        self.sum += value * weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "LatencySketch"):
+        if other.count == 0:
+            return
+        if not math.isclose(other.gamma, self.gamma):
+            raise ValueError("Cannot merge sketches with different relative accuracy.")
+        for key, weight in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + weight
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def _collapse(self):
+        keys = sorted(self.bins)
+        overflow = keys[: len(keys) - self.max_bins + 1]
+        target = keys[len(keys) - self.max_bins]
+        self.bins[target] = sum(self.bins.pop(key) for key in overflow)
+
+    def quantile(self, q: float) -> float | None:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                estimate = 2 * self.gamma**key / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "relativeAccuracy": self.relative_accuracy,
+            "maxBins": self.max_bins,
+            "bins": {str(key): weight for key, weight in self.bins.items()},
+            "zeroCount": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict | None) -> "LatencySketch":
+        data = data or {}
+        sketch = cls(data.get("relativeAccuracy", 0.01), data.get("maxBins", 2048))
+        sketch.bins = {int(key): weight for key, weight in (data.get("bins") or {}).items()}
+        sketch.zero_count = data.get("zeroCount", 0)
+        sketch.count = data.get("count", 0)
+        sketch.sum = data.get("sum", 0.0)
+        sketch.min = data.get("min")
+        sketch.max = data.get("max")
+        return sketch
@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from collections import deque
+
+from .analysis import analyze_trace, call_site_latency, incident_call_site, incident_rank
+from .baselines import REQUEST, record_latency
+from .hotspots import HotspotTree, stack_latency
+from .impact import CallSiteImpact
+from .models import LatencyBaseline
+from .spans import SpanTree, span_tags, trace_route
+
+
+class LiveTraceAnalyzer:
+    """Assembles spans pushed over OTLP into traces and keeps per-call-site aggregates current.
+
+    Spans are buffered per trace. A trace is complete once its root span arrived and no
+    span came in for `settle_seconds`, or `max_wait_seconds` after its first span either
+    way. Completed traces are analyzed right away (the same per-trace analysis
+    `detect_incidents` runs) and folded into `impacts`, then queued for the next detection
+    run with `TRACE_SOURCE=live`.
+
+    State lives in this process: run the receiver in the process that runs detection
+    (the runserver scheduler thread does) or point exporters at a single instance.
+    """
+
+    def __init__(
+        self,
+        settle_seconds: float = 2.0,
+        max_wait_seconds: float = 60.0,
+        max_pending_traces: int = 10_000,
+        max_queued_traces: int = 50_000,
+        clock=time.monotonic,
+    ):
+        self.settle_seconds = settle_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.max_pending_traces = max_pending_traces
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pending = {}  # traceID -> {"service", "spans", "first", "last", "hasRoot"}
+        self._queued = deque(maxlen=max_queued_traces)
+        self.impacts = {}
+        self.hotspots = HotspotTree()
+        self.sketches = {}
+        self.counters = {"spans": 0, "traces": 0, "analyzed": 0, "candidates": 0, "evicted": 0}
+        self._baselines = {}
+        self._baselines_loaded_at = None
+
+    @classmethod
+    def from_env(cls) -> "LiveTraceAnalyzer":
+        return cls(
+            settle_seconds=float(os.getenv("LIVE_TRACE_SETTLE_SECONDS", "2")),
+            max_wait_seconds=float(os.getenv("LIVE_TRACE_MAX_WAIT_SECONDS", "60")),
+            max_pending_traces=int(os.getenv("LIVE_MAX_PENDING_TRACES", "10000")),
+            max_queued_traces=int(os.getenv("LIVE_MAX_QUEUED_TRACES", "50000")),
+        )
+
+    def add_spans(self, items):
+        """Buffer `(service_name, span)` pairs, then analyze whatever traces completed."""
+        now = self.clock()
+        with self._lock:
+            for service, span in items:
+                pending = self._pending.get(span["traceID"])
+                if pending is None:
+                    pending = self._pending[span["traceID"]] = {
+                        "service": service, "spans": {}, "first": now, "last": now, "hasRoot": False,
+                    }
+                pending["spans"][span["spanID"]] = span
+                pending["last"] = now
+                pending["hasRoot"] = pending["hasRoot"] or not span.get("references")
+                self.counters["spans"] += 1
+        self.settle()
+
+    def settle(self) -> int:
+        """Analyze completed (or overdue, or evicted) traces. Returns how many were finished."""
+        now = self.clock()
+        with self._lock:
+            done = [
+                trace_id for trace_id, pending in self._pending.items()
+                if (pending["hasRoot"] and now - pending["last"] >= self.settle_seconds)
+                or now - pending["first"] >= self.max_wait_seconds
+            ]
+            overflow = len(self._pending) - len(done) - self.max_pending_traces
+            if overflow > 0:
+                finishing = set(done)
+                oldest = sorted(
+                    (trace_id for trace_id in self._pending if trace_id not in finishing),
+                    key=lambda trace_id: self._pending[trace_id]["first"],
+                )[:overflow]
+                done.extend(oldest)
+                self.counters["evicted"] += len(oldest)
+            finished = [(trace_id, self._pending.pop(trace_id)) for trace_id in done]
+
+        for trace_id, pending in finished:
+            trace = {
+                "traceID": trace_id,
+                "spans": list(pending["spans"].values()),
+                "processes": {f"p-{pending['service']}": {"serviceName": pending["service"]}},
+            }
+            self._analyze(pending["service"], trace)
+        return len(finished)
+
+    def _route_baseline(self, route):
+        # Refreshed once a minute so request handling does not query baselines per trace.
+        now = self.clock()
+        if self._baselines_loaded_at is None or now - self._baselines_loaded_at >= 60:
+            self._baselines = {
+                row["route"]: row
+                for row in LatencyBaseline.objects.filter(callSite=REQUEST).values("route", "p95", "count")
+            }
+            self._baselines_loaded_at = now
+        return self._baselines.get(route)
+
+    def _is_slow(self, route, duration):
+        baseline = self._route_baseline(route)
+        if baseline and baseline["p95"] and baseline["count"] >= int(os.getenv("LATENCY_MIN_SAMPLES", "10")):
+            return duration > baseline["p95"] * (1 + float(os.getenv("LATENCY_REGRESSION_TOLERANCE", "0.2")))
+        return duration >= float(os.getenv("LATENCY_COLD_START_THRESHOLD_MS", "2000")) * 1000
+
+    def _analyze(self, service, trace):
+        tree = SpanTree(trace["spans"])
+        call_operations = {
+            span_id: span for span_id, span in tree.spans.items()
+            if span.get("operationName") == "prisma:call-operation"
+        }
+        route = trace_route(tree)
+
+        candidate = None
+        stacks = {}
+        if call_operations:
+            duration = tree.duration
+            if self._is_slow(route, duration):
+                candidate = analyze_trace(
+                    trace, tree, call_operations, route,
+                    n_plus_one_min_repeats=int(os.getenv("N_PLUS_ONE_MIN_REPEATS", "3")),
+                )
+                stacks = stack_latency(tree)
+
+        with self._lock:
+            self.counters["traces"] += 1
+            self._queued.append((service, trace))
+            if not call_operations:
+                return
+            self.counters["analyzed"] += 1
+            record_latency(self.sketches, route, REQUEST, tree.duration)
+            for span in call_operations.values():
+                call_site = span_tags(span).get("prisma.frame")
+                if call_site:
+                    record_latency(self.sketches, route, call_site, span.get("duration") or 0)
+            if candidate is None:
+                return
+            self.counters["candidates"] += 1
+            for stacktrace, micros in stacks.items():
+                self.hotspots.add(stacktrace, micros)
+            key = incident_call_site(candidate)
+            if key not in self.impacts:
+                self.impacts[key] = CallSiteImpact(key)
+            self.impacts[key].add(trace["traceID"], candidate, call_site_latency(candidate), rank=incident_rank(candidate))
+
+    def take_traces(self) -> list[tuple[str, dict]]:
+        """Hand the completed traces queued since the last call to a detection run."""
+        self.settle()
+        with self._lock:
+            traces = list(self._queued)
+            self._queued.clear()
+        return traces
+
+    def snapshot(self, limit: int = 50) -> dict:
+        self.settle()
+        with self._lock:
+            impacts = sorted(self.impacts.values(), key=lambda impact: impact.total_added_micros, reverse=True)
+            routes = {}
+            for (route, call_site), sketch in self.sketches.items():
+                if call_site == REQUEST:
+                    routes[route] = {
+                        "count": sketch.count,
+                        "p50": sketch.quantile(0.5),
+                        "p95": sketch.quantile(0.95),
+                        "p99": sketch.quantile(0.99),
+                    }
+            return {
+                **self.counters,
+                "pendingTraces": len(self._pending),
+                "queuedTraces": len(self._queued),
+                "callSites": [impact.summary() for impact in impacts[:limit]],
+                "routes": routes,
+                "hotspots": self.hotspots.summary(10),
+            }
+
+
+live_analyzer = LiveTraceAnalyzer.from_env()
@@ -0,0 +1,82 @@
+import json
+import time
+
+from .models import DetectionRun, Log
+from .serializers import LogSerializer
+
+
+POLL_INTERVAL_SECONDS = 0.5
+HEARTBEAT_INTERVAL_SECONDS = 15.0
+# Clients reconnect with Last-Event-ID, so capping a single stream is cheap.
+MAX_STREAM_SECONDS = 15 * 60
+BATCH_SIZE = 200
+
+
+def format_event(data, *, event: str | None = None, event_id: int | None = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    lines.append(f"data: {payload}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _run_status(run_id: str) -> str | None:
+    return (
+        DetectionRun.objects.filter(runId=run_id)
+        .order_by("-id")
+        .values_list("status", flat=True)
+        .first()
+    )
+
+
+def stream_run_logs(
+    run_id: str,
+    last_event_id: int = 0,
+    *,
+    poll_interval: float = POLL_INTERVAL_SECONDS,
+    heartbeat_interval: float = HEARTBEAT_INTERVAL_SECONDS,
+    max_seconds: float = MAX_STREAM_SECONDS,
+):
+    """Yield SSE frames for Log rows of `run_id` with an id above `last_event_id`.
+
+    The stream ends with an `end` event once the tracking DetectionRun is no longer
+    running. Runs without a DetectionRun row are replayed once and closed.
+    """
+
+    started = time.monotonic()
+    last_frame = started
+    last_id = last_event_id
+
+    yield f"retry: {int(poll_interval * 4000)}\n\n"
+
+    while True:
+        # Read the status before the rows so nothing written before completion is missed.
+        status = _run_status(run_id)
+        rows = list(
+            Log.objects.filter(run_id=run_id, id__gt=last_id).order_by("id")[:BATCH_SIZE]
+        )
+        for row in rows:
+            last_id = row.id
+            yield format_event(LogSerializer(row).data, event="log", event_id=row.id)
+
+        now = time.monotonic()
+        if rows:
+            last_frame = now
+            if len(rows) == BATCH_SIZE:
+                continue
+
+        if status != "running":
+            yield format_event({"run_id": run_id, "status": status}, event="end", event_id=last_id or None)
+            return
+
+        if now - started >= max_seconds:
+            return
+
+        if now - last_frame >= heartbeat_interval:
+            last_frame = now
+            yield ": heartbeat\n\n"
+
+        time.sleep(poll_interval)
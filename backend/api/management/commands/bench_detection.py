@@ -0,0 +1,168 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import DeferredCandidate
+from api.synthetic import generate_traces
+from api.views import detect_incidents
+
+
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+_WRITE_TABLE_RE = re.compile(r'^\s*(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+"?(\w+)"?', re.I)
+
+# A real (non-dry) run that never reaches the agent: every candidate is carried over, and
+# without GITHUB_LINK no workspaces are warmed. All of its writes are rolled back.
+BENCH_ENV = {"AGENT_MAX_SESSIONS_PER_RUN": "0", "AGENT_QUEUE": "", "GITHUB_LINK": ""}
+
+
+class _Rollback(Exception):
+    pass
+
+
+class _WriteCounter:
+    def __init__(self):
+        self.writes = 0
+        self.by_table = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+            count = len(params) if many and params is not None else 1
+            self.writes += count
+            match = _WRITE_TABLE_RE.match(sql)
+            table = match.group(1) if match else "?"
+            self.by_table[table] = self.by_table.get(table, 0) + count
+        return execute(sql, params, many, context)
+
+
+@contextlib.contextmanager
+def _environ(values):
+    previous = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark detect_incidents on synthetic Jaeger traces: spans/s, peak traced memory and "
+        "database write statements per size. Runs with no agent sessions (every candidate is "
+        "carried over) inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--spans", default="1000,10000,100000,1000000", help="Comma-separated span counts.")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--skip-memory", action="store_true", help="Skip the (slower) tracemalloc pass.")
+        parser.add_argument("--output", help="Write the results as JSON to this path.")
+        parser.add_argument("--baseline", help="Compare against results previously written with --output.")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed relative throughput drop / memory and write growth before failing.",
+        )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options["spans"].split(",") if size.strip()]
+        results = []
+        for size in sizes:
+            traces = list(generate_traces(size, seed=options["seed"]))
+            span_count = sum(len(trace["spans"]) for _service, trace in traces)
+            best, counter, candidates = None, None, 0
+            for _ in range(options["repeat"]):
+                elapsed, counter, candidates = self._run(traces)
+                best = elapsed if best is None else min(best, elapsed)
+            peak = None
+            if not options["skip_memory"]:
+                tracemalloc.start()
+                try:
+                    self._run(traces)
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+
+            result = {
+                "spans": span_count,
+                "traces": len(traces),
+                "seconds": round(best, 4),
+                "spansPerSecond": round(span_count / best),
+                "peakTracedBytes": peak,
+                "dbWrites": counter.writes,
+                "dbWritesByTable": dict(sorted(counter.by_table.items())),
+                "candidates": candidates,
+            }
+            results.append(result)
+            self.stdout.write(
+                f"{span_count:>9} spans {len(traces):>7} traces  {best * 1000:9.1f} ms  "
+                f"{result['spansPerSecond']:>9} spans/s  "
+                f"peak {'-' if peak is None else f'{peak / 1e6:8.1f} MB'}  "
+                f"{counter.writes:>5} writes  {candidates} candidates"
+            )
+
+        report = {
+            "recordedAt": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()}",
+            "results": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output:
+                json.dump(report, output, indent=2)
+                output.write("\n")
+        if options["baseline"]:
+            self._compare(results, options["baseline"], options["tolerance"])
+
+    def _run(self, traces):
+        counter = _WriteCounter()
+        candidates = 0
+        started = time.perf_counter()
+        try:
+            with _environ(BENCH_ENV), transaction.atomic(), connection.execute_wrapper(counter), \
+                    contextlib.redirect_stdout(io.StringIO()):
+                # Not a dry run, so baseline, post-merge and carry-over writes are measured too.
+                detect_incidents(run_id="bench", traces=iter(traces))
+                candidates = DeferredCandidate.objects.filter(runId="bench").count()
+                raise _Rollback
+        except _Rollback:
+            pass
+        return time.perf_counter() - started, counter, candidates
+
+    def _compare(self, results, path, tolerance):
+        with open(path, encoding="utf-8") as baseline_file:
+            baseline = {row["spans"]: row for row in json.load(baseline_file)["results"]}
+
+        regressions = []
+        for result in results:
+            before = baseline.get(result["spans"])
+            if before is None:
+                continue
+            if result["spansPerSecond"] < before["spansPerSecond"] * (1 - tolerance):
+                regressions.append(f"{result['spans']} spans: {before['spansPerSecond']} -> {result['spansPerSecond']} spans/s")
+            if result["peakTracedBytes"] and before.get("peakTracedBytes") and (
+                result["peakTracedBytes"] > before["peakTracedBytes"] * (1 + tolerance)
+            ):
+                regressions.append(
+                    f"{result['spans']} spans: peak {before['peakTracedBytes']} -> {result['peakTracedBytes']} bytes"
+                )
+            if result["dbWrites"] > before["dbWrites"] * (1 + tolerance):
+                regressions.append(f"{result['spans']} spans: {before['dbWrites']} -> {result['dbWrites']} writes")
+
+        if regressions:
+            raise CommandError("Performance regressed against baseline:\n  " + "\n  ".join(regressions))
+        self.stdout.write(f"No regressions against {path} (tolerance {tolerance:.0%}).")
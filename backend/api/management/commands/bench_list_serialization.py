@@ -0,0 +1,122 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.fast_serializers import get_row_mapper
+from api.models import DetectionRun, Incident, Log
+from api.renderers import FastJSONRenderer
+from api.serializers import DetectionRunSerializer, IncidentSerializer, LogSerializer
+
+
+def _log_rows(count):
+    return [
+        Log(
+            run_id=f"bench{i % 50:04d}",
+            step="analyze_trace_output",
+            level="info",
+            message=f"Detected slow trace candidate #{i} — matches été",
+            context={"trace_id": f"{i:032x}", "duration_micros": 2_000_000 + i, "call_operation_count": i % 7},
+        )
+        for i in range(count)
+    ]
+
+
+def _incident_rows(count):
+    severities = [key for key, _label in Incident.SEVERITY_CHOICES]
+    return [
+        Incident(
+            url="/matches/:id",
+            title=f"For /matches caused by N+1 queries ({i})",
+            problemDescription="Slow HTTP request detected. " * 4,
+            solutionDescription="Batch the per-row lookups into a single findMany. " * 2,
+            severity=severities[i % len(severities)],
+            timeImpact=round(2 + (i % 300) / 7, 2),
+            impactCount=i % 40,
+        )
+        for i in range(count)
+    ]
+
+
+def _detection_run_rows(count):
+    return [
+        DetectionRun(
+            runType="automatic" if i % 3 else "manual",
+            runId=f"{i:012x}",
+            status="failure" if i % 11 == 0 else "success",
+            errorMessage="Failed to fetch services from Jaeger (503)" if i % 11 == 0 else "",
+            incidentCount=i % 9,
+        )
+        for i in range(count)
+    ]
+
+
+TARGETS = {
+    "log": (Log, LogSerializer, _log_rows),
+    "incident": (Incident, IncidentSerializer, _incident_rows),
+    "detection-run": (DetectionRun, DetectionRunSerializer, _detection_run_rows),
+}
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the ModelSerializer list path against the values_list fast path. "
+        "Rows are inserted in a transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100_000)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--model", choices=[*TARGETS, "all"], default="all")
+
+    def handle(self, *args, **options):
+        names = list(TARGETS) if options["model"] == "all" else [options["model"]]
+        try:
+            with transaction.atomic():
+                for name in names:
+                    self._bench(name, options["rows"], options["repeat"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _bench(self, name, rows, repeat):
+        model, serializer_class, factory = TARGETS[name]
+        model.objects.bulk_create(factory(rows), batch_size=2000)
+        queryset = model.objects.order_by("-id")
+        context = {"response": None}
+
+        def slow():
+            data = serializer_class(queryset.all(), many=True).data
+            return JSONRenderer().render(data, "application/json", context)
+
+        mapper = get_row_mapper(serializer_class)
+
+        def fast():
+            return FastJSONRenderer().render(mapper.serialize(queryset.all()), "application/json", context)
+
+        slow_best, slow_body = _best_of(slow, repeat)
+        fast_best, fast_body = _best_of(fast, repeat)
+        if slow_body != fast_body:
+            raise CommandError(f"{name}: fast path output differs from ModelSerializer output.")
+
+        self.stdout.write(
+            f"{name:>13}: {rows} rows, {len(slow_body) / 1e6:.1f} MB  "
+            f"serializer {slow_best * 1000:8.1f} ms  fast {fast_best * 1000:8.1f} ms  "
+            f"speedup {slow_best / fast_best:5.1f}x  (identical bytes, {timezone.now():%Y-%m-%d})"
+        )
+
+
+def _best_of(fn, repeat):
+    best, body = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
@@ -0,0 +1,63 @@
+import cProfile
+import io
+import pstats
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.replay import iter_dump_traces
+from api.views import detect_incidents
+
+
+class Command(BaseCommand):
+    help = (
+        "Run incident detection against captured Jaeger query API JSON (files or directories) "
+        "instead of a live Jaeger."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Dump files or directories of *.json dumps.")
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Skip generate_pr/generate_incident_fields and only report the incidents that would be created.",
+        )
+        parser.add_argument("--run-id", default=None)
+        parser.add_argument("--profile", action="store_true", help="Print the top cProfile entries of the run.")
+        parser.add_argument("--profile-limit", type=int, default=30)
+
+    def handle(self, *args, **options):
+        profiler = cProfile.Profile() if options["profile"] else None
+        started = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            # Streamed file by file, so only one dump has to be in memory at a time.
+            candidates = detect_incidents(
+                runType="manual",
+                run_id=options["run_id"],
+                traces=iter_dump_traces(options["paths"]),
+                dry_run=options["dry_run"],
+            )
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Could not read replay dump: {exc}") from exc
+        finally:
+            if profiler:
+                profiler.disable()
+        elapsed = time.perf_counter() - started
+
+        verb = "Would create" if options["dry_run"] else "Created"
+        self.stdout.write(f"{verb} {len(candidates)} incident(s) in {elapsed:.2f}s.")
+        for trace_id, candidate in candidates.items():
+            impact = candidate.get("impact") or {}
+            self.stdout.write(
+                f"  {candidate.get('severity', '?'):>8}  score={candidate.get('score', 0):.0f}  "
+                f"x{round(impact.get('occurrences') or 0)}  "
+                f"+{(impact.get('meanAddedMicros') or 0) / 1000:.1f} ms  "
+                f"{candidate.get('httpTarget')}  {candidate.get('callSite')}  (trace {trace_id})"
+            )
+
+        if profiler:
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(options["profile_limit"])
+            self.stdout.write(output.getvalue())
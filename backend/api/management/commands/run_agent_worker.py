@@ -0,0 +1,54 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.checkpoints import RunCheckpoint
+from api.job_queue import claim, expire_abandoned, settle_run
+from api.views import run_agent_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Pick up queued agent sessions (AGENT_QUEUE=db) and run generate_pr for them. "
+        "Any number of workers, on any number of machines sharing the database, may run at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--worker-id", default=None, help="Lease owner name; defaults to <hostname>:<pid>.")
+        parser.add_argument(
+            "--lease-seconds",
+            type=float,
+            default=float(os.getenv("AGENT_JOB_LEASE_SECONDS", "300")),
+            help="How long a claim lasts without a heartbeat before another worker may take the job over.",
+        )
+        parser.add_argument("--poll-seconds", type=float, default=5.0, help="Sleep between polls of an empty queue.")
+        parser.add_argument("--max-jobs", type=int, default=0, help="Exit after this many jobs (0: run forever).")
+        parser.add_argument("--once", action="store_true", help="Exit as soon as the queue is empty.")
+
+    def handle(self, *args, **options):
+        worker_id = options["worker_id"] or f"{socket.gethostname()}:{os.getpid()}"
+        lease_seconds = options["lease_seconds"]
+        processed = 0
+        self.stdout.write(f"Agent worker {worker_id} polling for jobs.")
+        while not options["max_jobs"] or processed < options["max_jobs"]:
+            close_old_connections()
+            for job in expire_abandoned():
+                RunCheckpoint(job.detectionRun).mark(job.candidates, "failed", error=job.errorMessage)
+                settle_run(job.detectionRun_id)
+                self.stdout.write(f"Job {job.id} failed: lease expired on its last attempt.")
+
+            job = claim(worker_id, lease_seconds)
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_seconds"])
+                continue
+
+            self.stdout.write(f"Claimed job {job.id} (run {job.runId}, attempt {job.attempts}/{job.maxAttempts}).")
+            status = run_agent_job(job, worker_id, lease_seconds)
+            self.stdout.write(f"Job {job.id}: {status or 'lease lost'}.")
+            processed += 1
+        self.stdout.write(f"Agent worker {worker_id} processed {processed} job(s).")
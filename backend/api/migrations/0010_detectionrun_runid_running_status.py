@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_detectionrun_incidentcount"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="detectionrun",
+            name="runId",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                default="",
+                help_text="Log.run_id of the detect_incidents execution tracked by this run.",
+                max_length=64,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="detectionrun",
+            name="status",
+            field=models.CharField(
+                choices=[("running", "Running"), ("success", "Success"), ("failure", "Failure")],
+                db_index=True,
+                default="success",
+                max_length=16,
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_incident_detectionrun_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="incident",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name="StatsSummary",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("key", models.CharField(max_length=64, unique=True)),
+                (
+                    "version",
+                    models.IntegerField(
+                        default=0,
+                        help_text="Bumped whenever the underlying incidents or detection runs change.",
+                    ),
+                ),
+                (
+                    "computed_version",
+                    models.IntegerField(
+                        default=-1,
+                        help_text="Version the cached payload was computed for; stale when it differs from version.",
+                    ),
+                ),
+                ("payload", models.JSONField(blank=True, default=dict)),
+                ("computed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
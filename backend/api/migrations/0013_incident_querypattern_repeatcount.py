@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_incident_created_at_statssummary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="incident",
+            name="queryPattern",
+            field=models.TextField(
+                blank=True,
+                default="",
+                help_text="Fingerprint of the repeated query when an N+1 pattern was detected.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="incident",
+            name="repeatCount",
+            field=models.IntegerField(
+                default=0,
+                help_text="How many times the N+1 query ran within the example request.",
+            ),
+        ),
+    ]
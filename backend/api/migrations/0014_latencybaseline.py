@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_incident_querypattern_repeatcount"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LatencyBaseline",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("route", models.CharField(db_index=True, help_text="Normalized route, e.g. /matches/:id.", max_length=512)),
+                (
+                    "callSite",
+                    models.CharField(
+                        blank=True,
+                        default="",
+                        help_text="prisma.frame of the call operation; empty for the whole request.",
+                        max_length=512,
+                    ),
+                ),
+                (
+                    "sketch",
+                    models.JSONField(blank=True, default=dict, help_text="Serialized LatencySketch of durations (micros)."),
+                ),
+                ("count", models.BigIntegerField(default=0)),
+                ("p50", models.FloatField(blank=True, null=True)),
+                ("p95", models.FloatField(blank=True, null=True)),
+                ("p99", models.FloatField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(fields=("route", "callSite"), name="unique_latency_baseline"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_latencybaseline"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="incident",
+            name="callSite",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="prisma.frame of the call site the incident is aggregated on.",
+                max_length=1024,
+            ),
+        ),
+        migrations.AddField(
+            model_name="incident",
+            name="meanAddedLatency",
+            field=models.FloatField(
+                default=0,
+                help_text="Mean critical-path seconds the call site added per affected request.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="incident",
+            name="exampleTraceIds",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                help_text="Trace ids of the worst affected requests, worst first.",
+            ),
+        ),
+        migrations.AddField(
+            model_name="incident",
+            name="affectedRoutes",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                help_text="Normalized routes the call site was slow on, most frequent first.",
+            ),
+        ),
+    ]
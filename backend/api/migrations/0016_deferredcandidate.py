@@ -0,0 +1,55 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_incident_call_site_impact"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeferredCandidate",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("callSite", models.CharField(max_length=1024, unique=True)),
+                ("traceId", models.CharField(blank=True, default="", max_length=64)),
+                (
+                    "score",
+                    models.FloatField(db_index=True, default=0, help_text="Severity-weighted added latency (micros)."),
+                ),
+                (
+                    "severity",
+                    models.CharField(
+                        choices=[
+                            ("low", "Low"),
+                            ("medium", "Medium"),
+                            ("high", "High"),
+                            ("critical", "Critical"),
+                            ("blocker", "Blocker"),
+                        ],
+                        default="medium",
+                        max_length=16,
+                    ),
+                ),
+                (
+                    "payload",
+                    models.JSONField(
+                        blank=True, default=dict, help_text="Analyzed incident candidate, as queued for PR generation."
+                    ),
+                ),
+                (
+                    "runId",
+                    models.CharField(
+                        blank=True, default="", help_text="Run that last deferred the candidate.", max_length=64
+                    ),
+                ),
+                (
+                    "deferrals",
+                    models.IntegerField(default=0, help_text="How many runs ran out of budget before reaching it."),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
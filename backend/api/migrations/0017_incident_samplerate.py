@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_deferredcandidate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="incident",
+            name="sampleRate",
+            field=models.FloatField(
+                default=1.0,
+                help_text="Analyzed / estimated affected requests; impact numbers are already scaled by its inverse.",
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_incident_samplerate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="incident",
+            name="hotspot",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Function (file:line) with the most exclusive latency in the call site's slow requests.",
+                max_length=1024,
+            ),
+        ),
+        migrations.AddField(
+            model_name="incident",
+            name="hotspotStack",
+            field=models.TextField(
+                blank=True,
+                default="",
+                help_text="Aggregated call stacks of the slow requests with inclusive and self time.",
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0018_incident_hotspot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pullrequest",
+            name="benchmark_base_ms",
+            field=models.FloatField(
+                blank=True,
+                help_text="Median benchmark time on the base branch, when the change was verified.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="pullrequest",
+            name="benchmark_head_ms",
+            field=models.FloatField(blank=True, help_text="Median benchmark time with the change applied.", null=True),
+        ),
+        migrations.AddField(
+            model_name="pullrequest",
+            name="speedup",
+            field=models.FloatField(blank=True, help_text="benchmark_base_ms / benchmark_head_ms.", null=True),
+        ),
+        migrations.AddField(
+            model_name="incident",
+            name="verifiedSpeedup",
+            field=models.FloatField(
+                blank=True,
+                help_text="Benchmarked base/head speedup of the linked pull request; null when not verified.",
+                null=True,
+            ),
+        ),
+    ]
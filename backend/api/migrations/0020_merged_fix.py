@@ -0,0 +1,82 @@
+from django.db import migrations, models
+
+
+SKETCH_HELP = "Serialized LatencySketch of the call site's durations (micros) when the incident was created."
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0019_benchmark_verification"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="incident",
+            name="latencySketch",
+            field=models.JSONField(blank=True, default=dict, help_text=SKETCH_HELP),
+        ),
+        migrations.CreateModel(
+            name="MergedFix",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("callSite", models.CharField(db_index=True, max_length=1024)),
+                ("routes", models.JSONField(blank=True, default=list)),
+                ("incidentTitle", models.CharField(blank=True, default="", max_length=255)),
+                ("pullRequestTitle", models.CharField(blank=True, default="", max_length=255)),
+                (
+                    "repo",
+                    models.CharField(
+                        blank=True, default="", help_text="owner/name of the merged repository.", max_length=512
+                    ),
+                ),
+                ("headBranch", models.CharField(blank=True, default="", max_length=255)),
+                ("mergeSha", models.CharField(blank=True, default="", max_length=64)),
+                ("mergedAt", models.DateTimeField(db_index=True)),
+                (
+                    "verifiedSpeedup",
+                    models.FloatField(blank=True, help_text="Pre-merge benchmark speedup, if verified.", null=True),
+                ),
+                ("beforeSketch", models.JSONField(blank=True, default=dict, help_text=SKETCH_HELP)),
+                (
+                    "afterSketch",
+                    models.JSONField(
+                        blank=True,
+                        default=dict,
+                        help_text="Serialized LatencySketch of the call site's durations (micros) in traces after the merge.",
+                    ),
+                ),
+                ("beforeCount", models.FloatField(default=0)),
+                ("afterCount", models.FloatField(default=0)),
+                ("beforeP50", models.FloatField(blank=True, null=True)),
+                ("beforeP95", models.FloatField(blank=True, null=True)),
+                ("afterP50", models.FloatField(blank=True, null=True)),
+                ("afterP95", models.FloatField(blank=True, null=True)),
+                (
+                    "p50Change",
+                    models.FloatField(blank=True, help_text="(after - before) / before; negative is faster.", null=True),
+                ),
+                (
+                    "p95Change",
+                    models.FloatField(blank=True, help_text="(after - before) / before; negative is faster.", null=True),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("improved", "Improved"),
+                            ("unchanged", "Unchanged"),
+                            ("regressed", "Regressed"),
+                        ],
+                        db_index=True,
+                        default="pending",
+                        max_length=16,
+                    ),
+                ),
+                ("checkedAt", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0020_merged_fix"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="detectionrun",
+            name="cancelRequested",
+            field=models.BooleanField(
+                default=False,
+                help_text="Set by the cancel action; the running detection stops at its next check.",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="detectionrun",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("running", "Running"),
+                    ("success", "Success"),
+                    ("failure", "Failure"),
+                    ("cancelled", "Cancelled"),
+                    ("timeout", "Timeout"),
+                ],
+                db_index=True,
+                default="success",
+                max_length=16,
+            ),
+        ),
+    ]
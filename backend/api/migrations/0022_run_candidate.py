@@ -0,0 +1,88 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0021_detection_run_cancel"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="detectionrun",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("running", "Running"),
+                    ("success", "Success"),
+                    ("failure", "Failure"),
+                    ("cancelled", "Cancelled"),
+                    ("timeout", "Timeout"),
+                    ("partial", "Partial"),
+                ],
+                db_index=True,
+                default="success",
+                max_length=16,
+            ),
+        ),
+        migrations.CreateModel(
+            name="RunCandidate",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("position", models.IntegerField(help_text="Order in which the run schedules the candidate.")),
+                (
+                    "groupIndex",
+                    models.IntegerField(help_text="Agent session (group of candidates sharing a PR) within the run."),
+                ),
+                ("callSite", models.CharField(max_length=1024)),
+                ("traceId", models.CharField(blank=True, default="", max_length=64)),
+                ("score", models.FloatField(default=0)),
+                (
+                    "payload",
+                    models.JSONField(
+                        blank=True, default=dict, help_text="Analyzed incident candidate, as queued for PR generation."
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("generated", "Generated"),
+                            ("failed", "Failed"),
+                            ("rejected", "Rejected"),
+                            ("skipped", "Skipped"),
+                            ("deferred", "Deferred"),
+                        ],
+                        db_index=True,
+                        default="pending",
+                        max_length=16,
+                    ),
+                ),
+                ("attempts", models.IntegerField(default=0)),
+                ("errorMessage", models.TextField(blank=True, default="")),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "detectionRun",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="candidates", to="api.detectionrun"
+                    ),
+                ),
+                (
+                    "pullRequest",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="api.pullrequest",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ("detectionRun", "position"),
+                "constraints": [models.UniqueConstraint(fields=("detectionRun", "callSite"), name="unique_run_candidate")],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0022_run_candidate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AgentJob",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("runId", models.CharField(blank=True, db_index=True, default="", max_length=64)),
+                ("groupIndex", models.IntegerField(default=0)),
+                (
+                    "candidates",
+                    models.JSONField(blank=True, default=list, help_text="Analyzed incident candidates of the session."),
+                ),
+                ("prompt", models.TextField()),
+                ("benchmarkEnv", models.JSONField(blank=True, default=dict)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        db_index=True,
+                        default="queued",
+                        max_length=16,
+                    ),
+                ),
+                ("attempts", models.IntegerField(default=0)),
+                ("maxAttempts", models.IntegerField(default=3)),
+                ("leaseOwner", models.CharField(blank=True, default="", max_length=255)),
+                ("leaseExpiresAt", models.DateTimeField(blank=True, db_index=True, null=True)),
+                ("heartbeatAt", models.DateTimeField(blank=True, null=True)),
+                (
+                    "result",
+                    models.JSONField(blank=True, default=dict, help_text="generate_pr result reported by the worker."),
+                ),
+                ("errorMessage", models.TextField(blank=True, default="")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "detectionRun",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="jobs",
+                        to="api.detectionrun",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0023_agent_job"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="detectionrun",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("running", "Running"),
+                    ("success", "Success"),
+                    ("failure", "Failure"),
+                    ("cancelled", "Cancelled"),
+                    ("timeout", "Timeout"),
+                    ("partial", "Partial"),
+                    ("queued", "Waiting for agent workers"),
+                ],
+                db_index=True,
+                default="success",
+                max_length=16,
+            ),
+        ),
+    ]
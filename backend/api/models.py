@@ -10,6 +10,17 @@ class PullRequest(models.Model):
     title = models.CharField(max_length=255)
     body = models.TextField()
     compare_url = models.URLField(blank=True)
+    benchmark_base_ms = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Median benchmark time on the base branch, when the change was verified.",
+    )
+    benchmark_head_ms = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Median benchmark time with the change applied.",
+    )
+    speedup = models.FloatField(null=True, blank=True, help_text="benchmark_base_ms / benchmark_head_ms.")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -39,7 +50,63 @@ class Incident(models.Model):
     solutionDescription = models.TextField()
     timeImpact = models.FloatField()
     impactCount = models.IntegerField()
+    queryPattern = models.TextField(
+        blank=True,
+        default="",
+        help_text="Fingerprint of the repeated query when an N+1 pattern was detected.",
+    )
+    repeatCount = models.IntegerField(
+        default=0,
+        help_text="How many times the N+1 query ran within the example request.",
+    )
+    callSite = models.CharField(
+        max_length=1024,
+        blank=True,
+        default="",
+        help_text="prisma.frame of the call site the incident is aggregated on.",
+    )
+    hotspot = models.CharField(
+        max_length=1024,
+        blank=True,
+        default="",
+        help_text="Function (file:line) with the most exclusive latency in the call site's slow requests.",
+    )
+    hotspotStack = models.TextField(
+        blank=True,
+        default="",
+        help_text="Aggregated call stacks of the slow requests with inclusive and self time.",
+    )
+    verifiedSpeedup = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Benchmarked base/head speedup of the linked pull request; null when not verified.",
+    )
+    latencySketch = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Serialized LatencySketch of the call site's durations (micros) when the incident was created.",
+    )
+    meanAddedLatency = models.FloatField(
+        default=0,
+        help_text="Mean critical-path seconds the call site added per affected request.",
+    )
+    sampleRate = models.FloatField(
+        default=1.0,
+        help_text="Analyzed / estimated affected requests; impact numbers are already scaled by its inverse.",
+    )
+    exampleTraceIds = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Trace ids of the worst affected requests, worst first.",
+    )
+    affectedRoutes = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Normalized routes the call site was slow on, most frequent first.",
+    )
     severity = models.CharField(max_length=16, choices=SEVERITY_CHOICES, default="medium", db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self) -> str:
         return self.title
@@ -104,15 +171,211 @@ class DetectionRun(models.Model):
         ("automatic", "Automatic"),
     )
     STATUS_CHOICES = (
+        ("running", "Running"),
         ("success", "Success"),
         ("failure", "Failure"),
+        ("cancelled", "Cancelled"),
+        ("timeout", "Timeout"),
+        ("partial", "Partial"),
+        ("queued", "Waiting for agent workers"),
     )
 
     date = models.DateTimeField(auto_now_add=True, db_index=True)
+    runId = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        db_index=True,
+        help_text="Log.run_id of the detect_incidents execution tracked by this run.",
+    )
     runType = models.CharField(max_length=16, choices=RUN_TYPE_CHOICES, db_index=True)
     status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="success", db_index=True)
     errorMessage = models.TextField(blank=True, default="")
     incidentCount = models.IntegerField(default=0)
+    cancelRequested = models.BooleanField(
+        default=False,
+        help_text="Set by the cancel action; the running detection stops at its next check.",
+    )
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self) -> str:
         return f"{self.runType}/{self.status} run @ {self.date.isoformat()}"
+
+
+class StatsSummary(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    version = models.IntegerField(
+        default=0,
+        help_text="Bumped whenever the underlying incidents or detection runs change.",
+    )
+    computed_version = models.IntegerField(
+        default=-1,
+        help_text="Version the cached payload was computed for; stale when it differs from version.",
+    )
+    payload = models.JSONField(default=dict, blank=True)
+    computed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.key} (v{self.computed_version}/{self.version})"
+
+
+class LatencyBaseline(models.Model):
+    route = models.CharField(max_length=512, db_index=True, help_text="Normalized route, e.g. /matches/:id.")
+    callSite = models.CharField(
+        max_length=512,
+        blank=True,
+        default="",
+        help_text="prisma.frame of the call operation; empty for the whole request.",
+    )
+    sketch = models.JSONField(default=dict, blank=True, help_text="Serialized LatencySketch of durations (micros).")
+    count = models.BigIntegerField(default=0)
+    p50 = models.FloatField(null=True, blank=True)
+    p95 = models.FloatField(null=True, blank=True)
+    p99 = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["route", "callSite"], name="unique_latency_baseline"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.route} {self.callSite or '(request)'} p95={self.p95}"
+
+
+class DeferredCandidate(models.Model):
+    callSite = models.CharField(max_length=1024, unique=True)
+    traceId = models.CharField(max_length=64, blank=True, default="")
+    score = models.FloatField(default=0, db_index=True, help_text="Severity-weighted added latency (micros).")
+    severity = models.CharField(max_length=16, choices=Incident.SEVERITY_CHOICES, default="medium")
+    payload = models.JSONField(default=dict, blank=True, help_text="Analyzed incident candidate, as queued for PR generation.")
+    runId = models.CharField(max_length=64, blank=True, default="", help_text="Run that last deferred the candidate.")
+    deferrals = models.IntegerField(default=0, help_text="How many runs ran out of budget before reaching it.")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.callSite} (score={self.score:.0f}, deferred {self.deferrals}x)"
+
+
+class MergedFix(models.Model):
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("improved", "Improved"),
+        ("unchanged", "Unchanged"),
+        ("regressed", "Regressed"),
+    )
+
+    callSite = models.CharField(max_length=1024, db_index=True)
+    routes = models.JSONField(default=list, blank=True)
+    incidentTitle = models.CharField(max_length=255, blank=True, default="")
+    pullRequestTitle = models.CharField(max_length=255, blank=True, default="")
+    repo = models.CharField(max_length=512, blank=True, default="", help_text="owner/name of the merged repository.")
+    headBranch = models.CharField(max_length=255, blank=True, default="")
+    mergeSha = models.CharField(max_length=64, blank=True, default="")
+    mergedAt = models.DateTimeField(db_index=True)
+    verifiedSpeedup = models.FloatField(null=True, blank=True, help_text="Pre-merge benchmark speedup, if verified.")
+    beforeSketch = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Serialized LatencySketch of the call site's durations (micros) when the incident was created.",
+    )
+    afterSketch = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Serialized LatencySketch of the call site's durations (micros) in traces after the merge.",
+    )
+    beforeCount = models.FloatField(default=0)
+    afterCount = models.FloatField(default=0)
+    beforeP50 = models.FloatField(null=True, blank=True)
+    beforeP95 = models.FloatField(null=True, blank=True)
+    afterP50 = models.FloatField(null=True, blank=True)
+    afterP95 = models.FloatField(null=True, blank=True)
+    p50Change = models.FloatField(null=True, blank=True, help_text="(after - before) / before; negative is faster.")
+    p95Change = models.FloatField(null=True, blank=True, help_text="(after - before) / before; negative is faster.")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="pending", db_index=True)
+    checkedAt = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.callSite} merged {self.mergedAt:%Y-%m-%d}: {self.status}"
+
+
+class RunCandidate(models.Model):
+    """Checkpoint of one analyzed candidate of a DetectionRun, so the run can be resumed."""
+
+    STATUS_CHOICES = (
+        ("pending", "Pending"),
+        ("generated", "Generated"),
+        ("failed", "Failed"),
+        ("rejected", "Rejected"),
+        ("skipped", "Skipped"),
+        ("deferred", "Deferred"),
+    )
+
+    detectionRun = models.ForeignKey(DetectionRun, on_delete=models.CASCADE, related_name="candidates")
+    position = models.IntegerField(help_text="Order in which the run schedules the candidate.")
+    groupIndex = models.IntegerField(help_text="Agent session (group of candidates sharing a PR) within the run.")
+    callSite = models.CharField(max_length=1024)
+    traceId = models.CharField(max_length=64, blank=True, default="")
+    score = models.FloatField(default=0)
+    payload = models.JSONField(default=dict, blank=True, help_text="Analyzed incident candidate, as queued for PR generation.")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="pending", db_index=True)
+    attempts = models.IntegerField(default=0)
+    errorMessage = models.TextField(blank=True, default="")
+    pullRequest = models.ForeignKey(
+        PullRequest,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ("detectionRun", "position")
+        constraints = [
+            models.UniqueConstraint(fields=["detectionRun", "callSite"], name="unique_run_candidate"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.callSite} ({self.status}) in run {self.detectionRun_id}"
+
+
+class AgentJob(models.Model):
+    """One agent session (a group of candidates sharing a PR), queued for `run_agent_worker`."""
+
+    STATUS_CHOICES = (
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+
+    detectionRun = models.ForeignKey(
+        DetectionRun,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="jobs",
+    )
+    runId = models.CharField(max_length=64, blank=True, default="", db_index=True)
+    groupIndex = models.IntegerField(default=0)
+    candidates = models.JSONField(default=list, blank=True, help_text="Analyzed incident candidates of the session.")
+    prompt = models.TextField()
+    benchmarkEnv = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="queued", db_index=True)
+    attempts = models.IntegerField(default=0)
+    maxAttempts = models.IntegerField(default=3)
+    leaseOwner = models.CharField(max_length=255, blank=True, default="")
+    leaseExpiresAt = models.DateTimeField(null=True, blank=True, db_index=True)
+    heartbeatAt = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(default=dict, blank=True, help_text="generate_pr result reported by the worker.")
+    errorMessage = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"job {self.id} ({self.status}, attempt {self.attempts}/{self.maxAttempts})"
+
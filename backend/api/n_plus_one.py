@@ -0,0 +1,80 @@
+import re
+from collections import defaultdict
+
+from .spans import enclosing_span, parent_span_id, span_tags
+
+
+CALL_OPERATION = "prisma:call-operation"
+DB_QUERY = "prisma:client:db_query"
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_BIND_PARAM_RE = re.compile(r"\$\d+")
+_NUMBER_RE = re.compile(r"(?<![\w\"$.])-?\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def fingerprint_query(sql: str) -> str:
+    """Normalize SQL so the same statement with different parameters compares equal.
+
+    Literals and bind parameters become `?`, IN-lists collapse to `(?+)` and
+    whitespace is squashed, e.g. `... WHERE "id" = $1 LIMIT $2` -> `... WHERE "id" = ? LIMIT ?`.
+    """
+
+    query = _STRING_RE.sub("?", sql)
+    query = _BIND_PARAM_RE.sub("?", query)
+    query = _NUMBER_RE.sub("?", query)
+    query = _IN_LIST_RE.sub("(?+)", query)
+    return _WHITESPACE_RE.sub(" ", query).strip()
+
+
+def find_n_plus_one(spans, min_repeats: int = 3) -> list[dict]:
+    """Find queries repeated under one parent span in a single trace.
+
+    db_query spans are attributed to their enclosing prisma:call-operation (and its
+    `prisma.frame` call site) and grouped by the call operation's parent plus the query
+    fingerprint. Groups with at least `min_repeats` executions are merged per call site
+    and fingerprint and returned sorted by the total time spent in the repeated queries.
+    """
+
+    spans_by_id = {span.get("spanID"): span for span in spans}
+    groups = defaultdict(lambda: {"repeatCount": 0, "totalDuration": 0, "sampleQuery": None})
+
+    for span in spans:
+        if span.get("operationName") != DB_QUERY:
+            continue
+        query_text = span_tags(span).get("db.query.text")
+        if not query_text:
+            continue
+
+        call_operation = enclosing_span(span, spans_by_id, CALL_OPERATION)
+        anchor = call_operation or span
+        call_site = span_tags(call_operation).get("prisma.frame") if call_operation else None
+        key = (parent_span_id(anchor), call_site, fingerprint_query(str(query_text)))
+
+        group = groups[key]
+        group["repeatCount"] += 1
+        group["totalDuration"] += span.get("duration") or 0
+        if group["sampleQuery"] is None:
+            group["sampleQuery"] = str(query_text)[:2000]
+
+    patterns = {}
+    for (parent_id, call_site, fingerprint), group in groups.items():
+        if group["repeatCount"] < min_repeats:
+            continue
+        pattern = patterns.setdefault(
+            (call_site, fingerprint),
+            {
+                "fingerprint": fingerprint,
+                "callSite": call_site,
+                "repeatCount": 0,
+                "totalDuration": 0,
+                "parentSpanIds": [],
+                "sampleQuery": group["sampleQuery"],
+            },
+        )
+        pattern["repeatCount"] += group["repeatCount"]
+        pattern["totalDuration"] += group["totalDuration"]
+        pattern["parentSpanIds"].append(parent_id)
+
+    return sorted(patterns.values(), key=lambda p: p["totalDuration"], reverse=True)
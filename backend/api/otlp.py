@@ -0,0 +1,296 @@
+"""Decoding of OTLP/HTTP trace export requests into Jaeger-shaped spans.
+
+Both encodings of `ExportTraceServiceRequest` are supported: protobuf
+(`application/x-protobuf`, decoded with a small wire-format reader so no protobuf
+runtime is needed) and JSON (`application/json`). Spans come out in the shape the
+rest of the app reads from Jaeger's query API: hex `traceID`/`spanID`, a CHILD_OF
+reference to the parent, microsecond `startTime`/`duration` and a `tags` list.
+"""
+
+import base64
+import binascii
+import json
+import struct
+import zlib
+
+
+PROTOBUF = "application/x-protobuf"
+JSON = "application/json"
+
+
+class UnsupportedContentType(ValueError):
+    pass
+
+
+class PayloadTooLarge(ValueError):
+    pass
+
+
+def gunzip(body: bytes, max_bytes: int) -> bytes:
+    """Decompress a gzip body (possibly several members) of at most `max_bytes`.
+
+    Raises ValueError for corrupt or truncated data and PayloadTooLarge past the cap,
+    without inflating more than `max_bytes` first.
+    """
+    out = bytearray()
+    try:
+        while True:
+            decompressor = zlib.decompressobj(wbits=31)
+            out += decompressor.decompress(body, max_bytes - len(out) + 1)
+            if len(out) > max_bytes:
+                raise PayloadTooLarge(f"Decompressed body exceeds {max_bytes} bytes.")
+            if not decompressor.eof:
+                raise ValueError("Malformed gzip body: truncated stream.")
+            body = decompressor.unused_data
+            if not body:
+                return bytes(out)
+    except zlib.error as exc:
+        raise ValueError(f"Malformed gzip body: {exc}") from exc
+
+
+def _read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buf):
+    """Yield `(field_number, wire_type, value)` for each field of a protobuf message."""
+    buf = memoryview(buf)
+    pos, end = 0, len(buf)
+    try:
+        while pos < end:
+            key, pos = _read_varint(buf, pos)
+            field, wire = key >> 3, key & 7
+            if wire == 0:
+                value, pos = _read_varint(buf, pos)
+            elif wire == 1:
+                value, pos = buf[pos:pos + 8], pos + 8
+            elif wire == 2:
+                length, pos = _read_varint(buf, pos)
+                value, pos = buf[pos:pos + length], pos + length
+            elif wire == 5:
+                value, pos = buf[pos:pos + 4], pos + 4
+            else:
+                raise ValueError(f"Unsupported protobuf wire type {wire}.")
+            if pos > end:
+                raise ValueError("Truncated protobuf message.")
+            yield field, wire, value
+    except IndexError:
+        raise ValueError("Truncated protobuf varint.") from None
+
+
+# Wire types of the fields read from each message: 0 varint, 1 fixed64, 2 length-delimited.
+_EXPORT_REQUEST = {1: 2}
+_RESOURCE_SPANS = {1: 2, 2: 2}
+_RESOURCE = {1: 2}
+_SCOPE_SPANS = {2: 2}
+_SPAN = {1: 2, 2: 2, 4: 2, 5: 2, 7: 1, 8: 1, 9: 2}
+_KEY_VALUE = {1: 2, 2: 2}
+_ANY_VALUE = {1: 2, 2: 0, 3: 0, 4: 1, 5: 2, 6: 2, 7: 2}
+_VALUES = {1: 2}  # ArrayValue and KeyValueList
+
+
+def _message(buf, schema):
+    """`(field_number, value)` for the fields in `schema`; other fields are skipped.
+
+    A field with another wire type than its schema says is rejected, so a varint can
+    never be read as a length or a fixed-width number.
+    """
+    for field, wire, value in _fields(buf):
+        expected = schema.get(field)
+        if expected is None:
+            continue
+        if wire != expected:
+            raise ValueError(f"Protobuf field {field} has wire type {wire}, expected {expected}.")
+        yield field, value
+
+
+def _pb_any_value(buf):
+    for field, value in _message(buf, _ANY_VALUE):
+        if field == 1:
+            return bytes(value).decode("utf-8")
+        if field == 2:
+            return bool(value)
+        if field == 3:
+            return value - (1 << 64) if value >= 1 << 63 else value
+        if field == 4:
+            return struct.unpack("<d", value)[0]
+        if field == 5:
+            return [_pb_any_value(item) for _item_field, item in _message(value, _VALUES)]
+        if field == 6:
+            return dict(_pb_key_value(item) for _item_field, item in _message(value, _VALUES))
+        if field == 7:
+            return bytes(value).hex()
+    return None
+
+
+def _pb_key_value(buf):
+    key, value = "", None
+    for field, raw in _message(buf, _KEY_VALUE):
+        if field == 1:
+            key = bytes(raw).decode("utf-8")
+        elif field == 2:
+            value = _pb_any_value(raw)
+    return key, value
+
+
+def _pb_attributes(buf):
+    return dict(_pb_key_value(raw) for _field, raw in _message(buf, _RESOURCE))
+
+
+def _pb_span(buf):
+    span = {"attributes": {}}
+    for field, value in _message(buf, _SPAN):
+        if field == 1:
+            span["traceId"] = bytes(value).hex()
+        elif field == 2:
+            span["spanId"] = bytes(value).hex()
+        elif field == 4:
+            span["parentSpanId"] = bytes(value).hex()
+        elif field == 5:
+            span["name"] = bytes(value).decode("utf-8")
+        elif field == 7:
+            span["startTimeUnixNano"] = struct.unpack("<Q", value)[0]
+        elif field == 8:
+            span["endTimeUnixNano"] = struct.unpack("<Q", value)[0]
+        elif field == 9:
+            key, attribute = _pb_key_value(value)
+            span["attributes"][key] = attribute
+    return span
+
+
+def _decode_protobuf(body):
+    """ExportTraceServiceRequest -> [(service_name, otlp_span_dict), ...]."""
+    decoded = []
+    for _field, resource_spans in _message(body, _EXPORT_REQUEST):
+        service, scope_spans = "", []
+        for rs_field, value in _message(resource_spans, _RESOURCE_SPANS):
+            if rs_field == 1:
+                service = _pb_attributes(value).get("service.name") or ""
+            else:
+                scope_spans.append(value)
+        for scope in scope_spans:
+            for _scope_field, value in _message(scope, _SCOPE_SPANS):
+                decoded.append((service, _pb_span(value)))
+    return decoded
+
+
+def _json_any_value(value):
+    if not isinstance(value, dict):
+        return value
+    if "stringValue" in value:
+        return value["stringValue"]
+    if "boolValue" in value:
+        return bool(value["boolValue"])
+    if "intValue" in value:
+        return int(value["intValue"])
+    if "doubleValue" in value:
+        return float(value["doubleValue"])
+    if "arrayValue" in value:
+        return [_json_any_value(item) for item in (value["arrayValue"] or {}).get("values") or []]
+    if "kvlistValue" in value:
+        return _json_attributes((value["kvlistValue"] or {}).get("values"))
+    if "bytesValue" in value:
+        return _json_id(value["bytesValue"])
+    return None
+
+
+def _json_attributes(attributes):
+    return {item.get("key"): _json_any_value(item.get("value")) for item in attributes or [] if isinstance(item, dict)}
+
+
+def _json_id(value):
+    """OTLP/JSON ids are hex; tolerate the base64 of the generic proto3 JSON mapping too."""
+    if not value:
+        return ""
+    try:
+        bytes.fromhex(value)
+        return value.lower()
+    except ValueError:
+        try:
+            return base64.b64decode(value, validate=True).hex()
+        except (binascii.Error, ValueError):
+            raise ValueError(f"Invalid OTLP id {value!r}.")
+
+
+def _decode_json(body):
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("OTLP/JSON payload must be an object.")
+    decoded = []
+    for resource_spans in payload.get("resourceSpans") or []:
+        resource = resource_spans.get("resource") or {}
+        service = _json_attributes(resource.get("attributes")).get("service.name") or ""
+        scopes = resource_spans.get("scopeSpans") or resource_spans.get("instrumentationLibrarySpans") or []
+        for scope in scopes:
+            for span in scope.get("spans") or []:
+                decoded.append((service, {
+                    "traceId": _json_id(span.get("traceId")),
+                    "spanId": _json_id(span.get("spanId")),
+                    "parentSpanId": _json_id(span.get("parentSpanId")),
+                    "name": span.get("name") or "",
+                    "startTimeUnixNano": int(span.get("startTimeUnixNano") or 0),
+                    "endTimeUnixNano": int(span.get("endTimeUnixNano") or 0),
+                    "attributes": _json_attributes(span.get("attributes")),
+                }))
+    return decoded
+
+
+def _tag(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "type": "bool", "value": value}
+    if isinstance(value, int):
+        return {"key": key, "type": "int64", "value": value}
+    if isinstance(value, float):
+        return {"key": key, "type": "float64", "value": value}
+    if isinstance(value, str):
+        return {"key": key, "type": "string", "value": value}
+    return {"key": key, "type": "string", "value": json.dumps(value)}
+
+
+def _jaeger_span(span, process_id):
+    trace_id, parent = span.get("traceId") or "", span.get("parentSpanId")
+    start = span.get("startTimeUnixNano") or 0
+    return {
+        "traceID": trace_id,
+        "spanID": span.get("spanId") or "",
+        "operationName": span.get("name") or "",
+        "references": [{"refType": "CHILD_OF", "traceID": trace_id, "spanID": parent}] if parent else [],
+        "startTime": start // 1000,
+        "duration": max(0, (span.get("endTimeUnixNano") or start) - start) // 1000,
+        "tags": [_tag(key, value) for key, value in span["attributes"].items()],
+        "processID": process_id,
+    }
+
+
+def decode_export_request(body: bytes, content_type: str) -> list[tuple[str, dict]]:
+    """`(service_name, jaeger_span)` pairs of an OTLP/HTTP trace export request body.
+
+    Raises ValueError for malformed bodies (UnsupportedContentType for other encodings).
+    """
+
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type == PROTOBUF:
+        try:
+            decoded = _decode_protobuf(body)
+        except (struct.error, UnicodeDecodeError) as exc:
+            raise ValueError(f"Malformed OTLP protobuf payload: {exc}") from exc
+    elif content_type == JSON:
+        try:
+            decoded = _decode_json(body)
+        except (TypeError, AttributeError, UnicodeDecodeError) as exc:
+            raise ValueError(f"Malformed OTLP/JSON payload: {exc}") from exc
+    else:
+        raise UnsupportedContentType(f"Unsupported content type {content_type!r}; send {PROTOBUF} or {JSON}.")
+
+    return [
+        (service, _jaeger_span(span, f"p-{service}"))
+        for service, span in decoded
+        if span.get("traceId") and span.get("spanId")
+    ]
@@ -0,0 +1,117 @@
+import os
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .latency_sketch import LatencySketch
+from .models import MergedFix
+
+
+def call_site_sketch(sketches: dict, call_site: str) -> LatencySketch:
+    """One call site's latency distribution over all routes of a run's `(route, call_site)` sketches."""
+    merged = LatencySketch()
+    for (_route, sketch_call_site), sketch in sketches.items():
+        if sketch_call_site == call_site:
+            merged.merge(sketch)
+    return merged
+
+
+def record_merge(incident, pull_request, merge_sha: str = "") -> MergedFix | None:
+    """Compact record of a merged fix that outlives the deleted Incident and PullRequest rows."""
+    if not incident.callSite:
+        return None
+    before = LatencySketch.from_dict(incident.latencySketch)
+    return MergedFix.objects.create(
+        callSite=incident.callSite,
+        routes=incident.affectedRoutes,
+        incidentTitle=incident.title[:255],
+        pullRequestTitle=pull_request.title[:255],
+        repo=f"{pull_request.repo_owner}/{pull_request.repo_name}",
+        headBranch=pull_request.head_branch,
+        mergeSha=merge_sha or "",
+        mergedAt=timezone.now(),
+        verifiedSpeedup=incident.verifiedSpeedup,
+        beforeSketch=incident.latencySketch,
+        beforeCount=before.count,
+        beforeP50=before.quantile(0.5),
+        beforeP95=before.quantile(0.95),
+    )
+
+
+class PostMergeTracker:
+    """Collects post-merge latencies of merged call sites during a detection run.
+
+    Only spans that started after the merge plus `grace` (time to deploy) count. A
+    fix is followed for `window` after its merge, then its verdict stays as it is.
+    """
+
+    def __init__(self, fixes, grace: timedelta, tolerance: float, min_samples: int):
+        self.tolerance = tolerance
+        self.min_samples = min_samples
+        self.fixes = {}  # callSite -> [(fix, cutoff micros since epoch)]
+        for fix in fixes:
+            cutoff = int((fix.mergedAt + grace).timestamp() * 1_000_000)
+            self.fixes.setdefault(fix.callSite, []).append((fix, cutoff))
+        self.sketches = {}  # fix id -> LatencySketch of this run
+
+    @classmethod
+    def from_env(cls) -> "PostMergeTracker":
+        window = timedelta(days=float(os.getenv("POST_MERGE_WINDOW_DAYS", "14")))
+        fixes = MergedFix.objects.filter(mergedAt__gte=timezone.now() - window)
+        return cls(
+            fixes,
+            grace=timedelta(minutes=float(os.getenv("POST_MERGE_GRACE_MINUTES", "10"))),
+            tolerance=float(os.getenv("POST_MERGE_TOLERANCE", "0.1")),
+            min_samples=int(os.getenv("LATENCY_MIN_SAMPLES", "10")),
+        )
+
+    def record(self, call_site: str, start_micros, duration_micros, weight: float = 1):
+        for fix, cutoff in self.fixes.get(call_site, ()):
+            if (start_micros or 0) >= cutoff:
+                if fix.id not in self.sketches:
+                    self.sketches[fix.id] = LatencySketch()
+                self.sketches[fix.id].add(duration_micros or 0, weight)
+
+    def save(self) -> list[dict]:
+        """Fold this run's samples into each fix's post-merge distribution and re-judge it."""
+        updated = []
+        for entries in self.fixes.values():
+            for fix, _cutoff in entries:
+                run_sketch = self.sketches.get(fix.id)
+                if run_sketch is None:
+                    continue
+                after = LatencySketch.from_dict(fix.afterSketch)
+                after.merge(run_sketch)
+                fix.afterSketch = after.to_dict()
+                fix.afterCount = after.count
+                fix.afterP50 = after.quantile(0.5)
+                fix.afterP95 = after.quantile(0.95)
+                fix.p50Change = _change(fix.beforeP50, fix.afterP50)
+                fix.p95Change = _change(fix.beforeP95, fix.afterP95)
+                fix.status = self._status(fix)
+                fix.checkedAt = timezone.now()
+                fix.save()
+                updated.append({
+                    "callSite": fix.callSite,
+                    "status": fix.status,
+                    "afterCount": fix.afterCount,
+                    "p50Change": fix.p50Change,
+                    "p95Change": fix.p95Change,
+                })
+        return updated
+
+    def _status(self, fix) -> str:
+        if fix.afterCount < self.min_samples or fix.p95Change is None:
+            return "pending"
+        if fix.p95Change <= -self.tolerance:
+            return "improved"
+        if fix.p95Change >= self.tolerance:
+            return "regressed"
+        return "unchanged"
+
+
+def _change(before, after):
+    """Relative change (after - before) / before; negative means faster."""
+    if not before or after is None:
+        return None
+    return round((after - before) / before, 4)
@@ -0,0 +1,174 @@
+import os
+import posixpath
+import re
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import DeferredCandidate
+
+
+# Multiplier applied to a candidate's total added latency when ranking.
+SEVERITY_WEIGHTS = {
+    "low": 0.5,
+    "medium": 1.0,
+    "high": 2.0,
+    "critical": 4.0,
+    "blocker": 8.0,
+}
+
+
+def estimate_severity(incident: dict) -> str:
+    """Severity guess made before the agent runs, from how much latency the call site adds."""
+    impact = incident.get("impact") or {}
+    mean_seconds = (impact.get("meanAddedMicros") or 0) / 1_000_000
+    if mean_seconds >= 5:
+        return "critical"
+    if incident.get("regressions") or mean_seconds >= 2:
+        return "high"
+    if mean_seconds >= 0.5:
+        return "medium"
+    return "low"
+
+
+def impact_score(incident: dict) -> float:
+    """Occurrences x mean added latency (micros), weighted by estimated severity."""
+    impact = incident.get("impact") or {}
+    added = (impact.get("occurrences") or 0) * (impact.get("meanAddedMicros") or 0)
+    return added * SEVERITY_WEIGHTS[incident.get("severity") or estimate_severity(incident)]
+
+
+class RunBudget:
+    """Caps how many agent sessions one run may start and how long it may keep starting them."""
+
+    def __init__(self, max_sessions: int, max_seconds: float, started_at: float | None = None):
+        self.max_sessions = max_sessions
+        self.max_seconds = max_seconds
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.sessions = 0
+
+    @classmethod
+    def from_env(cls, started_at: float | None = None) -> "RunBudget":
+        return cls(
+            max_sessions=int(os.getenv("AGENT_MAX_SESSIONS_PER_RUN", "5")),
+            max_seconds=float(os.getenv("AGENT_MAX_RUN_SECONDS", "3600")),
+            started_at=started_at,
+        )
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def exhausted(self) -> str | None:
+        """Reason no further session may start, or None while there is budget left."""
+        if self.sessions >= self.max_sessions:
+            return "max_sessions"
+        if self.elapsed >= self.max_seconds:
+            return "max_seconds"
+        return None
+
+    def spend(self):
+        self.sessions += 1
+
+
+def load_deferred_candidates(max_age_days: float | None = None, purge: bool = True) -> list[dict]:
+    """Candidates earlier runs ran out of budget for. Expired ones are dropped (and, with `purge`, deleted)."""
+    if max_age_days is None:
+        max_age_days = float(os.getenv("DEFERRED_CANDIDATE_MAX_AGE_DAYS", "7"))
+    expired = DeferredCandidate.objects.filter(updated_at__lt=timezone.now() - timedelta(days=max_age_days))
+    if purge:
+        expired.delete()
+    candidates = []
+    for deferred in DeferredCandidate.objects.exclude(id__in=expired.values("id")).order_by("-score"):
+        candidate = dict(deferred.payload)
+        candidate["deferrals"] = deferred.deferrals
+        candidates.append(candidate)
+    return candidates
+
+
+def schedule_candidates(fresh: list[dict], deferred: list[dict]) -> list[dict]:
+    """Merge this run's candidates with carried-over ones and order them by impact, highest first.
+
+    A call site found again in this run replaces its carried-over entry, keeping the
+    deferral count so it is visible how long it has been waiting.
+    """
+
+    by_call_site = {candidate["callSite"]: candidate for candidate in deferred}
+    for candidate in fresh:
+        previous = by_call_site.get(candidate["callSite"])
+        if previous is not None:
+            candidate["deferrals"] = previous.get("deferrals", 0)
+        by_call_site[candidate["callSite"]] = candidate
+
+    for candidate in by_call_site.values():
+        candidate["severity"] = estimate_severity(candidate)
+        candidate["score"] = impact_score(candidate)
+    return sorted(by_call_site.values(), key=lambda candidate: candidate["score"], reverse=True)
+
+
+# The file of "at fn (src/index.ts:51:38)", "at src/index.ts:51:38" or "src/index.ts:51".
+_SOURCE_FILE_RE = re.compile(r"\(?([^\s()]+?):\d+(?::\d+)?\)?\s*$")
+
+
+def candidate_source_file(candidate: dict) -> str | None:
+    """Source file a candidate's slow code is in: its call site's file, else its hotspot's."""
+    locations = [candidate.get("callSite"), (candidate.get("hotspot") or {}).get("location")]
+    for location in locations:
+        match = _SOURCE_FILE_RE.search(location or "")
+        if match:
+            return match.group(1)
+    return None
+
+
+def group_key(candidate: dict, group_by: str = "file") -> str | None:
+    """Key candidates are batched into one agent session by: their file, their file's directory, or none."""
+    if group_by not in {"file", "module"}:
+        return None
+    path = candidate_source_file(candidate)
+    if path is None or group_by == "file":
+        return path
+    return posixpath.dirname(path) or path
+
+
+def group_candidates(scheduled: list[dict], group_by: str = "file", max_size: int = 5) -> list[list[dict]]:
+    """Batch scheduled candidates that share a source file (or module) into one PR each.
+
+    Groups keep the schedule's order: a group runs where its highest-scoring member
+    was scheduled, members in score order. A group holds at most `max_size`
+    candidates; candidates without a known file run alone.
+    """
+
+    groups = []
+    open_groups = {}
+    for candidate in scheduled:
+        key = group_key(candidate, group_by)
+        group = open_groups.get(key) if key is not None else None
+        if group is None or len(group) >= max(1, max_size):
+            group = []
+            groups.append(group)
+            if key is not None:
+                open_groups[key] = group
+        group.append(candidate)
+    return groups
+
+
+def mark_started(candidate: dict):
+    DeferredCandidate.objects.filter(callSite=candidate["callSite"]).delete()
+
+
+def defer_candidates(candidates: list[dict], run_id: str):
+    """Carry candidates over to the next run."""
+    for candidate in candidates:
+        payload = {key: value for key, value in candidate.items() if key != "deferrals"}
+        DeferredCandidate.objects.update_or_create(
+            callSite=candidate["callSite"],
+            defaults={
+                "traceId": candidate.get("traceId") or "",
+                "score": candidate["score"],
+                "severity": candidate["severity"],
+                "payload": payload,
+                "runId": run_id,
+                "deferrals": candidate.get("deferrals", 0) + 1,
+            },
+        )
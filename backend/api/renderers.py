@@ -0,0 +1,50 @@
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .fast_serializers import FastRows
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes FastRows with orjson when that yields identical bytes.
+
+    Anything else (or indented output, or a missing orjson) goes through the stock
+    JSONRenderer, so responses are byte-for-byte the same either way.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or not isinstance(data, FastRows)
+            or not data.orjson_safe
+            or self.ensure_ascii
+            or not self.compact
+            or not self.strict
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Same strict-javascript-subset escaping as JSONRenderer.
+        return orjson.dumps(data).replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets `text/event-stream` requests through content negotiation.
+
+    Streaming views return a StreamingHttpResponse directly, so this renderer only
+    ever sees regular Response data (for example a 400 error payload).
+    """
+
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return json.dumps(data).encode(self.charset)
@@ -0,0 +1,53 @@
+import json
+from pathlib import Path
+
+
+def _dump_files(paths):
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(candidate for candidate in path.rglob("*.json") if candidate.is_file())
+        elif path.exists():
+            yield path
+        else:
+            raise FileNotFoundError(f"Replay path does not exist: {path}")
+
+
+def trace_service(trace: dict, default: str = "") -> str:
+    """serviceName of the process that reported the trace's first parentless span."""
+    processes = trace.get("processes") or {}
+    spans = trace.get("spans") or []
+    root = next((span for span in spans if not span.get("references")), spans[0] if spans else None)
+    process = processes.get(root.get("processID")) if root else None
+    return (process or {}).get("serviceName") or default
+
+
+def iter_dump_traces(paths):
+    """Yield `(service_name, trace)` from captured Jaeger query API responses.
+
+    Accepts files or directories (searched recursively for *.json). Each file may hold an
+    `/api/traces` response (`{"data": [trace, ...]}`), a bare list of traces or a single
+    trace. `/api/services` responses (`{"data": ["svc", ...]}`) are recognised and skipped.
+    Traces seen in more than one file are replayed once.
+    """
+
+    seen = set()
+    for path in _dump_files(paths):
+        with open(path, encoding="utf-8") as dump_file:
+            payload = json.load(dump_file)
+
+        if isinstance(payload, dict) and "data" in payload:
+            items = payload.get("data") or []
+        elif isinstance(payload, list):
+            items = payload
+        else:
+            items = [payload]
+
+        for item in items:
+            if not isinstance(item, dict) or "spans" not in item:
+                continue
+            trace_id = item.get("traceID")
+            if trace_id is not None:
+                if trace_id in seen:
+                    continue
+                seen.add(trace_id)
+            yield trace_service(item, default=path.stem), item
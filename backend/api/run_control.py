@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+
+from agent.utils import process_limits
+
+from .models import DetectionRun
+
+
+class RunControl:
+    """Wall-clock budget, per-stage deadlines and the cancel flag of one detection run.
+
+    The run polls `stop_reason()` between units of work (a fetched trace, an analyzed
+    trace, an agent session) and stops early, keeping what it has done so far. Commands
+    the agent runs inside `stage(...)` are killed, with their process group, once the
+    stage or run deadline passes or the run is cancelled.
+
+    Stages may run their commands on other threads (see `agent.stages.StageGraph`); the
+    cancel lookup closes the database connections it opened there, since nothing else
+    would.
+    """
+
+    # Seconds between DetectionRun.cancelRequested lookups.
+    CANCEL_POLL_SECONDS = 1.0
+
+    def __init__(
+        self,
+        detection_run_id: int | None = None,
+        max_seconds: float = 3300,
+        stage_seconds: dict | None = None,
+        started_at: float | None = None,
+    ):
+        self.detection_run_id = detection_run_id
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.deadline = self.started_at + max_seconds
+        self.stage_seconds = stage_seconds or {}
+        self.stage_name = None
+        self.stage_deadline = None
+        self.stopped = None  # first reason the run stopped early
+        self._cancelled = False
+        self._checked_at = None
+        self._owner = threading.get_ident()
+
+    @classmethod
+    def from_env(cls, detection_run_id: int | None = None, started_at: float | None = None) -> "RunControl":
+        return cls(
+            detection_run_id,
+            # Below the hourly schedule, so a stuck run does not hold up the next slot.
+            max_seconds=float(os.getenv("DETECTION_RUN_MAX_SECONDS", "3300")),
+            stage_seconds={
+                "fetch": float(os.getenv("DETECTION_FETCH_SECONDS", "600")),
+                "analyze": float(os.getenv("DETECTION_ANALYZE_SECONDS", "900")),
+                "agent_session": float(os.getenv("AGENT_SESSION_SECONDS", os.getenv("CLAUDE_CODE_TIMEOUT", "1800"))),
+            },
+            started_at=started_at,
+        )
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def cancelled(self) -> bool:
+        if self._cancelled or self.detection_run_id is None:
+            return self._cancelled
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.CANCEL_POLL_SECONDS:
+            self._checked_at = now
+            try:
+                self._cancelled = DetectionRun.objects.filter(id=self.detection_run_id, cancelRequested=True).exists()
+            finally:
+                if threading.get_ident() != self._owner:
+                    connections.close_all()
+        return self._cancelled
+
+    def run_stop_reason(self) -> str | None:
+        """Why the whole run must stop ("cancelled" or "run_deadline"), else None."""
+        if self.cancelled():
+            reason = "cancelled"
+        elif time.monotonic() >= self.deadline:
+            reason = "run_deadline"
+        else:
+            return None
+        self.stopped = self.stopped or reason
+        return reason
+
+    def stop_reason(self) -> str | None:
+        """Why the current stage must stop: the run stopped, or "<stage>_deadline"."""
+        reason = self.run_stop_reason()
+        if reason is None and self.stage_deadline is not None and time.monotonic() >= self.stage_deadline:
+            reason = f"{self.stage_name}_deadline"
+        return reason
+
+    def begin(self, name: str):
+        """Start stage `name`; its configured seconds count from now."""
+        seconds = self.stage_seconds.get(name)
+        self.stage_name = name
+        self.stage_deadline = time.monotonic() + seconds if seconds else None
+
+    @contextmanager
+    def stage(self, name: str):
+        """`begin(name)` for the block, with child processes killed at the stage or run deadline."""
+        self.begin(name)
+        deadline = min(filter(None, (self.deadline, self.stage_deadline)))
+        reason = f"{name}_deadline" if deadline == self.stage_deadline else "run_deadline"
+        try:
+            with process_limits(deadline, reason=reason, stop_reason=self._process_stop_reason):
+                yield self
+        finally:
+            self.stage_name = None
+            self.stage_deadline = None
+
+    def _process_stop_reason(self) -> str | None:
+        if self.cancelled():
+            self.stopped = self.stopped or "cancelled"
+            return "cancelled"
+        return None
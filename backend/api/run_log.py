@@ -0,0 +1,55 @@
+import time
+
+from django.db import transaction
+
+from .models import Log
+
+
+class RunLogger:
+    """Buffers Log rows for one detection run and writes them in short batched transactions.
+
+    Called like the old per-row `log_event` helper. Rows are flushed once `batch_size`
+    are pending, when `flush_interval` seconds passed since the last flush, on
+    warnings/errors, and whenever `flush()` is called (do that before long steps so
+    streamed logs stay current).
+    """
+
+    def __init__(self, run_id: str, source: str = "detect_incidents", batch_size: int = 50, flush_interval: float = 1.0):
+        self.run_id = run_id
+        self.source = source
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    def __call__(self, step, message, *, level="info", context=None, incident=None, pull_request=None):
+        self._pending.append(
+            Log(
+                run_id=self.run_id,
+                source=self.source,
+                step=step,
+                level=level,
+                message=message,
+                context=context or {},
+                incident=incident,
+                pull_request=pull_request,
+            )
+        )
+        if (
+            level != "info"
+            or len(self._pending) >= self.batch_size
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            with transaction.atomic():
+                Log.objects.bulk_create(pending)
+        except Exception as exc:
+            steps = ", ".join(sorted({entry.step for entry in pending}))
+            print(f"Failed to persist {len(pending)} {self.source} logs ({steps}): {exc}")
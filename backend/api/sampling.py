@@ -0,0 +1,103 @@
+import random
+
+from .latency_sketch import LatencySketch
+
+
+class StratifiedTraceSampler:
+    """Bounded-size trace sample per stratum (service, route) that never drops the slow tail.
+
+    Each stratum keeps every trace at or above its `tail_quantile` latency and a uniform
+    reservoir (Algorithm R) of `reservoir_size` traces from the faster bulk. The tail
+    threshold comes from a sketch of every latency offered so far; the first `warmup`
+    traces of a stratum are buffered until the sketch is good enough to split them.
+
+    `sample()` returns `(trace, weight)` pairs: tail traces weigh 1, bulk traces weigh
+    `bulk seen / bulk kept`, so weighted sums estimate the totals over everything offered.
+    """
+
+    THRESHOLD_REFRESH = 32
+
+    def __init__(self, reservoir_size: int = 200, tail_quantile: float = 0.9, warmup: int = 50, rng=None):
+        self.reservoir_size = reservoir_size
+        self.tail_quantile = tail_quantile
+        self.warmup = warmup
+        self.rng = rng or random.Random()
+        self.strata = {}
+
+    def _stratum(self, key):
+        stratum = self.strata.get(key)
+        if stratum is None:
+            stratum = self.strata[key] = {
+                "sketch": LatencySketch(),
+                "warmup": [],
+                "tail": [],
+                "reservoir": [],
+                "bulkSeen": 0,
+                "threshold": None,
+                "thresholdAge": 0,
+            }
+        return stratum
+
+    def offer(self, key, duration: float, trace):
+        stratum = self._stratum(key)
+        stratum["sketch"].add(duration)
+        if stratum["warmup"] is not None:
+            stratum["warmup"].append((duration, trace))
+            if len(stratum["warmup"]) >= self.warmup:
+                self._end_warmup(stratum)
+            return
+        self._place(stratum, duration, trace)
+
+    def _end_warmup(self, stratum):
+        buffered, stratum["warmup"] = stratum["warmup"], None
+        for duration, trace in buffered:
+            self._place(stratum, duration, trace)
+
+    def _threshold(self, stratum):
+        # Re-reading the quantile walks the sketch's bins, so only refresh it periodically.
+        if stratum["threshold"] is None or stratum["thresholdAge"] >= self.THRESHOLD_REFRESH:
+            stratum["threshold"] = stratum["sketch"].quantile(self.tail_quantile)
+            stratum["thresholdAge"] = 0
+        stratum["thresholdAge"] += 1
+        return stratum["threshold"]
+
+    def _place(self, stratum, duration, trace):
+        if duration >= self._threshold(stratum):
+            stratum["tail"].append(trace)
+            return
+        stratum["bulkSeen"] += 1
+        reservoir = stratum["reservoir"]
+        if len(reservoir) < self.reservoir_size:
+            reservoir.append(trace)
+        else:
+            slot = self.rng.randrange(stratum["bulkSeen"])
+            if slot < self.reservoir_size:
+                reservoir[slot] = trace
+
+    def sample(self) -> list[tuple]:
+        sampled = []
+        for stratum in self.strata.values():
+            if stratum["warmup"] is not None:
+                self._end_warmup(stratum)
+            sampled.extend((trace, 1) for trace in stratum["tail"])
+            if stratum["reservoir"]:
+                weight = stratum["bulkSeen"] / len(stratum["reservoir"])
+                sampled.extend((trace, weight) for trace in stratum["reservoir"])
+        return sampled
+
+    def stats(self) -> list[dict]:
+        """Per-stratum counts and the bulk sample rate; call after `sample()`."""
+        rows = []
+        for (service, route), stratum in self.strata.items():
+            kept = len(stratum["reservoir"])
+            rows.append({
+                "service": service,
+                "route": route,
+                "seen": stratum["sketch"].count,
+                "tail": len(stratum["tail"]),
+                "bulkSeen": stratum["bulkSeen"],
+                "bulkKept": kept,
+                "bulkSampleRate": kept / stratum["bulkSeen"] if stratum["bulkSeen"] else 1.0,
+                "tailThresholdMicros": stratum["sketch"].quantile(self.tail_quantile),
+            })
+        return rows
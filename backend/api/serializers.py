@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import DetectionRun, Incident, Log, PullRequest
+from .models import DetectionRun, Incident, Log, MergedFix, PullRequest, RunCandidate
 
 
 class PullRequestSerializer(serializers.ModelSerializer):
@@ -15,6 +15,9 @@ class PullRequestSerializer(serializers.ModelSerializer):
             "title",
             "body",
             "compare_url",
+            "benchmark_base_ms",
+            "benchmark_head_ms",
+            "speedup",
             "created_at",
             "updated_at",
         ]
@@ -34,8 +37,19 @@ class IncidentSerializer(serializers.ModelSerializer):
             "solutionDescription",
             "timeImpact",
             "impactCount",
+            "queryPattern",
+            "repeatCount",
+            "callSite",
+            "hotspot",
+            "hotspotStack",
+            "verifiedSpeedup",
+            "meanAddedLatency",
+            "sampleRate",
+            "exampleTraceIds",
+            "affectedRoutes",
+            "updated_at",
         ]
-        read_only_fields = ["id"]
+        read_only_fields = ["id", "updated_at"]
 
 
 class LogSerializer(serializers.ModelSerializer):
@@ -62,9 +76,62 @@ class DetectionRunSerializer(serializers.ModelSerializer):
         fields = [
             "id",
             "date",
+            "runId",
             "runType",
             "status",
             "incidentCount",
             "errorMessage",
+            "cancelRequested",
+            "updated_at",
+        ]
+        read_only_fields = fields
+
+
+class MergedFixSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MergedFix
+        fields = [
+            "id",
+            "callSite",
+            "routes",
+            "incidentTitle",
+            "pullRequestTitle",
+            "repo",
+            "headBranch",
+            "mergeSha",
+            "mergedAt",
+            "verifiedSpeedup",
+            "beforeCount",
+            "afterCount",
+            "beforeP50",
+            "beforeP95",
+            "afterP50",
+            "afterP95",
+            "p50Change",
+            "p95Change",
+            "status",
+            "checkedAt",
+            "updated_at",
         ]
         read_only_fields = fields
+
+
+class RunCandidateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RunCandidate
+        fields = [
+            "id",
+            "detectionRun",
+            "position",
+            "groupIndex",
+            "callSite",
+            "traceId",
+            "score",
+            "status",
+            "attempts",
+            "errorMessage",
+            "pullRequest",
+            "updated_at",
+        ]
+        read_only_fields = fields
+
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import DetectionRun, Incident
+from .stats import invalidate_stats
+
+
+# run_detection_with_tracking saves its DetectionRun on start and on completion,
+# so both transitions invalidate the cached dashboard stats.
+@receiver(post_save, sender=Incident)
+@receiver(post_delete, sender=Incident)
+@receiver(post_save, sender=DetectionRun)
+@receiver(post_delete, sender=DetectionRun)
+def _invalidate_stats(sender, **kwargs):
+    invalidate_stats()
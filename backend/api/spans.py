@@ -0,0 +1,201 @@
+import re
+from urllib.parse import urlsplit
+
+
+_ID_SEGMENT_RE = re.compile(
+    r"^(?:\d+"
+    r"|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+    r"|[0-9a-fA-F]{16,}"
+    r"|c[a-z0-9]{24})$"
+)
+
+
+def normalize_route(target: str | None) -> str:
+    """Collapse ids in a request path: `/matches/123?x=1` -> `/matches/:id`.
+
+    Numeric, UUID, long hex and cuid segments are treated as ids.
+    """
+
+    if not target:
+        return "unknown"
+    path = urlsplit(str(target)).path or "/"
+    segments = [":id" if _ID_SEGMENT_RE.match(segment) else segment for segment in path.split("/")]
+    route = "/".join(segments)
+    if len(route) > 1:
+        route = route.rstrip("/")
+    return route or "/"
+
+
+def span_tags(span) -> dict:
+    """Flatten a Jaeger span's `tags` list into a key -> value dict."""
+    if not span:
+        return {}
+    return {tag.get("key"): tag.get("value") for tag in span.get("tags") or [] if isinstance(tag, dict)}
+
+
+def parent_span_id(span) -> str | None:
+    """Return the spanID this span is a CHILD_OF (falling back to its first reference)."""
+    references = span.get("references") or []
+    for reference in references:
+        if reference.get("refType") == "CHILD_OF":
+            return reference.get("spanID")
+    if references:
+        return references[0].get("spanID")
+    return span.get("parentSpanID")
+
+
+def enclosing_span(span, spans_by_id: dict, operation_name: str):
+    """Walk up the parent chain and return the nearest ancestor with `operation_name`."""
+    seen = set()
+    parent_id = parent_span_id(span)
+    while parent_id and parent_id not in seen:
+        seen.add(parent_id)
+        parent = spans_by_id.get(parent_id)
+        if parent is None:
+            return None
+        if parent.get("operationName") == operation_name:
+            return parent
+        parent_id = parent_span_id(parent)
+    return None
+
+
+def span_end(span) -> int:
+    return (span.get("startTime") or 0) + (span.get("duration") or 0)
+
+
+class SpanTree:
+    """In-memory parent/child index over one trace's spans, built from `references`."""
+
+    def __init__(self, spans):
+        self.spans = {span.get("spanID"): span for span in spans if span.get("spanID")}
+        self.children = {span_id: [] for span_id in self.spans}
+        self.parents = {}
+        self.roots = []
+        for span_id, span in self.spans.items():
+            parent_id = parent_span_id(span)
+            if parent_id in self.spans and parent_id != span_id:
+                self.parents[span_id] = parent_id
+                self.children[parent_id].append(span_id)
+            else:
+                self.roots.append(span_id)
+        self._nearest = {}  # (operation name, span id) -> nearest matching span id
+        self._critical_path = None
+
+    @property
+    def root(self) -> str | None:
+        """The longest root span; other roots are usually orphans whose parent was not reported."""
+        if not self.roots:
+            return None
+        return max(self.roots, key=lambda span_id: self.spans[span_id].get("duration") or 0)
+
+    @property
+    def duration(self) -> int:
+        root = self.root
+        return (self.spans[root].get("duration") or 0) if root else 0
+
+    def self_time(self, span_id: str) -> int:
+        """Exclusive time: the span's duration minus the union of its children's intervals."""
+        span = self.spans[span_id]
+        start, end = span.get("startTime") or 0, span_end(span)
+        intervals = sorted(
+            (max(start, self.spans[child].get("startTime") or 0), min(end, span_end(self.spans[child])))
+            for child in self.children[span_id]
+        )
+        covered, cursor = 0, start
+        for child_start, child_end in intervals:
+            child_start = max(child_start, cursor)
+            if child_end > child_start:
+                covered += child_end - child_start
+                cursor = child_end
+        return (span.get("duration") or 0) - covered
+
+    def critical_path(self) -> dict[str, int]:
+        """Map span id -> microseconds it contributes to the root span's critical path.
+
+        Walks back from the root's end, always descending into the child that finished
+        last before the cursor; time not covered by such a child belongs to the parent.
+        Parallel siblings that finished earlier contribute nothing. Computed once per tree.
+        """
+        if self._critical_path is not None:
+            return self._critical_path
+        contributions = self._critical_path = {}
+        root = self.root
+        if root is None:
+            return contributions
+
+        stack = [(root, span_end(self.spans[root]))]
+        while stack:
+            span_id, cursor = stack.pop()
+            span = self.spans[span_id]
+            start = span.get("startTime") or 0
+            cursor = min(cursor, span_end(span))
+            own = 0
+            for child_id in sorted(self.children[span_id], key=lambda c: span_end(self.spans[c]), reverse=True):
+                if cursor <= start:
+                    break
+                child = self.spans[child_id]
+                child_start = child.get("startTime") or 0
+                if child_start >= cursor or span_end(child) <= start:
+                    continue
+                child_end = min(span_end(child), cursor)
+                own += cursor - child_end
+                stack.append((child_id, child_end))
+                cursor = max(child_start, start)
+            own += max(0, cursor - start)
+            contributions[span_id] = contributions.get(span_id, 0) + own
+        return contributions
+
+    def nearest(self, span_id: str, operation_name: str) -> str | None:
+        """Closest ancestor-or-self span with `operation_name`, memoized per span."""
+        path = []
+        found = None
+        current = span_id
+        while current is not None:
+            if (operation_name, current) in self._nearest:
+                found = self._nearest[(operation_name, current)]
+                break
+            path.append(current)
+            if self.spans[current].get("operationName") == operation_name:
+                found = current
+                break
+            current = self.parents.get(current)
+        for visited in path:
+            self._nearest[(operation_name, visited)] = found
+        return found
+
+
+def trace_route(tree: SpanTree) -> str:
+    """Normalized route of the request a trace belongs to.
+
+    Prefers `http.route` (set by the Express instrumentation), then `http.target`/`url.path`
+    of the root span, then of any span.
+    """
+
+    root = tree.spans.get(tree.root)
+    ordered = ([root] if root else []) + [span for span_id, span in tree.spans.items() if span_id != tree.root]
+    for keys in (("http.route",), ("http.target", "url.path")):
+        for span in ordered:
+            tags = span_tags(span)
+            for key in keys:
+                if tags.get(key):
+                    return normalize_route(tags[key])
+    return "unknown"
+
+
+def trace_profile(spans) -> tuple[str, int]:
+    """Cheap (route, duration) of a trace without building a SpanTree, for sampling.
+
+    The duration is that of the longest span, which is the root span for complete traces.
+    """
+
+    longest = max(spans, key=lambda span: span.get("duration") or 0, default=None)
+    if longest is None:
+        return "unknown", 0
+    route = None
+    for span in spans:
+        tags = span_tags(span)
+        if tags.get("http.route"):
+            return normalize_route(tags["http.route"]), longest.get("duration") or 0
+        if route is None and (tags.get("http.target") or tags.get("url.path")):
+            route = tags.get("http.target") or tags.get("url.path")
+    return normalize_route(route), longest.get("duration") or 0
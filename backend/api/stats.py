@@ -0,0 +1,113 @@
+from datetime import timedelta
+
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DetectionRun, Incident, StatsSummary
+
+
+DASHBOARD_STATS_KEY = "dashboard"
+TREND_DAYS = 30
+
+# Counted per status; "running" and "queued" are only in the totals.
+RUN_STATUSES = ("success", "failure", "cancelled", "timeout", "partial")
+# Runs that ended on their own. Cancelled runs were stopped by a user and say nothing
+# about reliability; timed-out and partial runs count against the success rate.
+RATED_RUN_STATUSES = ("success", "failure", "timeout", "partial")
+
+
+def _status_counts(*statuses) -> dict:
+    return {status: Count("id", filter=Q(status=status)) for status in statuses}
+
+
+def invalidate_stats():
+    """Mark the cached dashboard stats as stale. Costs a single UPDATE."""
+    StatsSummary.objects.filter(key=DASHBOARD_STATS_KEY).update(version=F("version") + 1)
+
+
+def compute_stats(now=None) -> dict:
+    now = now or timezone.now()
+    trend_start = (now - timedelta(days=TREND_DAYS - 1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    incident_totals = Incident.objects.aggregate(total=Count("id"), timeImpact=Sum("timeImpact"))
+    by_severity = {
+        severity: {"count": 0, "timeImpact": 0.0}
+        for severity, _label in Incident.SEVERITY_CHOICES
+    }
+    for row in Incident.objects.order_by().values("severity").annotate(count=Count("id"), timeImpact=Sum("timeImpact")):
+        by_severity[row["severity"]] = {"count": row["count"], "timeImpact": row["timeImpact"] or 0.0}
+
+    incidents_by_day = [
+        {"date": row["day"].isoformat(), "count": row["count"], "timeImpact": row["timeImpact"] or 0.0}
+        for row in Incident.objects.filter(created_at__gte=trend_start)
+        .annotate(day=TruncDate("created_at"))
+        .order_by("day")
+        .values("day")
+        .annotate(count=Count("id"), timeImpact=Sum("timeImpact"))
+    ]
+
+    run_totals = DetectionRun.objects.aggregate(
+        total=Count("id"),
+        **_status_counts(*RUN_STATUSES, "running", "queued"),
+        incidentCount=Sum("incidentCount"),
+    )
+    rated = sum(run_totals[status] for status in RATED_RUN_STATUSES)
+
+    runs_by_day = [
+        {
+            "date": row["day"].isoformat(),
+            "total": row["total"],
+            **{status: row[status] for status in RUN_STATUSES},
+            "incidentCount": row["incidentCount"] or 0,
+        }
+        for row in DetectionRun.objects.filter(date__gte=trend_start)
+        .annotate(day=TruncDate("date"))
+        .order_by("day")
+        .values("day")
+        .annotate(
+            total=Count("id"),
+            **_status_counts(*RUN_STATUSES),
+            incidentCount=Sum("incidentCount"),
+        )
+    ]
+
+    return {
+        "incidents": {
+            "total": incident_totals["total"],
+            "totalTimeImpact": incident_totals["timeImpact"] or 0.0,
+            "bySeverity": by_severity,
+            "byDay": incidents_by_day,
+        },
+        "detectionRuns": {
+            "total": run_totals["total"],
+            **{status: run_totals[status] for status in (*RUN_STATUSES, "running", "queued")},
+            "incidentCount": run_totals["incidentCount"] or 0,
+            "successRate": round(run_totals["success"] / rated, 4) if rated else None,
+            "byDay": runs_by_day,
+        },
+        "trendDays": TREND_DAYS,
+        "computedAt": now.isoformat(),
+    }
+
+
+def get_dashboard_stats() -> dict:
+    """Return the cached dashboard stats, recomputing them only after an invalidation
+    or when the day changed (the trend window moves even when nothing is written)."""
+
+    summary, _created = StatsSummary.objects.get_or_create(key=DASHBOARD_STATS_KEY)
+    if (
+        summary.computed_version == summary.version
+        and summary.computed_at is not None
+        and timezone.localdate(summary.computed_at) == timezone.localdate()
+    ):
+        return summary.payload
+
+    payload = compute_stats()
+    # Skip the write if another invalidation landed while computing; the next read recomputes.
+    StatsSummary.objects.filter(key=DASHBOARD_STATS_KEY, version=summary.version).update(
+        payload=payload,
+        computed_version=summary.version,
+        computed_at=timezone.now(),
+    )
+    return payload
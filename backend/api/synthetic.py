@@ -0,0 +1,91 @@
+import random
+
+
+ROUTES = ("/matches/{id}", "/leaderboards", "/users/{id}/games", "/models/{id}", "/health")
+
+
+def _span(trace_id, span_id, operation, start, duration, parent=None, tags=None, process_id="p1"):
+    return {
+        "traceID": trace_id,
+        "spanID": span_id,
+        "operationName": operation,
+        "references": [{"refType": "CHILD_OF", "traceID": trace_id, "spanID": parent}] if parent else [],
+        "startTime": start,
+        "duration": duration,
+        "tags": [{"key": key, "type": "string", "value": value} for key, value in (tags or {}).items()],
+        "processID": process_id,
+    }
+
+
+def _call_operation(spans, trace_id, prefix, start, query_micros, frame, query, root_id):
+    """prisma:call-operation -> prisma:engine:query -> prisma:client:db_query, back to back."""
+    overhead = max(1, query_micros // 20)
+    spans.append(_span(trace_id, f"{prefix}c", "prisma:call-operation", start, query_micros + 2 * overhead, root_id,
+                       {"prisma.frame": frame, "prisma.args": "{}"}))
+    spans.append(_span(trace_id, f"{prefix}e", "prisma:engine:query", start + overhead // 2, query_micros + overhead,
+                       f"{prefix}c"))
+    spans.append(_span(trace_id, f"{prefix}q", "prisma:client:db_query", start + overhead, query_micros, f"{prefix}e",
+                       {"db.query.text": query}))
+    return start + query_micros + 2 * overhead
+
+
+def generate_traces(
+    total_spans: int,
+    services: int = 3,
+    spans_per_trace: int = 25,
+    n_plus_one_rate: float = 0.2,
+    n_plus_one_repeats: int = 10,
+    slow_rate: float = 0.05,
+    median_query_ms: float = 4.0,
+    sigma: float = 0.8,
+    seed: int = 0,
+):
+    """Yield `(service_name, trace)` pairs shaped like Jaeger's /api/traces output, until `total_spans`.
+
+    Every trace is an HTTP root span over sequential Prisma call operations (three spans
+    each). Query latencies are log-normal around `median_query_ms`; `slow_rate` of the
+    traces get one query slow enough to push the request past two seconds, and
+    `n_plus_one_rate` of them spend their call operations on a findMany followed by
+    `n_plus_one_repeats` identical per-row lookups from one call site.
+    """
+
+    rng = random.Random(seed)
+    call_operations = max(1, (spans_per_trace - 1) // 3)
+    produced = 0
+    trace_number = 0
+    while produced < total_spans:
+        trace_number += 1
+        trace_id = f"{seed:04x}{trace_number:028x}"
+        service = f"service-{trace_number % services}"
+        route = rng.choice(ROUTES)
+        target = route.replace("{id}", str(rng.randrange(1, 10_000)))
+        root_start = 1_700_000_000_000_000 + trace_number * 1_000
+
+        spans = []
+        cursor = root_start + 200
+        n_plus_one = rng.random() < n_plus_one_rate
+        slow_index = rng.randrange(call_operations) if rng.random() < slow_rate else None
+        for index in range(call_operations):
+            query_micros = max(50, int(rng.lognormvariate(0, sigma) * median_query_ms * 1000))
+            if index == slow_index:
+                query_micros += 2_000_000 + rng.randrange(3_000_000)
+            if n_plus_one and 0 < index <= n_plus_one_repeats:
+                frame = f"at {service} (src/routes{route}.ts:51:38)"
+                query = f'SELECT "public"."Match"."id" FROM "public"."Match" WHERE "public"."Match"."modelId" = {index}'
+            else:
+                frame = f"at {service} (src/routes{route}.ts:{40 + index}:12)"
+                query = f'SELECT "public"."Model{index}"."id" FROM "public"."Model{index}" WHERE 1=1 LIMIT $1'
+            cursor = _call_operation(spans, trace_id, f"s{index}", cursor, query_micros, frame, query, "root")
+
+        spans.insert(0, _span(trace_id, "root", "GET", root_start, cursor + 300 - root_start, tags={
+            "http.method": "GET",
+            "http.route": route.replace("{id}", ":id"),
+            "http.target": target,
+        }))
+        produced += len(spans)
+        yield service, {
+            "traceID": trace_id,
+            "spans": spans,
+            "processes": {"p1": {"serviceName": service, "tags": []}},
+            "warnings": None,
+        }
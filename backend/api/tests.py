@@ -1,3 +1,1727 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import random
+import struct
+import subprocess
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections, transaction
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .baselines import REQUEST, compare_and_update_baselines, record_latency
+from .checkpoints import RunCheckpoint
+from .code_index import CodeIndex, parse_source
+from .fast_serializers import FastRows, get_row_mapper
+from .hotspots import HotspotTree, parse_frame
+from .job_queue import claim, finish, heartbeat
+from .latency_sketch import LatencySketch
+from .live import LiveTraceAnalyzer
+from .log_stream import stream_run_logs
+from .n_plus_one import fingerprint_query, find_n_plus_one
+from .otlp import decode_export_request
+from .replay import iter_dump_traces
+from .run_log import RunLogger
+from .sampling import StratifiedTraceSampler
+from .spans import SpanTree, normalize_route
+from .stats import TREND_DAYS
+from .synthetic import generate_traces
+from .trace_store import TraceStore
+from .models import (
+    AgentJob,
+    DeferredCandidate,
+    DetectionRun,
+    Incident,
+    LatencyBaseline,
+    Log,
+    MergedFix,
+    PullRequest,
+    StatsSummary,
+)
+from .serializers import DetectionRunSerializer, IncidentSerializer, LogSerializer
+from .views import create_prompt_from_incident, detect_incidents, resume_detection_run, run_detection_with_tracking
+from .run_control import RunControl
+
+from agent.benchmark import verify_from_env, verify_speedup
+from agent.stages import StageGraph
+from agent.utils import ProcessStopped, process_limits, run_process, sh
+from agent.workspaces import WorkspacePool, workspace_pool
+
+
+class LogStreamTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def _log(self, run_id, step, message="msg"):
+        return Log.objects.create(run_id=run_id, step=step, message=message)
+
+    def _read(self, response):
+        return b"".join(response.streaming_content).decode()
+
+    def test_streams_logs_of_finished_run_and_closes(self):
+        DetectionRun.objects.create(runType="manual", runId="run-a", status="success")
+        first = self._log("run-a", "start")
+        second = self._log("run-a", "complete")
+        self._log("run-b", "start")
+
+        response = self.client.get("/api/logs/stream/", {"run_id": "run-a"}, HTTP_ACCEPT="text/event-stream")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = self._read(response)
+        self.assertIn(f"id: {first.id}\nevent: log\n", body)
+        self.assertIn(f"id: {second.id}\nevent: log\n", body)
+        self.assertEqual(body.count("event: log"), 2)
+        self.assertTrue(body.endswith('data: {"run_id":"run-a","status":"success"}\n\n'))
+
+    def test_resumes_after_last_event_id(self):
+        DetectionRun.objects.create(runType="manual", runId="run-a", status="failure")
+        first = self._log("run-a", "start")
+        second = self._log("run-a", "fetch_services")
+
+        response = self.client.get(
+            "/api/logs/stream/",
+            {"run_id": "run-a"},
+            HTTP_ACCEPT="text/event-stream",
+            HTTP_LAST_EVENT_ID=str(first.id),
+        )
+
+        body = self._read(response)
+        self.assertNotIn(f"id: {first.id}\nevent: log", body)
+        self.assertIn(f"id: {second.id}\nevent: log", body)
+
+    def test_defaults_to_latest_tracked_run(self):
+        DetectionRun.objects.create(runType="manual", runId="old", status="success")
+        DetectionRun.objects.create(runType="automatic", runId="new", status="success")
+        self._log("new", "start")
+
+        body = self._read(self.client.get("/api/logs/stream/", HTTP_ACCEPT="text/event-stream"))
+
+        self.assertIn('"run_id":"new"', body)
+
+    def test_rejects_invalid_last_event_id(self):
+        response = self.client.get(
+            "/api/logs/stream/",
+            {"run_id": "run-a", "last_event_id": "abc"},
+            HTTP_ACCEPT="text/event-stream",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_running_run_emits_heartbeats_until_deadline(self):
+        DetectionRun.objects.create(runType="manual", runId="run-a", status="running")
+
+        frames = list(stream_run_logs("run-a", poll_interval=0.01, heartbeat_interval=0, max_seconds=0.05))
+
+        self.assertIn(": heartbeat\n\n", frames)
+        self.assertFalse(any("event: end" in frame for frame in frames))
+
+
+class ConditionalListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def _incident(self, title="For /matches caused by N+1 queries"):
+        return Incident.objects.create(
+            title=title,
+            problemDescription="slow",
+            solutionDescription="batch",
+            timeImpact=2.5,
+            impactCount=3,
+        )
+
+    def test_unchanged_list_returns_not_modified(self):
+        self._incident()
+        first = self.client.get("/api/incidents/")
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("ETag", first)
+        self.assertIn("Last-Modified", first)
+
+        second = self.client.get("/api/incidents/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b"")
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_update_and_delete_change_etag(self):
+        incident = self._incident()
+        other = self._incident("For /teams caused by slow joins")
+        etag = self.client.get("/api/incidents/")["ETag"]
+
+        incident.title = "For /matches caused by missing index"
+        incident.save()
+        updated_etag = self.client.get("/api/incidents/")["ETag"]
+        self.assertNotEqual(updated_etag, etag)
+
+        other.delete()
+        response = self.client.get("/api/incidents/", HTTP_IF_NONE_MATCH=updated_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_filters_are_part_of_the_validator(self):
+        Log.objects.create(run_id="run-a", step="start", message="a")
+        Log.objects.create(run_id="run-b", step="start", message="b")
+        etag = self.client.get("/api/logs/", {"run_id": "run-a"})["ETag"]
+
+        response = self.client.get("/api/logs/", {"run_id": "run-b"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get("/api/logs/", {"run_id": "run-a"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_delete_inside_limited_window_changes_etag(self):
+        runs = [DetectionRun.objects.create(runType="manual", runId=f"run-{i}") for i in range(3)]
+        etag = self.client.get("/api/detection-runs/", {"limit": 2})["ETag"]
+
+        # The oldest run slides into the window; count, max id and max updated_at stay the same.
+        runs[1].delete()
+
+        response = self.client.get("/api/detection-runs/", {"limit": 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([run["runId"] for run in response.json()], ["run-2", "run-0"])
+
+    def test_set_null_cascades_change_etag(self):
+        pull_request = PullRequest.objects.create(
+            repo_owner="acme", repo_name="shop", repo_url="https://github.com/acme/shop",
+            base_branch="main", head_branch="claude/fix-1", title="PR 1", body="report",
+        )
+        incident = self._incident()
+        incident.pullRequest = pull_request
+        incident.save()
+        Log.objects.create(run_id="run-a", step="start", message="a", incident=incident, pull_request=pull_request)
+        incidents_etag = self.client.get("/api/incidents/")["ETag"]
+        logs_etag = self.client.get("/api/logs/")["ETag"]
+
+        # SET_NULL runs as a queryset UPDATE: no auto_now, no signals.
+        pull_request.delete()
+        response = self.client.get("/api/incidents/", HTTP_IF_NONE_MATCH=incidents_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()[0]["pullRequest"])
+        logs_etag_after_pr = self.client.get("/api/logs/", HTTP_IF_NONE_MATCH=logs_etag)
+        self.assertEqual(logs_etag_after_pr.status_code, 200)
+
+        incident.delete()
+        response = self.client.get("/api/logs/", HTTP_IF_NONE_MATCH=logs_etag_after_pr["ETag"])
+        self.assertEqual(response.status_code, 200)
+
+    def test_detection_run_status_change_invalidates(self):
+        run = DetectionRun.objects.create(runType="manual", runId="run-a", status="running")
+        etag = self.client.get("/api/detection-runs/", {"limit": 5})["ETag"]
+
+        run.status = "success"
+        run.save(update_fields=["status", "updated_at"])
+
+        response = self.client.get("/api/detection-runs/", {"limit": 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class StatsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def _incident(self, severity, time_impact):
+        return Incident.objects.create(
+            title="For /matches caused by N+1 queries",
+            problemDescription="slow",
+            solutionDescription="batch",
+            severity=severity,
+            timeImpact=time_impact,
+            impactCount=1,
+        )
+
+    def test_aggregates_incidents_and_runs(self):
+        self._incident("high", 2.5)
+        self._incident("high", 1.5)
+        self._incident("low", 0.5)
+        DetectionRun.objects.create(runType="manual", status="success", incidentCount=3)
+        DetectionRun.objects.create(runType="automatic", status="failure")
+        for status in ("cancelled", "timeout", "partial", "running"):
+            DetectionRun.objects.create(runType="automatic", status=status)
+
+        data = self.client.get("/api/stats/").json()
+
+        self.assertEqual(data["incidents"]["total"], 3)
+        self.assertAlmostEqual(data["incidents"]["totalTimeImpact"], 4.5)
+        self.assertEqual(data["incidents"]["bySeverity"]["high"], {"count": 2, "timeImpact": 4.0})
+        self.assertEqual(data["incidents"]["bySeverity"]["blocker"], {"count": 0, "timeImpact": 0.0})
+        self.assertEqual(data["incidents"]["byDay"][0]["count"], 3)
+        runs = data["detectionRuns"]
+        self.assertEqual(runs["total"], 6)
+        statuses = ("success", "failure", "cancelled", "timeout", "partial", "running")
+        self.assertEqual(sum(runs[status] for status in statuses), runs["total"])
+        self.assertEqual((runs["byDay"][0]["total"], runs["byDay"][0]["timeout"]), (6, 1))
+        # Cancelled runs are left out of the success rate; timed-out and partial ones count against it.
+        self.assertEqual(runs["successRate"], 0.25)
+        self.assertEqual(data["detectionRuns"]["incidentCount"], 3)
+
+    def test_serves_cached_payload_until_invalidated(self):
+        incident = self._incident("medium", 1.0)
+        self.assertEqual(self.client.get("/api/stats/").json()["incidents"]["total"], 1)
+
+        with self.assertNumQueries(1):
+            self.client.get("/api/stats/")
+
+        incident.delete()
+        summary = StatsSummary.objects.get()
+        self.assertNotEqual(summary.version, summary.computed_version)
+        self.assertEqual(self.client.get("/api/stats/").json()["incidents"]["total"], 0)
+
+    def test_cached_payload_rolls_over_at_midnight(self):
+        self._incident("medium", 1.0)
+        self.assertEqual(len(self.client.get("/api/stats/").json()["incidents"]["byDay"]), 1)
+
+        # Nothing was written, but the incident's day has left the trend window.
+        later = timezone.now() + timedelta(days=TREND_DAYS)
+        with mock.patch("django.utils.timezone.now", return_value=later):
+            data = self.client.get("/api/stats/").json()
+        self.assertEqual(data["incidents"]["byDay"], [])
+        self.assertEqual(data["computedAt"], later.isoformat())
+
+
+class FastListSerializationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        pull_request = PullRequest.objects.create(
+            repo_owner="acme",
+            repo_name="shop",
+            repo_url="https://github.com/acme/shop",
+            base_branch="main",
+            head_branch="claude/fix-1",
+            title="Batch match lookups",
+            body="report",
+        )
+        incident = Incident.objects.create(
+            pullRequest=pull_request,
+            url="/matches/:id",
+            title="For /matches caused by N+1 queries \u2028 \u00e9t\u00e9",
+            problemDescription='Quotes " and \\ backslashes\n',
+            solutionDescription="batch",
+            severity="critical",
+            timeImpact=2.35,
+            impactCount=7,
+        )
+        Incident.objects.create(
+            title="For /teams caused by slow joins",
+            problemDescription="slow",
+            solutionDescription="index",
+            timeImpact=0.0,
+            impactCount=0,
+        )
+        Log.objects.create(
+            run_id="run-a",
+            step="analyze_trace_output",
+            message="Detected slow trace candidate \U0001f40c",
+            context={"trace_id": "abc", "duration_micros": 2_500_000, "nested": [1.5, None, True, {"k": "v"}]},
+            incident=incident,
+            pull_request=pull_request,
+        )
+        Log.objects.create(run_id="run-a", step="start", message="start")
+        DetectionRun.objects.create(runType="manual", runId="run-a", status="failure", errorMessage="boom")
+        DetectionRun.objects.create(runType="automatic", runId="run-b", status="success", incidentCount=2)
+
+    def _expected(self, serializer_class, queryset):
+        return JSONRenderer().render(serializer_class(queryset, many=True).data, "application/json", {})
+
+    def test_list_bytes_match_model_serializer(self):
+        cases = [
+            ("/api/incidents/", IncidentSerializer, Incident.objects.order_by("-id")),
+            ("/api/logs/", LogSerializer, Log.objects.order_by("-created_at", "-id")),
+            ("/api/detection-runs/", DetectionRunSerializer, DetectionRun.objects.order_by("-date", "-id")),
+        ]
+        for url, serializer_class, queryset in cases:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_ACCEPT="application/json")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, self._expected(serializer_class, queryset))
+
+    def test_unsafe_floats_fall_back_to_stdlib_encoding(self):
+        Log.objects.create(run_id="run-c", step="analyze_trace", message="tiny", context={"ratio": 1e-05})
+        queryset = Log.objects.filter(run_id="run-c")
+
+        rows = get_row_mapper(LogSerializer).serialize(queryset)
+
+        self.assertIsInstance(rows, FastRows)
+        self.assertFalse(rows.orjson_safe)
+        response = self.client.get("/api/logs/", {"run_id": "run-c"}, HTTP_ACCEPT="application/json")
+        self.assertIn(b'"ratio":1e-05', response.content)
+        self.assertEqual(response.content, self._expected(LogSerializer, queryset.order_by("-created_at", "-id")))
+
+    def test_large_floats_fall_back_to_stdlib_encoding(self):
+        Log.objects.create(run_id="run-d", step="analyze_trace", message="huge", context={"bytes": 1e16, "max": -2.5e300})
+        queryset = Log.objects.filter(run_id="run-d")
+
+        self.assertFalse(get_row_mapper(LogSerializer).serialize(queryset).orjson_safe)
+        response = self.client.get("/api/logs/", {"run_id": "run-d"}, HTTP_ACCEPT="application/json")
+        self.assertIn(b'"bytes":1e+16', response.content)
+        self.assertEqual(response.content, self._expected(LogSerializer, queryset.order_by("-created_at", "-id")))
+
+
+class RunLoggerTests(TestCase):
+    def test_buffers_until_batch_size_and_flush(self):
+        log_event = RunLogger("run-a", batch_size=3, flush_interval=3600)
+        log_event("start", "one")
+        log_event("config", "two")
+        self.assertEqual(Log.objects.count(), 0)
+
+        log_event("fetch_services", "three")
+        self.assertEqual(Log.objects.count(), 3)
+
+        log_event("fetch_traces", "four")
+        log_event.flush()
+        self.assertEqual(list(Log.objects.order_by("id").values_list("step", flat=True)),
+                         ["start", "config", "fetch_services", "fetch_traces"])
+
+    def test_errors_are_written_immediately(self):
+        log_event = RunLogger("run-a", batch_size=100, flush_interval=3600)
+        log_event("start", "one")
+        log_event("fetch_services", "boom", level="error")
+        self.assertEqual(Log.objects.filter(run_id="run-a").count(), 2)
+
+
+class SQLiteConcurrencyStressTests(SimpleTestCase):
+    """Scheduler-style batched writers racing API-style readers on a file database."""
+
+    alias = "sqlite_stress"
+    # The alias only exists while this class runs, so it cannot be named up front.
+    databases = "__all__"
+    writers = 2
+    readers = 4
+    batches = 60
+    batch_size = 25
+
+    @classmethod
+    def setUpClass(cls):
+        handle, cls.path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(handle)
+        connections.settings[cls.alias] = {
+            **connections.settings["default"],
+            "NAME": cls.path,
+            "OPTIONS": settings.SQLITE_TUNED_OPTIONS,
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.alias].close()
+        del connections.settings[cls.alias]
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(cls.path + suffix):
+                os.remove(cls.path + suffix)
+
+    def _run_thread(self, target, errors):
+        try:
+            target()
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connections[self.alias].close()
+
+    def test_tuned_mode_handles_concurrent_writes_and_reads(self):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("CREATE TABLE stress_log (id INTEGER PRIMARY KEY, writer INTEGER, message TEXT)")
+
+        done = threading.Event()
+        reads = []
+
+        def write(writer):
+            for batch in range(self.batches):
+                with transaction.atomic(using=self.alias):
+                    with connections[self.alias].cursor() as cursor:
+                        # Read-then-write inside the transaction: deadlocks without BEGIN IMMEDIATE.
+                        cursor.execute("SELECT COUNT(*) FROM stress_log WHERE writer = %s", [writer])
+                        cursor.executemany(
+                            "INSERT INTO stress_log (writer, message) VALUES (%s, %s)",
+                            [(writer, f"batch {batch} row {row}") for row in range(self.batch_size)],
+                        )
+
+        def read():
+            while not done.is_set():
+                with connections[self.alias].cursor() as cursor:
+                    cursor.execute("SELECT COUNT(*), MAX(id) FROM stress_log")
+                    reads.append(cursor.fetchone()[0])
+
+        errors = []
+        writer_threads = [
+            threading.Thread(target=self._run_thread, args=(lambda w=w: write(w), errors)) for w in range(self.writers)
+        ]
+        reader_threads = [threading.Thread(target=self._run_thread, args=(read, errors)) for _ in range(self.readers)]
+        for thread in reader_threads + writer_threads:
+            thread.start()
+        for thread in writer_threads:
+            thread.join()
+        done.set()
+        for thread in reader_threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertTrue(reads)
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM stress_log")
+            self.assertEqual(cursor.fetchone()[0], self.writers * self.batches * self.batch_size)
+
+
+def make_span(span_id, operation, duration, parent=None, tags=None, start=0, trace_id="t1"):
+    return {
+        "traceID": trace_id,
+        "spanID": span_id,
+        "operationName": operation,
+        "startTime": start,
+        "duration": duration,
+        "references": [{"refType": "CHILD_OF", "traceID": trace_id, "spanID": parent}] if parent else [],
+        "tags": [{"key": key, "type": "string", "value": value} for key, value in (tags or {}).items()],
+    }
+
+
+def make_n_plus_one_trace(trace_id="t1", repeats=5, query_duration=400_000, frame="at <anonymous> (src/index.ts:51:38)"):
+    """GET /leaderboards: one findMany for the models, then one findMany per model."""
+    spans = [
+        make_span("root", "GET", 2_500_000, tags={"http.target": "/leaderboards"}, trace_id=trace_id),
+        make_span("op0", "prisma:call-operation", 50_000, parent="root", trace_id=trace_id,
+                  tags={"prisma.frame": "at <anonymous> (src/index.ts:47:38)", "prisma.args": "{}"}),
+        make_span("q0", "prisma:client:db_query", 40_000, parent="op0", trace_id=trace_id,
+                  tags={"db.query.text": 'SELECT "public"."AIModel"."id" FROM "public"."AIModel" WHERE 1=1 OFFSET $1'}),
+    ]
+    for i in range(repeats):
+        spans.append(make_span(f"op{i + 1}", "prisma:call-operation", query_duration + 10_000, parent="root",
+                               trace_id=trace_id, tags={"prisma.frame": frame, "prisma.args": f'{{"id":{i}}}'}))
+        spans.append(make_span(f"e{i + 1}", "prisma:engine:query", query_duration + 5_000, parent=f"op{i + 1}",
+                               trace_id=trace_id))
+        spans.append(make_span(f"q{i + 1}", "prisma:client:db_query", query_duration, parent=f"e{i + 1}",
+                               trace_id=trace_id, tags={"db.query.text": (
+                                   'SELECT "public"."Match"."id" FROM "public"."Match" '
+                                   f'WHERE ("public"."Match"."winnerId" = $1 OR "public"."Match"."loserId" = {i}) '
+                                   "OFFSET $2"
+                               )}))
+    return {"traceID": trace_id, "spans": spans}
+
+
+class NPlusOneTests(TestCase):
+    def test_fingerprint_normalizes_parameters(self):
+        self.assertEqual(
+            fingerprint_query("SELECT  * FROM \"Match\" WHERE id = $1 AND name = 'x''y' AND n IN (1, 2,3) LIMIT 10"),
+            'SELECT * FROM "Match" WHERE id = ? AND name = ? AND n IN (?+) LIMIT ?',
+        )
+        self.assertEqual(fingerprint_query('SELECT "t2"."c1" FROM "t2"'), 'SELECT "t2"."c1" FROM "t2"')
+
+    def test_detects_repeated_query_under_one_parent(self):
+        patterns = find_n_plus_one(make_n_plus_one_trace(repeats=5)["spans"], min_repeats=3)
+
+        self.assertEqual(len(patterns), 1)
+        pattern = patterns[0]
+        self.assertEqual(pattern["repeatCount"], 5)
+        self.assertEqual(pattern["totalDuration"], 5 * 400_000)
+        self.assertEqual(pattern["callSite"], "at <anonymous> (src/index.ts:51:38)")
+        self.assertEqual(pattern["parentSpanIds"], ["root"])
+        self.assertIn('"winnerId" = ? OR', pattern["fingerprint"])
+
+    def test_ignores_queries_below_repeat_threshold(self):
+        self.assertEqual(find_n_plus_one(make_n_plus_one_trace(repeats=2)["spans"], min_repeats=3), [])
+
+    def test_prompt_names_pattern_and_call_site(self):
+        incident = {
+            "duration": 2_500_000,
+            "callOperations": [{"callOperation": {"duration": 50_000, "tag": "at <anonymous> (src/index.ts:47:38)"}}],
+            "nPlusOne": find_n_plus_one(make_n_plus_one_trace(repeats=4)["spans"]),
+        }
+        with mock.patch("builtins.print"):
+            prompt = create_prompt_from_incident(incident)
+
+        self.assertIn("In demo2/backend/at <anonymous> (src/index.ts:51:38)", prompt)
+        self.assertIn("Executed 4 times", prompt)
+
+
+class JaegerStub:
+    """Stands in for requests.get against the Jaeger query API."""
+
+    def __init__(self, traces_by_service):
+        self.traces_by_service = traces_by_service
+
+    def __call__(self, url, params=None, timeout=None):
+        response = mock.Mock(ok=True, status_code=200, text="")
+        if url.endswith("/api/services"):
+            response.json.return_value = {"data": list(self.traces_by_service)}
+        else:
+            response.json.return_value = {"data": self.traces_by_service[params["service"]]}
+        return response
+
+
+class DetectIncidentsTests(TestCase):
+    def _detect(self, traces, pull_request_ids=(1,)):
+        pull_requests = [
+            PullRequest.objects.create(
+                repo_owner="acme", repo_name="shop", repo_url="https://github.com/acme/shop",
+                base_branch="main", head_branch=f"claude/fix-{pk}", title=f"PR {pk}", body="report",
+            )
+            for pk in pull_request_ids
+        ]
+        generated = iter({"id": pr.id, "title": pr.title, "body": pr.body} for pr in pull_requests)
+        prompts = []
+
+        def fake_generate_pr(repo_url, prompt, **_kwargs):
+            prompts.append(prompt)
+            return next(generated)
+
+        with mock.patch("api.views.requests.get", JaegerStub({"svc": traces})), \
+                mock.patch("api.views.generate_pr", side_effect=fake_generate_pr), \
+                mock.patch("api.views.generate_incident_fields", side_effect=RuntimeError("offline")), \
+                mock.patch("builtins.print"):
+            result = detect_incidents(run_id="run-test")
+        return result, prompts
+
+    def test_n_plus_one_incident_records_pattern(self):
+        result, prompts = self._detect([make_n_plus_one_trace("t1", repeats=6)])
+
+        self.assertEqual(list(result), ["t1"])
+        incident = Incident.objects.get()
+        self.assertEqual(incident.repeatCount, 6)
+        self.assertIn('"public"."Match"', incident.queryPattern)
+        self.assertIn("Executed 6 times", prompts[0])
+
+    def test_aggregates_call_site_across_traces(self):
+        traces = [make_n_plus_one_trace(f"t{i}", repeats=3 + i) for i in range(4)]
+        traces[3]["spans"][0]["tags"] = [{"key": "http.target", "type": "string", "value": "/matches/42"}]
+
+        result, prompts = self._detect(traces)
+
+        self.assertEqual(list(result), ["t3"])
+        self.assertEqual(len(prompts), 1)
+        incident = Incident.objects.get()
+        self.assertEqual(incident.impactCount, 4)
+        self.assertEqual(incident.callSite, "at <anonymous> (src/index.ts:51:38)")
+        self.assertEqual(incident.exampleTraceIds[0], "t3")
+        self.assertCountEqual(incident.exampleTraceIds, ["t0", "t1", "t2", "t3"])
+        self.assertEqual(incident.affectedRoutes, ["/leaderboards", "/matches/:id"])
+        self.assertGreater(incident.meanAddedLatency, 0)
+        self.assertAlmostEqual(incident.timeImpact, incident.meanAddedLatency * 4, places=1)
+        self.assertIn("slow in 4 requests", prompts[0])
+
+    def test_budget_orders_by_impact_and_carries_over_leftovers(self):
+        small = make_n_plus_one_trace("small", repeats=3, frame="at a (src/a.ts:10:1)")
+        large = make_n_plus_one_trace("large", repeats=8, query_duration=900_000, frame="at b (src/b.ts:20:1)")
+
+        with mock.patch.dict(os.environ, {"AGENT_MAX_SESSIONS_PER_RUN": "1"}):
+            result, prompts = self._detect([small, large], pull_request_ids=(1,))
+
+        self.assertEqual(list(result), ["large"])
+        deferred = DeferredCandidate.objects.get()
+        self.assertEqual((deferred.callSite, deferred.traceId, deferred.deferrals), ("at a (src/a.ts:10:1)", "small", 1))
+        self.assertEqual(Log.objects.get(step="schedule", level="warning").context["reason"], "max_sessions")
+
+        result, prompts = self._detect([], pull_request_ids=(2,))
+
+        self.assertEqual(list(result), ["small"])
+        self.assertIn("at a (src/a.ts:10:1)", prompts[0])
+        self.assertFalse(DeferredCandidate.objects.exists())
+
+    def test_batches_call_sites_in_one_file_into_one_pull_request(self):
+        traces = [
+            make_n_plus_one_trace("matches", repeats=8, frame="at matches (src/index.ts:51:38)"),
+            make_n_plus_one_trace("models", repeats=4, frame="at models (src/routes/models.ts:12:5)"),
+            make_n_plus_one_trace("users", repeats=6, frame="at users (src/index.ts:90:7)"),
+        ]
+
+        with mock.patch.dict(os.environ, {"AGENT_MAX_SESSIONS_PER_RUN": "2"}):
+            result, prompts = self._detect(traces, pull_request_ids=(1, 2))
+
+        self.assertEqual(len(prompts), 2)
+        self.assertIn("There are 2 slow call sites in demo2/backend/src/index.ts", prompts[0])
+        self.assertLess(prompts[0].index("src/index.ts:51:38"), prompts[0].index("src/index.ts:90:7"))
+        self.assertNotIn("There are", prompts[1])
+        self.assertCountEqual(result, ["matches", "users", "models"])
+        first, second = Incident.objects.order_by("id").values_list("pullRequest_id", flat=True)[:2]
+        self.assertEqual(first, second)
+        self.assertEqual(Incident.objects.values("pullRequest").distinct().count(), 2)
+        self.assertFalse(DeferredCandidate.objects.exists())
+
+        with mock.patch.dict(os.environ, {"PR_GROUP_BY": "module", "AGENT_MAX_SESSIONS_PER_RUN": "1"}):
+            result, prompts = self._detect(traces, pull_request_ids=(3,))
+        self.assertEqual(list(result), ["matches", "users"])
+        self.assertEqual(DeferredCandidate.objects.get().callSite, "at models (src/routes/models.ts:12:5)")
+
+    def test_merged_fix_compares_post_merge_latency(self):
+        self._detect([make_n_plus_one_trace(f"t{i}", repeats=6) for i in range(2)])
+        pull_request = PullRequest.objects.get()
+        self.assertEqual(LatencySketch.from_dict(Incident.objects.get().latencySketch).count, 12)
+
+        with mock.patch.dict(os.environ, {"GITHUB_TOKEN": "x"}), \
+                mock.patch("api.views.merge_pr", return_value={"merged": True, "sha": "abc123"}):
+            response = APIClient().post(f"/api/pull-requests/{pull_request.id}/merge-pr/")
+        self.assertEqual(response.status_code, 200)
+        fix = MergedFix.objects.get(id__in=response.json()["merged_fix_ids"])
+        self.assertEqual((fix.callSite, fix.mergeSha, fix.status), ("at <anonymous> (src/index.ts:51:38)", "abc123", "pending"))
+        self.assertAlmostEqual(fix.beforeP95, 410_000, delta=8_000)
+
+        # Traces from before the merge (and its deploy grace period) do not count.
+        self._detect([make_n_plus_one_trace("old", repeats=6)], pull_request_ids=(2,))
+        fix.refresh_from_db()
+        self.assertEqual(fix.afterCount, 0)
+
+        after = [make_n_plus_one_trace(f"new{i}", repeats=6, query_duration=100_000) for i in range(2)]
+        start = int((fix.mergedAt.timestamp() + 3600) * 1_000_000)
+        for trace in after:
+            for span in trace["spans"]:
+                span["startTime"] = start
+        self._detect(after, pull_request_ids=(3,))
+
+        fix.refresh_from_db()
+        self.assertEqual((fix.status, fix.afterCount), ("improved", 12))
+        self.assertLess(fix.p95Change, -0.5)
+        listed = APIClient().get("/api/merged-fixes/?status=improved").json()
+        self.assertEqual([row["id"] for row in listed], [fix.id])
+
+    def test_incident_text_drafted_during_pr_creation_is_used(self):
+        pull_request = PullRequest.objects.create(
+            repo_owner="acme", repo_name="shop", repo_url="https://github.com/acme/shop",
+            base_branch="main", head_branch="claude/fix-1", title="PR 1", body="report",
+        )
+        fields = {
+            "title": "For /leaderboards caused by a query per match",
+            "problemDescription": "problem",
+            "solutionDescription": "solution",
+            "severity": "high",
+        }
+        generate_pr = mock.Mock(return_value={
+            "id": pull_request.id, "title": "PR 1", "body": "report",
+            "incidentFields": {"t1": fields}, "stageTimings": {"push": 0.5, "incident_fields:t1": 2.0},
+        })
+
+        with mock.patch("api.views.requests.get", JaegerStub({"svc": [make_n_plus_one_trace("t1", repeats=6)]})), \
+                mock.patch("api.views.generate_pr", generate_pr), \
+                mock.patch("api.views.generate_incident_fields", side_effect=AssertionError("drafted twice")), \
+                mock.patch("builtins.print"):
+            detect_incidents(run_id="run-test")
+
+        self.assertEqual(list(generate_pr.call_args.kwargs["incident_prompts"]), ["t1"])
+        incident = Incident.objects.get()
+        self.assertEqual((incident.title, incident.severity), (fields["title"], "high"))
+        completed = Log.objects.get(step="generate_pr", message="Pull request suggestion generation completed.")
+        self.assertEqual(completed.context["stage_timings"]["push"], 0.5)
+
+    def test_failed_session_is_isolated_and_resumed_from_checkpoint(self):
+        traces = [
+            make_n_plus_one_trace("large", repeats=8, query_duration=900_000, frame="at b (src/b.ts:20:1)"),
+            make_n_plus_one_trace("small", repeats=3, frame="at a (src/a.ts:10:1)"),
+        ]
+        pull_requests = [
+            PullRequest.objects.create(
+                repo_owner="acme", repo_name="shop", repo_url="https://github.com/acme/shop",
+                base_branch="main", head_branch=f"claude/fix-{pk}", title=f"PR {pk}", body="report",
+            )
+            for pk in (1, 2)
+        ]
+        prompts = []
+
+        def flaky_generate_pr(repo_url, prompt, **_kwargs):
+            prompts.append(prompt)
+            if len(prompts) == 1:
+                raise RuntimeError("git push failed")
+            pull_request = pull_requests[len(prompts) - 2]
+            return {"id": pull_request.id, "title": pull_request.title, "body": pull_request.body}
+
+        with mock.patch("api.views.requests.get", JaegerStub({"svc": traces})), \
+                mock.patch("api.views.generate_pr", side_effect=flaky_generate_pr), \
+                mock.patch("api.views.generate_incident_fields", side_effect=RuntimeError("offline")), \
+                mock.patch("builtins.print"):
+            result, detection_run = run_detection_with_tracking()
+
+        self.assertEqual(list(result), ["small"])
+        self.assertEqual((detection_run.status, detection_run.incidentCount), ("partial", 1))
+        statuses = dict(detection_run.candidates.values_list("callSite", "status"))
+        self.assertEqual(statuses, {"at b (src/b.ts:20:1)": "failed", "at a (src/a.ts:10:1)": "generated"})
+
+        # Resuming neither fetches nor analyzes traces again and only retries the failed session.
+        with mock.patch("api.views.requests.get", side_effect=AssertionError("fetched traces")), \
+                mock.patch("api.views.generate_pr", side_effect=flaky_generate_pr), \
+                mock.patch("api.views.generate_incident_fields", side_effect=RuntimeError("offline")), \
+                mock.patch("builtins.print"):
+            response = APIClient().post(f"/api/detection-runs/{detection_run.id}/resume/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()["data"]), ["large"])
+        self.assertIn("src/b.ts:20:1", prompts[-1])
+        self.assertEqual(len(prompts), 3)
+        detection_run.refresh_from_db()
+        self.assertEqual((detection_run.status, detection_run.incidentCount), ("success", 2))
+        retried = detection_run.candidates.get(callSite="at b (src/b.ts:20:1)")
+        self.assertEqual((retried.status, retried.attempts, retried.pullRequest_id), ("generated", 2, pull_requests[1].id))
+        self.assertEqual(APIClient().post(f"/api/detection-runs/{detection_run.id}/resume/").status_code, 409)
+
+    def test_resume_claims_the_run_atomically(self):
+        detection_run = DetectionRun.objects.create(runType="manual", runId="run-a", status="partial")
+        stale = DetectionRun.objects.get(id=detection_run.id)
+        # Another request resumed it after this one read the row.
+        DetectionRun.objects.filter(id=detection_run.id).update(status="running")
+
+        with mock.patch("api.views.generate_pr", side_effect=AssertionError("resumed twice")):
+            self.assertIsNone(resume_detection_run(stale))
+            response = APIClient().post(f"/api/detection-runs/{detection_run.id}/resume/")
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("running", response.json()["detail"])
+
+
+class SpanTreeTests(TestCase):
+    def setUp(self):
+        # root [0, 1000): waits on a (0-300), then b and c in parallel (300-900 / 300-600), then 100 of own work.
+        self.spans = [
+            make_span("root", "GET", 1000),
+            make_span("a", "prisma:call-operation", 300, parent="root", start=0),
+            make_span("a-q", "prisma:client:db_query", 250, parent="a", start=20),
+            make_span("b", "prisma:call-operation", 600, parent="root", start=300),
+            make_span("c", "prisma:call-operation", 300, parent="root", start=300),
+        ]
+        self.tree = SpanTree(self.spans)
+
+    def test_self_time_excludes_overlapping_children(self):
+        self.assertEqual(self.tree.self_time("root"), 100)
+        self.assertEqual(self.tree.self_time("a"), 50)
+        self.assertEqual(self.tree.self_time("b"), 600)
+
+    def test_critical_path_skips_parallel_sibling(self):
+        path = self.tree.critical_path()
+
+        self.assertEqual(path["root"], 100)
+        self.assertEqual(path["b"], 600)
+        self.assertEqual(path["a"], 50)
+        self.assertEqual(path["a-q"], 250)
+        self.assertNotIn("c", path)
+        self.assertEqual(sum(path.values()), 1000)
+
+    def test_nearest_call_operation(self):
+        self.assertEqual(self.tree.nearest("a-q", "prisma:call-operation"), "a")
+        self.assertEqual(self.tree.nearest("a", "prisma:call-operation"), "a")
+        self.assertIsNone(self.tree.nearest("root", "prisma:call-operation"))
+
+    def test_incident_blames_call_site_on_critical_path(self):
+        spans = [
+            make_span("root", "GET", 3_000_000),
+            # Slow but fully overlapped by the longer sibling: not on the critical path.
+            make_span("slow", "prisma:call-operation", 2_000_000, parent="root", start=0,
+                      tags={"prisma.frame": "at a (src/index.ts:10:1)"}),
+            make_span("long", "prisma:call-operation", 2_900_000, parent="root", start=0,
+                      tags={"prisma.frame": "at b (src/index.ts:20:1)"}),
+        ]
+        with mock.patch("api.views.generate_pr", return_value=None), \
+                mock.patch("api.views.requests.get", JaegerStub({"svc": [{"traceID": "t1", "spans": spans}]})), \
+                mock.patch("builtins.print"):
+            detect_incidents(run_id="run-test")
+
+        context = Log.objects.get(step="analyze_trace_output").context
+        self.assertEqual(context["call_site"], "at b (src/index.ts:20:1)")
+        self.assertEqual(context["call_site_critical_micros"], 2_900_000)
+
+
+class LatencyBaselineTests(TestCase):
+    def test_normalize_route_collapses_ids(self):
+        self.assertEqual(normalize_route("/matches/123?limit=5"), "/matches/:id")
+        self.assertEqual(normalize_route("/users/3f2b9c1e-8a4d-4c2b-9e1f-0a1b2c3d4e5f/games/"), "/users/:id/games")
+        self.assertEqual(normalize_route("http://api:3000/leaderboards"), "/leaderboards")
+        self.assertEqual(normalize_route("/"), "/")
+        self.assertEqual(normalize_route(None), "unknown")
+
+    def test_sketch_quantiles_within_relative_accuracy(self):
+        values = [(i * 7919) % 100_000 + 1 for i in range(20_000)]
+        left, right = LatencySketch(), LatencySketch()
+        for i, value in enumerate(values):
+            (left if i % 2 else right).add(value)
+        left.merge(LatencySketch.from_dict(right.to_dict()))
+
+        ordered = sorted(values)
+        self.assertEqual(left.count, len(values))
+        for q in (0.5, 0.95, 0.99):
+            exact = ordered[int(q * (len(ordered) - 1))]
+            self.assertAlmostEqual(left.quantile(q), exact, delta=exact * 0.02)
+        self.assertLess(len(left.bins), 1200)
+
+    def _run(self, durations, route="/matches/:id"):
+        sketches = {}
+        for micros in durations:
+            record_latency(sketches, route, REQUEST, micros)
+        return compare_and_update_baselines(sketches, tolerance=0.2, min_samples=10)
+
+    def test_flags_p95_regression_against_baseline(self):
+        first = self._run([100_000] * 50)
+        self.assertEqual(first.regressions, {})
+        self.assertFalse(first.is_mature("/matches/:id"))
+
+        steady = self._run([100_000] * 50)
+        self.assertEqual(steady.regressions, {})
+        self.assertTrue(steady.is_mature("/matches/:id"))
+
+        regressed = self._run([100_000] * 40 + [400_000] * 10)
+        regression = regressed.route_regressions("/matches/:id", [])[0]
+        self.assertAlmostEqual(regression["baselineP95"], 100_000, delta=2_000)
+        self.assertAlmostEqual(regression["runP95"], 400_000, delta=8_000)
+        self.assertEqual(LatencyBaseline.objects.get(route="/matches/:id").count, 150)
+
+    def test_detection_skips_fast_routes_with_mature_baseline(self):
+        trace = make_n_plus_one_trace("t1", repeats=6)
+        trace["spans"][0]["tags"] = [{"key": "http.target", "type": "string", "value": "/leaderboards?page=2"}]
+        self._run([3_000_000] * 20, route="/leaderboards")
+
+        with mock.patch("api.views.generate_pr", return_value=None), \
+                mock.patch("api.views.requests.get", JaegerStub({"svc": [trace]})), \
+                mock.patch("builtins.print"):
+            result = detect_incidents(run_id="run-test")
+
+        self.assertEqual(result, {})
+        self.assertEqual(Log.objects.get(step="analyze_trace", message="Finished analyzing traces.").context["skipped_fast"], 1)
+
+
+class TraceSamplingTests(SimpleTestCase):
+    def test_keeps_slow_tail_and_weights_bulk(self):
+        sampler = StratifiedTraceSampler(reservoir_size=50, tail_quantile=0.95, warmup=100, rng=random.Random(7))
+        durations = [100_000 + (i * 37) % 1000 for i in range(10_000)]
+        for i in range(0, 10_000, 500):
+            durations[i] = 5_000_000 + i
+        for i, duration in enumerate(durations):
+            sampler.offer(("svc", "/matches/:id"), duration, {"traceID": f"t{i}", "duration": duration})
+        sampler.offer(("svc", "/leaderboards"), 3_000_000, {"traceID": "only", "duration": 3_000_000})
+
+        sampled = sampler.sample()
+        kept = {trace["traceID"] for trace, _weight in sampled}
+
+        self.assertTrue({f"t{i}" for i in range(0, 10_000, 500)} <= kept)
+        self.assertIn("only", kept)
+        self.assertLess(len(sampled), 1000)
+        self.assertAlmostEqual(sum(weight for _trace, weight in sampled), 10_001, delta=1e-6)
+        stats = {row["route"]: row for row in sampler.stats()}
+        self.assertEqual(stats["/matches/:id"]["bulkKept"], 50)
+        self.assertLess(stats["/matches/:id"]["bulkSampleRate"], 0.01)
+
+
+class TraceStoreTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_round_trip_across_segments_and_reopen(self):
+        store = TraceStore(self.directory.name, segment_bytes=2048)
+        traces = [make_n_plus_one_trace(f"t{i}", repeats=3) for i in range(10)]
+        for trace in traces:
+            self.assertTrue(store.put(trace, service="svc"))
+        self.assertFalse(store.put(traces[0], service="svc"))
+        store.close()
+
+        reopened = TraceStore(self.directory.name, segment_bytes=2048)
+        self.assertGreater(len(reopened.segments()), 1)
+        self.assertEqual(len(reopened), 10)
+        self.assertEqual(reopened.get("t7"), traces[7])
+        self.assertEqual([trace["traceID"] for _service, trace in reopened.iter_traces()], [f"t{i}" for i in range(10)])
+        reopened.close()
+
+    def test_retention_drops_oldest_segments(self):
+        store = TraceStore(self.directory.name, segment_bytes=2048, max_bytes=4096)
+        for i in range(20):
+            store.put(make_n_plus_one_trace(f"t{i}", repeats=3))
+
+        removed = store.enforce_retention()
+
+        self.assertEqual(removed[0], 1)
+        self.assertNotIn("t0", store)
+        self.assertIn("t19", store)
+        self.assertLessEqual(sum((store.path / f"segment-{n:06d}.log").stat().st_size for n in store.segments()[:-1]), 4096)
+        store.close()
+
+    def test_detect_incidents_reads_from_store(self):
+        store = TraceStore(self.directory.name)
+        store.put(make_n_plus_one_trace("t1", repeats=6), service="svc")
+        store.close()
+
+        env = {"TRACE_SOURCE": "store", "TRACE_STORE_DIR": self.directory.name}
+        with mock.patch.dict(os.environ, env), \
+                mock.patch("api.views.requests.get", side_effect=AssertionError("Jaeger must not be queried")), \
+                mock.patch("api.views.generate_pr", return_value=None), \
+                mock.patch("builtins.print"):
+            detect_incidents(run_id="run-test")
+
+        self.assertEqual(Log.objects.get(step="analyze_trace_output").context["trace_id"], "t1")
+
+
+class ReplayTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        slow = make_n_plus_one_trace("t1", repeats=6)
+        slow["processes"] = {"p1": {"serviceName": "api"}}
+        slow["spans"][0]["processID"] = "p1"
+        with open(os.path.join(self.path, "services.json"), "w") as dump:
+            json.dump({"data": ["api"]}, dump)
+        with open(os.path.join(self.path, "traces-api.json"), "w") as dump:
+            json.dump({"data": [slow, make_n_plus_one_trace("t2", repeats=2)]}, dump)
+        with open(os.path.join(self.path, "single.json"), "w") as dump:
+            json.dump(slow, dump)
+
+    def test_reads_traces_from_dump_directory(self):
+        replayed = [(service, trace["traceID"]) for service, trace in iter_dump_traces([self.path])]
+
+        self.assertEqual(replayed, [("api", "t1"), ("traces-api", "t2")])
+
+    def test_dry_run_reports_without_side_effects(self):
+        expired = DeferredCandidate.objects.create(callSite="at old (src/old.ts:1:1)", payload={"callSite": "x"})
+        DeferredCandidate.objects.filter(id=expired.id).update(updated_at=timezone.now() - timedelta(days=30))
+        out = io.StringIO()
+        with mock.patch("api.views.requests.get", side_effect=AssertionError("Jaeger must not be queried")), \
+                mock.patch("api.views.generate_pr", side_effect=AssertionError("no agent in dry runs")), \
+                mock.patch("api.views.generate_incident_fields", side_effect=AssertionError("no agent in dry runs")), \
+                mock.patch("builtins.print"):
+            call_command("replay_traces", self.path, "--dry-run", stdout=out)
+
+        self.assertIn("Would create 1 incident(s)", out.getvalue())
+        self.assertIn("at <anonymous> (src/index.ts:51:38)", out.getvalue())
+        self.assertFalse(Incident.objects.exists())
+        self.assertFalse(LatencyBaseline.objects.exists())
+        self.assertNotIn("src/old.ts", out.getvalue())
+        self.assertTrue(DeferredCandidate.objects.filter(id=expired.id).exists())
+
+
+class SyntheticTraceTests(TestCase):
+    def test_generator_shapes_and_patterns(self):
+        traces = list(generate_traces(5_000, spans_per_trace=25, n_plus_one_rate=0.5, slow_rate=0.2, seed=3))
+
+        span_count = sum(len(trace["spans"]) for _service, trace in traces)
+        self.assertGreaterEqual(span_count, 5_000)
+        self.assertLess(span_count, 5_000 + 25)
+        self.assertTrue(any(find_n_plus_one(trace["spans"]) for _service, trace in traces))
+        self.assertTrue(any(SpanTree(trace["spans"]).duration > 2_000_000 for _service, trace in traces))
+        self.assertEqual(traces, list(generate_traces(5_000, spans_per_trace=25, n_plus_one_rate=0.5, slow_rate=0.2, seed=3)))
+
+    def test_benchmark_command_compares_against_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            call_command("bench_detection", "--spans", "500", "--repeat", "1", "--output", path, stdout=io.StringIO())
+            with open(path) as baseline_file:
+                report = json.load(baseline_file)
+            self.assertEqual(report["results"][0]["traces"], 20)
+            tables = report["results"][0]["dbWritesByTable"]
+            self.assertGreater(tables["api_latencybaseline"], 0)
+            self.assertGreater(tables["api_deferredcandidate"], 0)
+            self.assertFalse(DeferredCandidate.objects.exists())
+
+            report["results"][0]["dbWrites"] = 0
+            with open(path, "w") as baseline_file:
+                json.dump(report, baseline_file)
+            with self.assertRaisesMessage(CommandError, "writes"):
+                call_command("bench_detection", "--spans", "500", "--repeat", "1", "--skip-memory",
+                             "--baseline", path, stdout=io.StringIO())
+
+
+def to_otlp_spans(trace):
+    """Jaeger-shaped test spans -> OTLP spans (hex ids, nanosecond times, attribute dicts)."""
+    ids = {span["spanID"]: f"{i + 1:016x}" for i, span in enumerate(trace["spans"])}
+    trace_id = f"{abs(hash(trace['traceID'])):032x}"[-32:]
+    spans = []
+    for span in trace["spans"]:
+        parent = span["references"][0]["spanID"] if span["references"] else None
+        spans.append({
+            "traceId": trace_id,
+            "spanId": ids[span["spanID"]],
+            "parentSpanId": ids[parent] if parent else "",
+            "name": span["operationName"],
+            "startTimeUnixNano": span["startTime"] * 1000,
+            "endTimeUnixNano": (span["startTime"] + span["duration"]) * 1000,
+            "attributes": {tag["key"]: tag["value"] for tag in span["tags"]},
+        })
+    return trace_id, spans
+
+
+def otlp_json(service, spans):
+    def attributes(values):
+        return [{"key": key, "value": {"stringValue": value}} for key, value in values.items()]
+
+    return json.dumps({"resourceSpans": [{
+        "resource": {"attributes": attributes({"service.name": service})},
+        "scopeSpans": [{"scope": {"name": "test"}, "spans": [
+            dict(span, startTimeUnixNano=str(span["startTimeUnixNano"]), endTimeUnixNano=str(span["endTimeUnixNano"]),
+                 attributes=attributes(span["attributes"]))
+            for span in spans
+        ]}],
+    }]}).encode()
+
+
+def _pb_varint(value):
+    out = bytearray()
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        out.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+
+def _pb_bytes(field, payload):
+    return _pb_varint(field << 3 | 2) + _pb_varint(len(payload)) + payload
+
+
+def _pb_key_value(key, value):
+    if isinstance(value, str):
+        any_value = _pb_bytes(1, value.encode())
+    else:
+        any_value = _pb_varint(3 << 3) + _pb_varint(value)
+    return _pb_bytes(1, key.encode()) + _pb_bytes(2, any_value)
+
+
+def otlp_protobuf(service, spans):
+    encoded_spans = b""
+    for span in spans:
+        body = _pb_bytes(1, bytes.fromhex(span["traceId"])) + _pb_bytes(2, bytes.fromhex(span["spanId"]))
+        if span["parentSpanId"]:
+            body += _pb_bytes(4, bytes.fromhex(span["parentSpanId"]))
+        body += _pb_bytes(5, span["name"].encode()) + _pb_varint(6 << 3) + _pb_varint(2)
+        body += _pb_varint(7 << 3 | 1) + struct.pack("<Q", span["startTimeUnixNano"])
+        body += _pb_varint(8 << 3 | 1) + struct.pack("<Q", span["endTimeUnixNano"])
+        for key, value in span["attributes"].items():
+            body += _pb_bytes(9, _pb_key_value(key, value))
+        encoded_spans += _pb_bytes(2, body)
+    resource = _pb_bytes(1, _pb_key_value("service.name", service))
+    return _pb_bytes(1, _pb_bytes(1, resource) + _pb_bytes(2, encoded_spans))
+
+
+class OTLPReceiverTests(TestCase):
+    def setUp(self):
+        self.analyzer = LiveTraceAnalyzer(settle_seconds=0)
+        patcher = mock.patch("api.views.live_analyzer", self.analyzer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def test_json_and_protobuf_decode_identically(self):
+        _trace_id, spans = to_otlp_spans(make_n_plus_one_trace("t1", repeats=3))
+        spans[1]["attributes"]["db.rows"] = 12
+
+        from_json = decode_export_request(otlp_json("api", spans).replace(b'"12"', b"12"), "application/json")
+        from_protobuf = decode_export_request(otlp_protobuf("api", spans), "application/x-protobuf")
+
+        self.assertEqual(len(from_json), len(spans))
+        self.assertEqual(from_json, from_protobuf)
+        service, root = from_protobuf[0]
+        self.assertEqual((service, root["operationName"], root["duration"], root["references"]), ("api", "GET", 2_500_000, []))
+
+    def test_pushed_spans_update_live_aggregates_and_feed_detection(self):
+        trace_id, spans = to_otlp_spans(make_n_plus_one_trace("t1", repeats=6))
+        # Children first, root last, split over two exports, like a span-at-a-time exporter.
+        response = self.client.post("/api/otlp/v1/traces", otlp_protobuf("api", spans[1:]),
+                                    content_type="application/x-protobuf")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/api/live/").json()["pendingTraces"], 1)
+
+        response = self.client.generic("POST", "/api/otlp/v1/traces", gzip.compress(otlp_json("api", spans[:1])),
+                                       content_type="application/json", HTTP_CONTENT_ENCODING="gzip")
+        self.assertEqual((response.status_code, response.content), (200, b"{}"))
+
+        live = self.client.get("/api/live/").json()
+        self.assertEqual((live["spans"], live["traces"], live["candidates"]), (len(spans), 1, 1))
+        self.assertEqual(live["callSites"][0]["callSite"], "at <anonymous> (src/index.ts:51:38)")
+        self.assertEqual(live["callSites"][0]["exampleTraceIds"], [trace_id])
+
+        with mock.patch.dict(os.environ, {"TRACE_SOURCE": "live"}), \
+                mock.patch("api.views.requests.get", side_effect=AssertionError("Jaeger must not be queried")), \
+                mock.patch("builtins.print"):
+            candidates = detect_incidents(run_id="run-test", dry_run=True)
+        self.assertEqual(list(candidates), [trace_id])
+        self.assertEqual(self.analyzer.take_traces(), [])
+
+    def test_rejects_unsupported_and_malformed_payloads(self):
+        response = self.client.post("/api/otlp/v1/traces", "x", content_type="text/plain")
+        self.assertEqual(response.status_code, 415)
+        response = self.client.post("/api/otlp/v1/traces", b"\x0a\xff", content_type="application/x-protobuf")
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_mistyped_and_truncated_protobuf_fields(self):
+        def length_delimited(field, payload):
+            return bytes([field << 3 | 2, len(payload)]) + payload
+
+        def export(span):
+            return length_delimited(1, length_delimited(2, length_delimited(2, span)))
+
+        huge_varint = b"\xff\xff\xff\xff\x0f"  # 2**32 - 1
+        bodies = {
+            "trace id as varint": export(bytes([1 << 3 | 0]) + huge_varint),
+            "start time as varint": export(bytes([7 << 3 | 0, 1])),
+            "truncated varint": export(b"\x0a\x02ab") + b"\x0a\x80",
+            "truncated key": b"\x0a",
+        }
+        for name, body in bodies.items():
+            with self.subTest(name):
+                response = self.client.post("/api/otlp/v1/traces", body, content_type="application/x-protobuf")
+                self.assertEqual(response.status_code, 400)
+
+    def test_rejects_corrupt_and_oversized_gzip_bodies(self):
+        def post(body):
+            return self.client.generic("POST", "/api/otlp/v1/traces", body,
+                                       content_type="application/json", HTTP_CONTENT_ENCODING="gzip")
+
+        compressed = gzip.compress(b'{"resourceSpans": []}')
+        bodies = {
+            "invalid block type": compressed[:10] + b"\xff" + compressed[11:],
+            "bad checksum": compressed[:-8] + bytes([compressed[-8] ^ 1]) + compressed[-7:],
+            "truncated": compressed[:-4],
+            "not gzip": b"{}",
+        }
+        for name, body in bodies.items():
+            with self.subTest(name):
+                self.assertEqual(post(body).status_code, 400)
+
+        bomb = gzip.compress(b'{"resourceSpans": [' + b" " * 100_000 + b"]}")
+        with mock.patch.dict(os.environ, {"OTLP_MAX_DECOMPRESSED_BYTES": "1000"}):
+            self.assertEqual(post(bomb).status_code, 413)
+            # Several gzip members are one body, as with gzip.decompress.
+            self.assertEqual(post(compressed + gzip.compress(b"")).status_code, 200)
+        self.assertEqual(post(bomb).status_code, 200)
+
+
+class HotspotTests(TestCase):
+    MATCHES = "at findMatches (src/matches.ts:12:5)\n    at handler (src/index.ts:50:3)"
+    MODELS = "at loadModels (src/models.ts:8:5)\n    at handler (src/index.ts:47:3)"
+    RECURSIVE = "at walk (src/tree.ts:3:1)\n    at walk (src/tree.ts:3:1)\n    at handler (src/index.ts:50:3)"
+
+    def test_parse_frame(self):
+        self.assertEqual(parse_frame("    at handler (src/index.ts:50:3)"), ("handler", "src/index.ts:50"))
+        self.assertEqual(parse_frame("at src/index.ts:7:1"), ("<anonymous>", "src/index.ts:7"))
+        self.assertIsNone(parse_frame("Error"))
+
+    def test_prefix_tree_inclusive_and_exclusive_frames(self):
+        hotspots = HotspotTree()
+        hotspots.add(self.MATCHES, 600)
+        hotspots.add(self.MODELS, 300)
+        hotspots.add(self.RECURSIVE, 50, weight=2)
+
+        self.assertEqual(hotspots.total_micros, 1000)
+        self.assertEqual(len(hotspots.frames), 5)
+        totals = {frame["function"] + " " + frame["location"]: frame for frame in hotspots.frame_totals()}
+        self.assertEqual(totals["handler src/index.ts:50"]["inclusiveMicros"], 700)
+        self.assertEqual(totals["handler src/index.ts:50"]["exclusiveMicros"], 0)
+        # Recursion counts once toward inclusive time.
+        self.assertEqual(totals["walk src/tree.ts:3"]["inclusiveMicros"], 100)
+        self.assertEqual(totals["walk src/tree.ts:3"]["exclusiveMicros"], 100)
+        self.assertEqual(hotspots.top_inclusive(1)[0]["location"], "src/index.ts:50")
+        self.assertEqual(hotspots.dominant_frame()["function"], "findMatches")
+        self.assertEqual(hotspots.render(min_fraction=0.2).splitlines(), [
+            "handler (src/index.ts:50) 0.7 ms total, 0.0 ms self (70%)",
+            "  findMatches (src/matches.ts:12) 0.6 ms total, 0.6 ms self (60%)",
+            "handler (src/index.ts:47) 0.3 ms total, 0.0 ms self (30%)",
+            "  loadModels (src/models.ts:8) 0.3 ms total, 0.3 ms self (30%)",
+        ])
+
+    def test_detection_points_incident_at_dominant_function(self):
+        trace = make_n_plus_one_trace("t1", repeats=6)
+        stack = "at getMatchesForModel (src/index.ts:51:38)\n    at Layer.handle (src/index.ts:40:3)"
+        for span in trace["spans"]:
+            if span["operationName"] == "prisma:call-operation":
+                span["tags"].append({"key": "code.stacktrace", "type": "string", "value": stack})
+
+        with mock.patch("builtins.print"):
+            candidates = detect_incidents(run_id="run-test", traces=iter([("svc", trace)]), dry_run=True)
+
+        candidate = candidates["t1"]
+        self.assertEqual(candidate["hotspot"]["function"], "getMatchesForModel")
+        self.assertIn("getMatchesForModel (src/index.ts:51)", candidate["hotspotStack"])
+        self.assertIn("Most of the latency is spent in getMatchesForModel at demo2/backend/src/index.ts:51", candidate["prompt"])
+        self.assertIn("Aggregated call stacks", candidate["prompt"])
+        self.assertEqual(Log.objects.get(step="hotspots").context["dominantFrame"]["location"], "src/index.ts:51")
+
+
+class CodeIndexTests(TestCase):
+    SCHEMA = """model AIModel {
+  id      Int     @id
+  name    String
+  wins    Match[] @relation("Winner")
+}
+
+model Match {
+  id       BigInt  @id
+  winnerId Int?
+  winner   AIModel? @relation("Winner", fields: [winnerId], references: [id])
+}
+"""
+    INDEX = """import { prisma } from "./lib/prisma";
+import { winRate } from "./stats";
+
+app.get("/leaderboards", async (_req: Request, res: Response) => {
+  const models = await prisma.aIModel.findMany(); // all models
+  const rows = await Promise.all(
+    models.map(async (model) => {
+      const matches = await prisma.match.findMany({ where: { winnerId: model.id } });
+      return winRate(model, matches);
+    })
+  );
+  res.json(rows);
+});
+"""
+    STATS = """export function winRate(model, matches) {
+  return matches.length ? matches.filter((m) => m.winnerId === model.id).length / matches.length : 0;
+}
+"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.repo = os.path.join(tmp.name, "repo")
+        self.cache = os.path.join(tmp.name, "cache")
+        self._git("init", "-q", self.repo)
+        self._commit({"app/prisma/schema.prisma": self.SCHEMA, "app/src/index.ts": self.INDEX,
+                      "app/src/stats.ts": self.STATS, "app/node_modules/x/index.js": "function x() {}"})
+
+    def _git(self, *args):
+        subprocess.run(["git", *args], check=True, capture_output=True)
+
+    def _commit(self, files):
+        for path, content in files.items():
+            os.makedirs(os.path.dirname(os.path.join(self.repo, path)), exist_ok=True)
+            with open(os.path.join(self.repo, path), "w") as source:
+                source.write(content)
+        self._git("-C", self.repo, "add", "-A")
+        self._git("-C", self.repo, "-c", "user.name=t", "-c", "user.email=t@example.com", "commit", "-qm", "change")
+
+    def test_parse_source_finds_enclosing_functions(self):
+        functions = {function["name"]: function for function in parse_source(self.INDEX)}
+
+        self.assertEqual((functions["GET /leaderboards handler"]["start"], functions["GET /leaderboards handler"]["end"]), (4, 13))
+        self.assertEqual((functions["<anonymous> in map()"]["start"], functions["<anonymous> in map()"]["end"]), (7, 10))
+        self.assertEqual(functions["<anonymous> in map()"]["prismaAccessors"], ["match"])
+        self.assertIn("winRate", functions["<anonymous> in map()"]["calls"])
+
+    def test_index_is_cached_per_commit_and_updated_from_the_diff(self):
+        index = CodeIndex.load(self.repo, prefix="app", cache_dir=self.cache)
+        self.assertEqual((index.reparsed, sorted(index.files)), (3, ["src/index.ts", "src/stats.ts"]))
+
+        context = index.context("src/index.ts", 8)
+        self.assertEqual([function["name"] for function in context["functions"]],
+                         ["GET /leaderboards handler", "<anonymous> in map()"])
+        self.assertIn(">    8        const matches = await prisma.match.findMany", context["excerpt"])
+        self.assertEqual(sorted(context["models"]), ["AIModel", "Match"])
+        self.assertEqual(context["models"]["Match"]["relations"][0]["foreignKey"], ["winnerId"])
+        stats = index.context("src/stats.ts", 2)
+        self.assertEqual(stats["callers"], [{"file": "src/index.ts", "function": "<anonymous> in map()", "line": 7}])
+
+        self.assertEqual(CodeIndex.load(self.repo, prefix="app", cache_dir=self.cache).reparsed, 0)
+        self._commit({"app/src/stats.ts": "\n" + self.STATS})
+        updated = CodeIndex.load(self.repo, prefix="app", cache_dir=self.cache)
+        self.assertEqual(updated.reparsed, 1)
+        self.assertNotEqual(updated.sha, index.sha)
+        self.assertEqual(updated.context("src/stats.ts", 3)["functions"][0]["start"], 2)
+        self.assertEqual(updated.files["src/index.ts"], index.files["src/index.ts"])
+        self.assertEqual(len(os.listdir(self.cache)), 2)
+
+    def test_prompt_embeds_source_context(self):
+        trace = make_n_plus_one_trace("t1", repeats=6, frame="at <anonymous> (src/index.ts:8:38)")
+        env = {"CODE_INDEX_REPO": self.repo, "CODE_INDEX_PREFIX": "app", "CODE_INDEX_DIR": self.cache}
+        with mock.patch.dict(os.environ, env), mock.patch("builtins.print"):
+            candidates = detect_incidents(run_id="run-test", traces=iter([("svc", trace)]), dry_run=True)
+
+        prompt = candidates["t1"]["prompt"]
+        self.assertIn("Source of src/index.ts:8 at commit", prompt)
+        self.assertIn("inside GET /leaderboards handler (lines 4-13) > <anonymous> in map() (lines 7-10)", prompt)
+        self.assertIn("- Match: id BigInt, winnerId Int?; relations: winner -> AIModel via winnerId", prompt)
+        self.assertEqual(Log.objects.get(step="code_index").context["candidates_with_context"], 1)
+
+
+class BenchmarkVerificationTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.repo = tmp.name
+        self._bench("echo BENCHMARK_MS=100")
+        self._git("init", "-q", "-b", "main")
+        self._commit()
+        self._git("checkout", "-q", "-b", "fix")
+        self._bench('echo "$BENCHMARK_REF $INCIDENT_TRACE_ID" >> runs.log; echo BENCHMARK_MS=40')
+        self._commit()
+
+    def _git(self, *args):
+        subprocess.run(["git", "-C", self.repo, *args], check=True, capture_output=True)
+
+    def _bench(self, script):
+        with open(os.path.join(self.repo, "bench.sh"), "w") as bench:
+            bench.write(script + "\n")
+
+    def _commit(self):
+        self._git("add", "bench.sh")
+        self._git("-c", "user.name=t", "-c", "user.email=t@example.com", "commit", "-qm", "bench")
+
+    def test_compares_base_and_head_medians(self):
+        verification = verify_speedup(self.repo, "main", "fix", "sh bench.sh", env={"INCIDENT_TRACE_ID": "t1"},
+                                      runs=3, warmup_runs=1)
+
+        self.assertEqual((verification["baseMs"], verification["headMs"], verification["speedup"]), (100, 40, 2.5))
+        with open(os.path.join(self.repo, "runs.log")) as runs:
+            self.assertEqual(runs.read().splitlines(), ["head t1"] * 4)
+        current = subprocess.run(["git", "-C", self.repo, "branch", "--show-current"], capture_output=True, text=True)
+        self.assertEqual(current.stdout.strip(), "fix")
+
+    def test_threshold_and_failures_reject(self):
+        self.assertIsNone(verify_from_env(self.repo, "main", "fix"))
+        with mock.patch.dict(os.environ, {"BENCHMARK_CMD": "sh bench.sh", "BENCHMARK_MIN_SPEEDUP": "3", "BENCHMARK_RUNS": "1"}):
+            verification = verify_from_env(self.repo, "main", "fix")
+        self.assertEqual((verification["speedup"], verification["accepted"]), (2.5, False))
+
+        self._bench("exit 3")
+        self._commit()
+        with mock.patch.dict(os.environ, {"BENCHMARK_CMD": "sh bench.sh"}):
+            verification = verify_from_env(self.repo, "main", "fix")
+        self.assertFalse(verification["accepted"])
+        self.assertIn("exited with 3", verification["error"])
+
+    def test_rejected_change_opens_no_incident_and_verified_speedup_is_recorded(self):
+        rejected = {"id": None, "rejected": "insufficient_speedup", "verification": {"speedup": 1.01}}
+        with mock.patch("api.views.requests.get", JaegerStub({"svc": [make_n_plus_one_trace("t1", repeats=6)]})), \
+                mock.patch("api.views.generate_pr", return_value=rejected) as generate_pr, \
+                mock.patch("builtins.print"):
+            detect_incidents(run_id="run-test")
+        self.assertFalse(Incident.objects.exists())
+        self.assertEqual(Log.objects.get(step="verify_pr").context["reason"], "insufficient_speedup")
+        self.assertEqual(generate_pr.call_args.kwargs["benchmark_env"]["INCIDENT_TRACE_ID"], "t1")
+        self.assertEqual(generate_pr.call_args.kwargs["benchmark_env"]["INCIDENT_ROUTES"], "/leaderboards")
+
+        pull_request = PullRequest.objects.create(
+            repo_owner="acme", repo_name="shop", repo_url="https://github.com/acme/shop", base_branch="main",
+            head_branch="fix", title="PR", body="report", benchmark_base_ms=100, benchmark_head_ms=40, speedup=2.5,
+        )
+        accepted = {"id": pull_request.id, "title": "PR", "body": "report", "verification": {"speedup": 2.5}}
+        with mock.patch("api.views.requests.get", JaegerStub({"svc": [make_n_plus_one_trace("t2", repeats=6)]})), \
+                mock.patch("api.views.generate_pr", return_value=accepted), \
+                mock.patch("api.views.generate_incident_fields", side_effect=RuntimeError("offline")), \
+                mock.patch("builtins.print"):
+            detect_incidents(run_id="run-test-2")
+        self.assertEqual(Incident.objects.get().verifiedSpeedup, 2.5)
+        self.assertEqual(APIClient().get(f"/api/pull-requests/{pull_request.id}/").json()["speedup"], 2.5)
+
+
+class WorkspacePoolTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.origin = os.path.join(self.tmp, "origin")
+        os.makedirs(os.path.join(self.origin, "demo2", "backend"))
+        with open(os.path.join(self.origin, "demo2", "backend", "package.json"), "w") as manifest:
+            manifest.write('{"name": "demo"}\n')
+        with open(os.path.join(self.origin, ".gitignore"), "w") as gitignore:
+            gitignore.write("node_modules/\n")
+        for args in (("init", "-q", "-b", "main"), ("add", "-A"), ("commit", "-qm", "init")):
+            subprocess.run(["git", "-C", self.origin, "-c", "user.name=t", "-c", "user.email=t@example.com", *args],
+                           check=True, capture_output=True)
+        self.installs = os.path.join(self.tmp, "installs.log")
+
+    def _wait(self, pool, ready):
+        for _ in range(200):
+            if pool._ready.qsize() == ready and pool._preparing == 0:
+                return
+            threading.Event().wait(0.05)
+        self.fail("workspace pool did not settle")
+
+    def _git(self, path, *args):
+        return subprocess.run(["git", "-C", str(path), *args], check=True, capture_output=True, text=True).stdout
+
+    def test_reuses_reset_workspaces_and_shared_node_modules(self):
+        install = f"mkdir -p node_modules && touch node_modules/.installed && echo x >> {self.installs}"
+        pool = WorkspacePool(os.path.join(self.tmp, "pool"), self.origin, "main", size=1)
+        with mock.patch.dict(os.environ, {"DEPENDENCY_INSTALL_CMD": install}), mock.patch("builtins.print"):
+            first = pool.acquire()
+            self._wait(pool, ready=1)
+            second = pool._ready.get()
+
+            node_modules = first / "demo2" / "backend" / "node_modules"
+            self.assertTrue(node_modules.is_symlink())
+            self.assertEqual(node_modules.resolve(), (second / "demo2" / "backend" / "node_modules").resolve())
+            self.assertTrue((node_modules / ".installed").exists())
+            self.assertEqual(self._git(first, "status", "--porcelain"), "")
+
+            self._git(first, "checkout", "-q", "-b", "claude/fix-1")
+            (first / "demo2" / "backend" / "package.json").write_text("{}\n")
+            (first / "scratch.txt").write_text("left over\n")
+            pool.release(first)
+            self._wait(pool, ready=1)
+
+            self.assertEqual(pool._ready.get(), first)
+            self.assertEqual(self._git(first, "status", "--porcelain"), "")
+            self.assertEqual(self._git(first, "branch", "--format=%(refname:short)").split(), ["main"])
+            self.assertTrue((first / "demo2" / "backend" / "node_modules" / ".installed").exists())
+        # Editing the manifest may have changed the shared tree, so it was installed again.
+        with open(self.installs) as installs:
+            self.assertEqual(len(installs.read().splitlines()), 2)
+
+    def test_changed_dependencies_retire_the_cache_entry_without_breaking_other_workspaces(self):
+        install = f"mkdir -p node_modules && touch node_modules/.installed && echo x >> {self.installs}"
+        pool = WorkspacePool(os.path.join(self.tmp, "pool"), self.origin, "main", size=2)
+        with mock.patch.dict(os.environ, {"DEPENDENCY_INSTALL_CMD": install}), mock.patch("builtins.print"):
+            first = pool.acquire()
+            self._wait(pool, ready=2)
+            old_entry = (first / "demo2" / "backend" / "node_modules").resolve()
+
+            (first / "demo2" / "backend" / "package.json").write_text("{}\n")
+            pool.release(first)
+            for _ in range(200):
+                if not first.exists():
+                    break
+                threading.Event().wait(0.05)
+
+            # The pool was full, so `first` was dropped; the ready workspaces still resolve.
+            for ready in list(pool._ready.queue):
+                self.assertTrue((ready / "demo2" / "backend" / "node_modules" / ".installed").exists())
+
+            acquired = [pool.acquire(), pool.acquire()]
+            for workspace in acquired:
+                node_modules = workspace / "demo2" / "backend" / "node_modules"
+                self.assertNotEqual(node_modules.resolve(), old_entry)
+                self.assertTrue((node_modules / ".installed").exists())
+            self._wait(pool, ready=2)
+            self.assertFalse(old_entry.exists())
+        with open(self.installs) as installs:
+            self.assertEqual(len(installs.read().splitlines()), 2)
+
+    def test_falls_back_to_cloning_without_file_locks_or_symlinks(self):
+        env = {"WORKSPACE_POOL_DIR": os.path.join(self.tmp, "pool"), "WORKSPACE_POOL_SIZE": "2"}
+        with mock.patch.dict(os.environ, env), mock.patch("builtins.print"):
+            with mock.patch.dict("agent.workspaces._pools", clear=True):
+                self.assertIsInstance(workspace_pool(self.origin, "main"), WorkspacePool)
+            with mock.patch.dict("agent.workspaces._pools", clear=True), \
+                    mock.patch("agent.workspaces.fcntl", None), mock.patch("agent.workspaces.msvcrt", None):
+                self.assertIsNone(workspace_pool(self.origin, "main"))
+            with mock.patch.dict("agent.workspaces._pools", clear=True), \
+                    mock.patch("pathlib.Path.symlink_to", side_effect=OSError("symbolic links are not allowed")):
+                self.assertIsNone(workspace_pool(self.origin, "main"))
+        self.assertEqual(os.listdir(env["WORKSPACE_POOL_DIR"]), [])
+
+
+class StageGraphTests(SimpleTestCase):
+    def test_independent_stages_overlap_and_dependents_wait(self):
+        both_running = threading.Barrier(2, timeout=5)
+        order = []
+        stages = StageGraph()
+        stages.add("push", lambda _inputs: (both_running.wait(), order.append("push"), "pushed")[-1])
+        stages.add("fields", lambda _inputs: (both_running.wait(), order.append("fields"), "drafted")[-1])
+        stages.add("record", lambda inputs: (order.append("record"), inputs["push"] + "+record")[-1], after=("push",))
+        with stages.timed("agent"):
+            pass
+
+        results = stages.run()
+
+        self.assertEqual(results, {"push": "pushed", "fields": "drafted", "record": "pushed+record"})
+        self.assertLess(order.index("push"), order.index("record"))
+        self.assertCountEqual(stages.timings, ["agent", "push", "fields", "record"])
+
+    def test_failure_skips_dependents_and_is_raised(self):
+        ran = []
+        stages = StageGraph()
+        stages.add("push", mock.Mock(side_effect=RuntimeError("push rejected")))
+        stages.add("record", lambda _inputs: ran.append("record"), after=("push",))
+        stages.add("fields", lambda _inputs: ran.append("fields"))
+        with self.assertRaisesRegex(RuntimeError, "push rejected"):
+            stages.run()
+        self.assertEqual(ran, ["fields"])
+        with self.assertRaises(ValueError):
+            stages.add("pr", lambda _inputs: None, after=("missing",))
+
+
+class RunControlTests(TestCase):
+    def _wait_dead(self, pid):
+        for _ in range(100):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return
+            threading.Event().wait(0.05)
+        self.fail(f"process {pid} still running")
+
+    def test_timeout_and_cancel_kill_the_process_group(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pid_file = os.path.join(tmp, "pid")
+            script = f"sleep 30 & echo $! > {pid_file}; wait"
+
+            with self.assertRaises(subprocess.TimeoutExpired):
+                run_process(["sh", "-c", script], cwd=tmp, timeout=0.5, poll=0.1)
+            with open(pid_file) as pid:
+                self._wait_dead(int(pid.read()))
+
+            with process_limits(stop_reason=lambda: "cancelled"), self.assertRaises(ProcessStopped) as stopped:
+                run_process(["sh", "-c", script], cwd=tmp, timeout=30, poll=0.1)
+            self.assertEqual(stopped.exception.reason, "cancelled")
+            with open(pid_file) as pid:
+                self._wait_dead(int(pid.read()))
+
+    def test_windows_branch_stops_the_process_without_process_groups(self):
+        # No taskkill here, so this also covers its fallback to killing the child.
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch("agent.utils._WINDOWS", True), mock.patch("agent.utils._NEW_GROUP", {}), \
+                mock.patch("agent.utils.os.killpg", side_effect=AssertionError("used killpg")):
+            with self.assertRaises(subprocess.TimeoutExpired):
+                run_process(["sleep", "30"], cwd=tmp, timeout=0.3, poll=0.1)
+            with process_limits(stop_reason=lambda: "cancelled"), self.assertRaises(ProcessStopped) as stopped:
+                run_process(["sleep", "30"], cwd=tmp, timeout=30, poll=0.1)
+        self.assertEqual(stopped.exception.reason, "cancelled")
+
+    def test_cancel_polls_from_stage_threads_close_their_connections(self):
+        control = RunControl(detection_run_id=1)
+        graph = StageGraph()
+        graph.add("poll", lambda _inputs: control.stop_reason())
+        # The test transaction keeps the table locked for other threads, so the lookup is faked.
+        with mock.patch("api.run_control.DetectionRun") as run_model, \
+                mock.patch("api.run_control.connections") as run_connections:
+            run_model.objects.filter.return_value.exists.return_value = False
+            control.cancelled()
+            run_connections.close_all.assert_not_called()
+            with control.stage("agent_session"), mock.patch.object(RunControl, "CANCEL_POLL_SECONDS", 0):
+                self.assertEqual(graph.run(), {"poll": None})
+        self.assertEqual(run_model.objects.filter.call_count, 2)
+        run_connections.close_all.assert_called_once_with()
+
+    def test_cancel_action_stops_the_run_and_keeps_partial_results(self):
+        traces = [
+            make_n_plus_one_trace("first", repeats=8, query_duration=900_000, frame="at b (src/b.ts:20:1)"),
+            make_n_plus_one_trace("second", repeats=3, frame="at a (src/a.ts:10:1)"),
+        ]
+        pull_request = PullRequest.objects.create(
+            repo_owner="acme", repo_name="shop", repo_url="https://github.com/acme/shop",
+            base_branch="main", head_branch="claude/fix-1", title="PR 1", body="report",
+        )
+        client = APIClient()
+
+        def fake_generate_pr(repo_url, prompt, **_kwargs):
+            if "src/b.ts" in prompt:
+                return {"id": pull_request.id, "title": pull_request.title, "body": pull_request.body}
+            run = DetectionRun.objects.get()
+            self.assertEqual(client.post(f"/api/detection-runs/{run.id}/cancel/").status_code, 202)
+            sh(settings.BASE_DIR, "sleep", "30")
+
+        with mock.patch("api.views.requests.get", JaegerStub({"svc": traces})), \
+                mock.patch("api.views.generate_pr", side_effect=fake_generate_pr), \
+                mock.patch("api.views.generate_incident_fields", side_effect=RuntimeError("offline")), \
+                mock.patch.object(RunControl, "CANCEL_POLL_SECONDS", 0), \
+                mock.patch("builtins.print"):
+            result, detection_run = run_detection_with_tracking()
+
+        self.assertEqual(list(result), ["first"])
+        self.assertEqual((detection_run.status, detection_run.incidentCount), ("cancelled", 1))
+        self.assertEqual(DeferredCandidate.objects.get().callSite, "at a (src/a.ts:10:1)")
+        stopped = Log.objects.get(step="generate_pr", level="warning")
+        self.assertEqual(stopped.context["reason"], "cancelled")
+        self.assertEqual(client.post(f"/api/detection-runs/{detection_run.id}/cancel/").status_code, 409)
+
+
+class AgentJobQueueTests(TestCase):
+    def _queue_run(self, **env):
+        traces = [make_n_plus_one_trace("first", repeats=8, query_duration=900_000, frame="at b (src/b.ts:20:1)")]
+        with mock.patch.dict(os.environ, {"AGENT_QUEUE": "db", **env}), \
+                mock.patch("api.views.requests.get", JaegerStub({"svc": traces})), \
+                mock.patch("api.views.generate_pr", side_effect=AssertionError("ran the agent inline")), \
+                mock.patch("builtins.print"):
+            return run_detection_with_tracking()
+
+    def test_worker_runs_queued_session_and_reports_back(self):
+        result, detection_run = self._queue_run()
+        self.assertEqual(result, {})
+        # Not finished until the workers are done with its sessions.
+        self.assertEqual(detection_run.status, "queued")
+        job = AgentJob.objects.get()
+        self.assertEqual((job.status, job.detectionRun_id), ("queued", detection_run.id))
+        self.assertEqual([candidate["callSite"] for candidate in job.candidates], ["at b (src/b.ts:20:1)"])
+        # A resumed run leaves the queued session to the workers.
+        self.assertEqual(RunCheckpoint(detection_run).resumable_groups(), [])
+
+        pull_request = PullRequest.objects.create(
+            repo_owner="acme", repo_name="shop", repo_url="https://github.com/acme/shop",
+            base_branch="main", head_branch="claude/fix-1", title="PR 1", body="report",
+        )
+        generated = {"id": pull_request.id, "title": pull_request.title, "body": pull_request.body}
+        client = APIClient()
+        etag = client.get("/api/detection-runs/")["ETag"]
+        self.assertEqual(client.get("/api/stats/").json()["detectionRuns"]["incidentCount"], 0)
+        with mock.patch("api.views.generate_pr", return_value=generated) as generate_pr, \
+                mock.patch("api.views.generate_incident_fields", side_effect=RuntimeError("offline")), \
+                mock.patch("builtins.print"):
+            call_command("run_agent_worker", "--once", "--worker-id", "w1", stdout=io.StringIO())
+
+        self.assertIn("src/b.ts:20:1", generate_pr.call_args.kwargs["prompt"])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.leaseOwner), ("done", 1, ""))
+        self.assertEqual(job.result["incidentTraceIds"], ["first"])
+        self.assertEqual(Incident.objects.get().pullRequest_id, pull_request.id)
+        candidate = detection_run.candidates.get()
+        self.assertEqual((candidate.status, candidate.pullRequest_id), ("generated", pull_request.id))
+        detection_run.refresh_from_db()
+        self.assertEqual((detection_run.status, detection_run.incidentCount), ("success", 1))
+        response = client.get("/api/detection-runs/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["incidentCount"], 1)
+        self.assertEqual(client.get("/api/stats/").json()["detectionRuns"]["incidentCount"], 1)
+
+    def test_failed_job_leaves_the_run_partial_and_resumable(self):
+        _result, detection_run = self._queue_run(AGENT_JOB_MAX_ATTEMPTS="1")
+        with mock.patch("api.views.generate_pr", side_effect=RuntimeError("git push failed")), \
+                mock.patch("builtins.print"):
+            call_command("run_agent_worker", "--once", stdout=io.StringIO())
+
+        detection_run.refresh_from_db()
+        self.assertEqual((detection_run.status, detection_run.candidates.get().status), ("partial", "failed"))
+
+        pull_request = PullRequest.objects.create(
+            repo_owner="acme", repo_name="shop", repo_url="https://github.com/acme/shop",
+            base_branch="main", head_branch="claude/fix-1", title="PR 1", body="report",
+        )
+        generated = {"id": pull_request.id, "title": pull_request.title, "body": pull_request.body}
+        with mock.patch("api.views.generate_pr", return_value=generated), \
+                mock.patch("api.views.generate_incident_fields", side_effect=RuntimeError("offline")), \
+                mock.patch("builtins.print"):
+            response = APIClient().post(f"/api/detection-runs/{detection_run.id}/resume/")
+        self.assertEqual(response.status_code, 200)
+        detection_run.refresh_from_db()
+        self.assertEqual((detection_run.status, detection_run.incidentCount), ("success", 1))
+
+    def test_expired_lease_is_reclaimed_and_the_old_worker_is_fenced_off(self):
+        self._queue_run()
+        first = claim("a", lease_seconds=60)
+        self.assertIsNone(claim("b", lease_seconds=60))
+        self.assertTrue(heartbeat(first, "a", lease_seconds=60))
+
+        AgentJob.objects.filter(id=first.id).update(leaseExpiresAt=timezone.now() - timedelta(seconds=1))
+        second = claim("b", lease_seconds=60)
+        self.assertEqual((second.id, second.attempts, second.leaseOwner), (first.id, 2, "b"))
+        self.assertFalse(heartbeat(first, "a", lease_seconds=60))
+        self.assertIsNone(finish(first, "a", result={"stale": True}))
+
+        # Failed attempts go back to the queue until maxAttempts is used up.
+        self.assertEqual(finish(second, "b", error="clone failed"), "queued")
+        third = claim("c", lease_seconds=60)
+        self.assertEqual(finish(third, "c", error="clone failed"), "failed")
+        self.assertIsNone(claim("d", lease_seconds=60))
+
+    def test_reclaimed_job_adopts_the_pull_request_instead_of_rerunning_the_session(self):
+        _result, detection_run = self._queue_run()
+        pull_request = PullRequest.objects.create(
+            repo_owner="acme", repo_name="shop", repo_url="https://github.com/acme/shop",
+            base_branch="main", head_branch="claude/fix-1", title="PR 1", body="report",
+        )
+
+        def push_then_lose_the_lease(*_args, **_kwargs):
+            # The PR is open by the time the worker notices its lease is gone.
+            AgentJob.objects.update(leaseOwner="other", leaseExpiresAt=timezone.now() - timedelta(seconds=1))
+            return {"id": pull_request.id, "title": pull_request.title, "body": pull_request.body}
+
+        with mock.patch("api.views.generate_pr", side_effect=push_then_lose_the_lease), \
+                mock.patch("builtins.print"):
+            call_command("run_agent_worker", "--max-jobs", "1", "--worker-id", "a", stdout=io.StringIO())
+        job = AgentJob.objects.get()
+        self.assertEqual(job.result["session"]["id"], pull_request.id)
+        self.assertFalse(Incident.objects.exists())
+
+        with mock.patch("api.views.generate_pr", side_effect=AssertionError("reran the session")), \
+                mock.patch("api.views.generate_incident_fields", side_effect=RuntimeError("offline")), \
+                mock.patch("builtins.print"):
+            call_command("run_agent_worker", "--once", "--worker-id", "b", stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result["pullRequestId"]), ("done", 2, pull_request.id))
+        self.assertEqual(Incident.objects.get().pullRequest_id, pull_request.id)
+        self.assertEqual(PullRequest.objects.count(), 1)
+        detection_run.refresh_from_db()
+        self.assertEqual((detection_run.status, detection_run.incidentCount), ("success", 1))
@@ -0,0 +1,166 @@
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+
+
+_LENGTH = struct.Struct("<I")
+
+
+class TraceStore:
+    """Append-only, compressed local store of raw Jaeger traces, keyed by traceID.
+
+    Traces are zlib-compressed JSON records appended to numbered segment files
+    (`segment-000001.log`). Each segment has a sidecar offset index
+    (`segment-000001.idx`, one `traceID<TAB>service<TAB>offset<TAB>length<TAB>storedAt`
+    line per record), so opening the store only reads the small index files, and
+    reads slice the record straight out of a memory-mapped segment.
+
+    Segments roll over at `segment_bytes`. Retention drops whole segments, oldest
+    first, once the store exceeds `max_bytes` or a segment is older than
+    `max_age_days`. One writer at a time; any number of readers.
+    """
+
+    def __init__(
+        self,
+        path,
+        segment_bytes: int = 64 * 1024 * 1024,
+        max_bytes: int | None = None,
+        max_age_days: float | None = None,
+        compress_level: int = 6,
+    ):
+        self.path = Path(path)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.compress_level = compress_level
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._index = {}  # traceID -> (segment number, service, offset, length)
+        self._maps = {}
+        self._load_index()
+        segments = self.segments()
+        self._active = segments[-1] if segments else 1
+        self._active_size = self._segment_path(self._active, "log").stat().st_size if segments else 0
+
+    @classmethod
+    def from_env(cls) -> "TraceStore":
+        max_bytes = os.getenv("TRACE_STORE_MAX_BYTES")
+        max_age_days = os.getenv("TRACE_STORE_MAX_AGE_DAYS")
+        return cls(
+            os.getenv("TRACE_STORE_DIR") or Path(settings.BASE_DIR) / "trace_store",
+            segment_bytes=int(os.getenv("TRACE_STORE_SEGMENT_BYTES", str(64 * 1024 * 1024))),
+            max_bytes=int(max_bytes) if max_bytes else None,
+            max_age_days=float(max_age_days) if max_age_days else None,
+        )
+
+    def _segment_path(self, number: int, suffix: str) -> Path:
+        return self.path / f"segment-{number:06d}.{suffix}"
+
+    def segments(self) -> list[int]:
+        return sorted(int(path.stem.split("-")[1]) for path in self.path.glob("segment-*.log"))
+
+    def _load_index(self):
+        for number in self.segments():
+            index_path = self._segment_path(number, "idx")
+            if not index_path.exists():
+                continue
+            with open(index_path, encoding="utf-8") as index_file:
+                for line in index_file:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) != 5:
+                        continue  # torn write at the tail of the index
+                    trace_id, service, offset, length, _stored_at = parts
+                    self._index[trace_id] = (number, service, int(offset), int(length))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, trace_id) -> bool:
+        return trace_id in self._index
+
+    def put(self, trace: dict, service: str = "") -> bool:
+        """Append a trace unless its traceID is already stored. Returns whether it was written."""
+        trace_id = trace.get("traceID")
+        if not trace_id or trace_id in self._index:
+            return False
+
+        if self._active_size >= self.segment_bytes:
+            self._active += 1
+            self._active_size = 0
+        number = self._active
+        segment_path = self._segment_path(number, "log")
+
+        payload = zlib.compress(json.dumps(trace, separators=(",", ":")).encode("utf-8"), self.compress_level)
+        with open(segment_path, "ab") as segment_file:
+            offset = segment_file.tell() + _LENGTH.size
+            segment_file.write(_LENGTH.pack(len(payload)) + payload)
+        # The index line goes last, so a crash mid-append leaves at most an unindexed record.
+        with open(self._segment_path(number, "idx"), "a", encoding="utf-8") as index_file:
+            index_file.write(f"{trace_id}\t{service}\t{offset}\t{len(payload)}\t{int(time.time())}\n")
+
+        self._index[trace_id] = (number, service, offset, len(payload))
+        self._active_size = offset + len(payload)
+        mapped = self._maps.pop(number, None)  # the segment grew; remap on next read
+        if mapped is not None:
+            mapped.close()
+        return True
+
+    def _map(self, number: int):
+        mapped = self._maps.get(number)
+        if mapped is None:
+            with open(self._segment_path(number, "log"), "rb") as segment_file:
+                mapped = self._maps[number] = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped
+
+    def get(self, trace_id: str) -> dict | None:
+        entry = self._index.get(trace_id)
+        if entry is None:
+            return None
+        number, _service, offset, length = entry
+        return json.loads(zlib.decompress(self._map(number)[offset:offset + length]))
+
+    def iter_traces(self):
+        """Yield `(service, trace)` for every stored trace, in append order."""
+        for trace_id, (number, service, offset, length) in sorted(
+            self._index.items(), key=lambda item: (item[1][0], item[1][2])
+        ):
+            yield service, json.loads(zlib.decompress(self._map(number)[offset:offset + length]))
+
+    def enforce_retention(self) -> list[int]:
+        """Delete whole segments past the age or size limit, oldest first. Returns the removed numbers."""
+        segments = self.segments()
+        removed = []
+        now = time.time()
+        sizes = {number: self._segment_path(number, "log").stat().st_size for number in segments}
+        total = sum(sizes.values())
+        # Never drop the segment currently being appended to.
+        for number in segments[:-1]:
+            too_old = (
+                self.max_age_days is not None
+                and now - self._segment_path(number, "log").stat().st_mtime > self.max_age_days * 86400
+            )
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_big):
+                break
+            self._drop_segment(number)
+            total -= sizes[number]
+            removed.append(number)
+        return removed
+
+    def _drop_segment(self, number: int):
+        mapped = self._maps.pop(number, None)
+        if mapped is not None:
+            mapped.close()
+        self._segment_path(number, "log").unlink(missing_ok=True)
+        self._segment_path(number, "idx").unlink(missing_ok=True)
+        self._index = {trace_id: entry for trace_id, entry in self._index.items() if entry[0] != number}
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps.clear()
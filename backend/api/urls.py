@@ -1,5 +1,15 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import DetectionRunViewSet, IncidentViewSet, LogViewSet, PullRequestViewSet
+from .views import (
+    DetectionRunViewSet,
+    IncidentViewSet,
+    LiveViewSet,
+    LogViewSet,
+    MergedFixViewSet,
+    PullRequestViewSet,
+    StatsViewSet,
+    otlp_traces,
+)
 
 
 router = DefaultRouter()
@@ -7,5 +17,11 @@ router.register(r"pull-requests", PullRequestViewSet, basename="pull-request")
 router.register(r"incidents", IncidentViewSet, basename="incident")
 router.register(r"logs", LogViewSet, basename="log")
 router.register(r"detection-runs", DetectionRunViewSet, basename="detection-run")
+router.register(r"stats", StatsViewSet, basename="stats")
+router.register(r"live", LiveViewSet, basename="live")
+router.register(r"merged-fixes", MergedFixViewSet, basename="merged-fix")
 
-urlpatterns = router.urls
+urlpatterns = [
+    path("otlp/v1/traces", otlp_traces, name="otlp-traces"),
+    *router.urls,
+]
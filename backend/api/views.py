@@ -1,5 +1,13 @@
 import os
+import threading
+import time
 import uuid
+from django.db import connections
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -13,13 +21,57 @@ if str(REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(REPO_ROOT))
 
 
-from agent.agent import generate_pr, generate_incident_fields
-
-from .models import DetectionRun, Incident, Log, PullRequest
-from .serializers import DetectionRunSerializer, IncidentSerializer, LogSerializer, PullRequestSerializer
-
-
-class PullRequestViewSet(viewsets.ModelViewSet):
+from agent.agent import generate_pr, generate_incident_fields, warm_workspaces
+from agent.utils import ProcessStopped
+
+from .analysis import analyze_trace, call_site_latency, incident_call_site, incident_rank
+from .baselines import REQUEST, compare_and_update_baselines, record_latency
+from .checkpoints import RunCheckpoint
+from .code_index import CodeIndex, candidate_contexts, render_context
+from .conditional import ConditionalListMixin
+from .fast_serializers import FastListMixin
+from .hotspots import HotspotTree, stack_latency
+from .impact import CallSiteImpact
+from .job_queue import enqueue, finish, heartbeat, outstanding_jobs, queue_enabled, record_session, settle_run
+from .live import live_analyzer
+from .log_stream import stream_run_logs
+from .models import DetectionRun, Incident, Log, MergedFix, PullRequest, RunCandidate
+from .otlp import (
+    JSON as OTLP_JSON,
+    PROTOBUF as OTLP_PROTOBUF,
+    PayloadTooLarge,
+    UnsupportedContentType,
+    decode_export_request,
+    gunzip,
+)
+from .post_merge import PostMergeTracker, call_site_sketch, record_merge
+from .pr_queue import (
+    RunBudget,
+    candidate_source_file,
+    defer_candidates,
+    group_candidates,
+    load_deferred_candidates,
+    mark_started,
+    schedule_candidates,
+)
+from .renderers import EventStreamRenderer
+from .run_control import RunControl
+from .run_log import RunLogger
+from .sampling import StratifiedTraceSampler
+from .serializers import (
+    DetectionRunSerializer,
+    IncidentSerializer,
+    LogSerializer,
+    MergedFixSerializer,
+    PullRequestSerializer,
+    RunCandidateSerializer,
+)
+from .spans import SpanTree, span_tags, trace_profile, trace_route
+from .stats import get_dashboard_stats, invalidate_stats
+from .trace_store import TraceStore
+
+
+class PullRequestViewSet(ConditionalListMixin, viewsets.ModelViewSet):
     queryset = PullRequest.objects.all().order_by("-created_at")
     serializer_class = PullRequestSerializer
     http_method_names = ["get", "post", "head", "options"]
@@ -49,6 +101,13 @@ class PullRequestViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_502_BAD_GATEWAY,
             )
 
+        # Keep what is needed to check the fix against production traces after the merge.
+        merged_fixes = []
+        for incident in record.incidents.all():
+            merged_fix = record_merge(incident, record, merge_sha=(merged or {}).get("sha") or "")
+            if merged_fix is not None:
+                merged_fixes.append(merged_fix.id)
+
         incident_count = record.incidents.count()
         record.incidents.all().delete()
         deleted_id = record.id
@@ -59,13 +118,14 @@ class PullRequestViewSet(viewsets.ModelViewSet):
                 "detail": "GitHub PR merged and local PullRequest/Incident records deleted.",
                 "deleted_pull_request_id": deleted_id,
                 "deleted_incident_count": incident_count,
+                "merged_fix_ids": merged_fixes,
                 "github_merge": merged,
             },
             status=status.HTTP_200_OK,
         )
 
 
-class IncidentViewSet(viewsets.ModelViewSet):
+class IncidentViewSet(ConditionalListMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Incident.objects.all().order_by("-id")
     serializer_class = IncidentSerializer
 
@@ -92,8 +152,10 @@ class IncidentViewSet(viewsets.ModelViewSet):
         )
 
 
-class LogViewSet(viewsets.ReadOnlyModelViewSet):
+class LogViewSet(ConditionalListMixin, FastListMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = LogSerializer
+    # Logs are append-only.
+    last_modified_field = "created_at"
 
     def get_queryset(self):
         qs = Log.objects.all().order_by("-created_at", "-id")
@@ -129,8 +191,46 @@ class LogViewSet(viewsets.ReadOnlyModelViewSet):
 
         return qs
 
+    @action(detail=False, methods=["get"], url_path="stream", renderer_classes=[EventStreamRenderer])
+    def stream(self, request):
+        """Server-sent events for the Log rows of one detection run.
+
+        Pass `run_id` (defaults to the most recent DetectionRun). Resume with the
+        standard `Last-Event-ID` header or a `last_event_id` query parameter.
+        """
+        run_id = request.query_params.get("run_id")
+        if not run_id:
+            run_id = (
+                DetectionRun.objects.exclude(runId="")
+                .order_by("-date", "-id")
+                .values_list("runId", flat=True)
+                .first()
+            )
+        if not run_id:
+            return Response(
+                {"detail": "No run_id given and no tracked detection run exists."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        last_event_id = request.headers.get("Last-Event-ID") or request.query_params.get("last_event_id") or 0
+        try:
+            last_event_id = max(0, int(last_event_id))
+        except (TypeError, ValueError):
+            return Response(
+                {"detail": "Invalid Last-Event-ID. Expected a log id."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-class DetectionRunViewSet(viewsets.ReadOnlyModelViewSet):
+        response = StreamingHttpResponse(
+            stream_run_logs(run_id, last_event_id),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+class DetectionRunViewSet(ConditionalListMixin, FastListMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = DetectionRunSerializer
 
     def get_queryset(self):
@@ -155,30 +255,196 @@ class DetectionRunViewSet(viewsets.ReadOnlyModelViewSet):
 
         return qs
 
+    @action(detail=True, methods=["post"], url_path="cancel")
+    def cancel(self, request, pk=None):
+        """Ask a running detection to stop; it keeps the incidents created so far."""
+        detection_run = self.get_object()
+        if detection_run.status not in ("running", "queued"):
+            return Response(
+                {"detail": f"Detection run is not running (status: {detection_run.status})."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        detection_run.cancelRequested = True
+        detection_run.save(update_fields=["cancelRequested", "updated_at"])
+        return Response(self.get_serializer(detection_run).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=["post"], url_path="resume")
+    def resume(self, request, pk=None):
+        """Continue a failed, cancelled, timed-out or partial run from its checkpoint."""
+        detection_run = self.get_object()
+        try:
+            resumed = resume_detection_run(detection_run)
+        except Exception as exc:
+            return Response(
+                {"detail": f"Failed to resume detection run: {exc}"},
+                status=status.HTTP_502_BAD_GATEWAY,
+            )
+        if resumed is None:
+            detection_run.refresh_from_db(fields=["status"])
+            return Response(
+                {"detail": f"Detection run cannot be resumed (status: {detection_run.status})."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        traces, detection_run = resumed
+        return Response(
+            {"data": traces, "count": len(traces), "detectionRunId": detection_run.id},
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=["get"], url_path="candidates")
+    def candidates(self, request, pk=None):
+        """The run's checkpointed candidates and how far each of them got."""
+        detection_run = self.get_object()
+        rows = RunCandidate.objects.filter(detectionRun=detection_run).order_by("position")
+        return Response(RunCandidateSerializer(rows, many=True).data, status=status.HTTP_200_OK)
+
+
+class MergedFixViewSet(ConditionalListMixin, viewsets.ReadOnlyModelViewSet):
+    """Merged fixes and how their call site's latency changed in traces after the merge."""
+
+    serializer_class = MergedFixSerializer
+
+    def get_queryset(self):
+        qs = MergedFix.objects.all().order_by("-mergedAt", "-id")
+        status_param = self.request.query_params.get("status")
+        if status_param:
+            qs = qs.filter(status=status_param)
+        return qs
+
+
+class StatsViewSet(viewsets.ViewSet):
+    def list(self, request):
+        return Response(get_dashboard_stats(), status=status.HTTP_200_OK)
+
+
+class LiveViewSet(viewsets.ViewSet):
+    """Per-call-site aggregates of the traces pushed to the OTLP receiver, as of now."""
+
+    def list(self, request):
+        return Response(live_analyzer.snapshot(), status=status.HTTP_200_OK)
+
+
+@csrf_exempt
+@require_POST
+def otlp_traces(request):
+    """OTLP/HTTP trace receiver: `ExportTraceServiceRequest` as protobuf or JSON, optionally gzipped."""
+    body = request.body
+    if request.headers.get("Content-Encoding", "").lower() == "gzip":
+        try:
+            body = gunzip(body, int(os.getenv("OTLP_MAX_DECOMPRESSED_BYTES", str(64 * 1024 * 1024))))
+        except PayloadTooLarge as exc:
+            return HttpResponse(str(exc), status=413, content_type="text/plain")
+        except ValueError as exc:
+            return HttpResponse(str(exc), status=400, content_type="text/plain")
+
+    try:
+        spans = decode_export_request(body, request.content_type)
+    except UnsupportedContentType as exc:
+        return HttpResponse(str(exc), status=415, content_type="text/plain")
+    except ValueError as exc:
+        return HttpResponse(str(exc), status=400, content_type="text/plain")
+
+    live_analyzer.add_spans(spans)
+    # An empty ExportTraceServiceResponse means every span was accepted.
+    if request.content_type == OTLP_PROTOBUF:
+        return HttpResponse(b"", content_type=OTLP_PROTOBUF)
+    return HttpResponse(b"{}", content_type=OTLP_JSON)
+
 
 def run_detection_with_tracking(run_type: str = "manual"):
     detection_run = DetectionRun.objects.create(
         runType=run_type,
-        status="success",
+        runId=uuid.uuid4().hex[:12],
+        status="running",
         errorMessage="",
         incidentCount=0,
     )
+    control = RunControl.from_env(detection_run.id)
     try:
-        traces = detect_incidents(runType=run_type)
+        traces = detect_incidents(
+            runType=run_type, run_id=detection_run.runId, control=control, detection_run=detection_run,
+        )
     except Exception as exc:
         detection_run.status = "failure"
         detection_run.errorMessage = str(exc)
         detection_run.incidentCount = 0
-        detection_run.save(update_fields=["status", "errorMessage", "incidentCount"])
+        detection_run.save(update_fields=["status", "errorMessage", "incidentCount", "updated_at"])
         raise
 
-    detection_run.status = "success"
-    detection_run.errorMessage = ""
-    detection_run.incidentCount = len(traces) if hasattr(traces, "__len__") else 0
-    detection_run.save(update_fields=["status", "errorMessage", "incidentCount"])
+    _finish_detection_run(detection_run, control, len(traces) if hasattr(traces, "__len__") else 0)
     return traces, detection_run
 
 
+RESUMABLE_RUN_STATUSES = {"failure", "cancelled", "timeout", "partial"}
+
+
+def resume_detection_run(detection_run):
+    """Continue a failed, cancelled, timed-out or partial run from its checkpoint.
+
+    Only the candidates that are still pending, failed or deferred (and not picked up by a
+    later run since) get an agent session; traces are not fetched or analyzed again. A run
+    that failed before its analysis was checkpointed is run again from the start.
+
+    Returns None when the run is not (or no longer) in a resumable status. The status is
+    claimed with a conditional UPDATE, so two concurrent resumes cannot both start.
+    """
+    claimed = DetectionRun.objects.filter(id=detection_run.id, status__in=RESUMABLE_RUN_STATUSES).update(
+        status="running", errorMessage="", cancelRequested=False, updated_at=timezone.now(),
+    )
+    if not claimed:
+        return None
+    invalidate_stats()
+    detection_run.refresh_from_db()
+    control = RunControl.from_env(detection_run.id)
+    checkpoint = RunCheckpoint(detection_run)
+    try:
+        if checkpoint.exists:
+            traces = resume_incidents(checkpoint, control)
+        else:
+            traces = detect_incidents(
+                runType=detection_run.runType, run_id=detection_run.runId, control=control, detection_run=detection_run,
+            )
+    except Exception as exc:
+        detection_run.status = "failure"
+        detection_run.errorMessage = str(exc)
+        detection_run.save(update_fields=["status", "errorMessage", "updated_at"])
+        raise
+
+    _finish_detection_run(detection_run, control, len(traces))
+    return traces, detection_run
+
+
+def _finish_detection_run(detection_run, control, created_count: int):
+    """Final status of a run, with the `created_count` incidents it created itself added to its count.
+
+    Agent workers add the incidents of queued sessions to the count themselves. While any
+    of those jobs is outstanding the run stays "queued" and the last job finishes it.
+    """
+    failed = RunCandidate.objects.filter(detectionRun=detection_run, status="failed").count()
+    # A stopped run still keeps the incidents it created before it stopped.
+    if control.stopped == "cancelled":
+        detection_run.status = "cancelled"
+        detection_run.errorMessage = f"Cancelled after {control.elapsed:.0f}s."
+    elif control.stopped == "run_deadline":
+        detection_run.status = "timeout"
+        detection_run.errorMessage = f"Stopped at the run deadline after {control.elapsed:.0f}s."
+    elif outstanding_jobs(detection_run.id).exists():
+        detection_run.status = "queued"
+        detection_run.errorMessage = ""
+    elif failed:
+        detection_run.status = "partial"
+        detection_run.errorMessage = f"{failed} candidate(s) failed; resume the run to retry them."
+    else:
+        detection_run.status = "success"
+        detection_run.errorMessage = ""
+    detection_run.incidentCount = F("incidentCount") + created_count
+    detection_run.save(update_fields=["status", "errorMessage", "incidentCount", "updated_at"])
+    detection_run.refresh_from_db(fields=["incidentCount"])
+    if detection_run.status == "queued" and settle_run(detection_run.id):
+        # The workers were done before the run was marked queued.
+        detection_run.refresh_from_db(fields=["status", "errorMessage", "updated_at"])
+
+
 def merge_pr(owner: str, repo: str, token: str, head: str, base: str):
     auth_headers = [f"Bearer {token}", f"token {token}"]
     last_response = None
@@ -243,11 +509,25 @@ def merge_pr(owner: str, repo: str, token: str, head: str, base: str):
 
 
 def create_prompt_from_incident(incident):
-    prompt = "You are an expert in optimizing code performance without changing the output of the code.\n"
-    prompt += "These are the locations where the slow code is located:\nIn demo2/backend/"
+    return create_prompt_from_incidents([incident])
+
 
-    slowCallOperation = incident.get("callOperations")[0]
-    prompt += f"{slowCallOperation.get("callOperation").get("tag")}\n"
+def create_prompt_from_incidents(incidents):
+    """One agent prompt for a batch of incidents whose slow code shares a file or module."""
+    prompt = "You are an expert in optimizing code performance without changing the output of the code.\n"
+    if len(incidents) == 1:
+        prompt += "These are the locations where the slow code is located:\nIn demo2/backend/"
+        prompt += _incident_prompt_details(incidents[0])
+    else:
+        files = sorted({candidate_source_file(incident) or "unknown" for incident in incidents})
+        prompt += (
+            f"There are {len(incidents)} slow call sites in {', '.join(f'demo2/backend/{path}' for path in files)}. "
+            "Fix all of them in the same change.\n"
+        )
+        for number, incident in enumerate(incidents, 1):
+            prompt += f"\nCall site {number} of {len(incidents)}, on {incident.get('httpTarget') or 'unknown route'}: In demo2/backend/"
+            prompt += _incident_prompt_details(incident)
+        prompt += "\n"
 
     prompt += "Try to keep the performance optimization in this area, but you may move outside of the area if it is necessary to improve performance.\n"
     prompt += "Do not use query raw. Use prisma syntax. It is very important that you identify and fix N+1 queries, while keeping the behavior of the code the same."
@@ -257,27 +537,122 @@ def create_prompt_from_incident(incident):
     return prompt
 
 
-from collections import defaultdict
+def _incident_prompt_details(incident):
+    prompt = f"{incident_call_site(incident)}\n"
 
-def detect_incidents(runType: str = "manual"):
-    run_id = uuid.uuid4().hex[:12]
+    hotspot = incident.get("hotspot")
+    if hotspot:
+        prompt += (
+            f"Most of the latency is spent in {hotspot['function']} at demo2/backend/{hotspot['location']} "
+            f"({hotspot['exclusiveMicros'] / 1000:.1f} ms in the function itself, "
+            f"{hotspot['inclusiveMicros'] / 1000:.1f} ms including its callees, over all slow requests).\n"
+        )
 
-    def log_event(step, message, *, level="info", context=None, incident=None, pull_request=None):
-        try:
-            Log.objects.create(
-                run_id=run_id,
-                source="detect_incidents",
-                step=step,
-                level=level,
-                message=message,
-                context=context or {},
-                incident=incident,
-                pull_request=pull_request,
+    for context in incident.get("sourceContext") or []:
+        prompt += render_context(context)
+
+    latency = call_site_latency(incident)
+    if latency and incident.get("duration"):
+        prompt += (
+            f"This call site accounts for {latency / 1000:.1f} ms of the request's "
+            f"{incident['duration'] / 1000:.1f} ms critical path.\n"
+        )
+
+    regressions = incident.get("regressions") or []
+    if regressions:
+        prompt += f"Latency regressions on {incident.get('httpTarget') or 'this route'} compared to its baseline:\n"
+        for regression in regressions:
+            prompt += (
+                f"- {regression['callSite'] or 'whole request'}: "
+                f"p95 {regression['baselineP95'] / 1000:.1f} ms -> {regression['runP95'] / 1000:.1f} ms, "
+                f"p99 {(regression['baselineP99'] or 0) / 1000:.1f} ms -> {regression['runP99'] / 1000:.1f} ms\n"
             )
-        except Exception as exc:
-            print(f"Failed to persist detect_incidents log ({step}): {exc}")
 
-    log_event("start", "Starting incident detection run.")
+    impact = incident.get("impact")
+    if impact and impact["occurrences"] > 1:
+        prompt += (
+            f"The same call site was slow in {round(impact['occurrences'])} requests "
+            f"({', '.join(impact['affectedRoutes'][:5])}), adding {impact['meanAddedMicros'] / 1000:.1f} ms "
+            f"on average and {impact['totalAddedMicros'] / 1000:.1f} ms in total.\n"
+        )
+
+    n_plus_one = incident.get("nPlusOne") or []
+    if n_plus_one:
+        prompt += "Detected N+1 query patterns (the same query repeated once per item within a single request):\n"
+        for pattern in n_plus_one[:3]:
+            prompt += (
+                f"- Executed {pattern['repeatCount']} times from {pattern.get('callSite') or 'an unknown call site'}, "
+                f"{pattern['totalDuration'] / 1000:.1f} ms in total: {pattern['fingerprint']}\n"
+            )
+
+    if incident.get("hotspotStack"):
+        prompt += "Aggregated call stacks of the slow requests (time including callees, time in the function itself):\n"
+        prompt += f"{incident['hotspotStack']}\n"
+
+    return prompt
+
+
+def detect_incidents(
+    runType: str = "manual",
+    run_id: str | None = None,
+    traces=None,
+    dry_run: bool = False,
+    control: RunControl | None = None,
+    detection_run: DetectionRun | None = None,
+):
+    """Analyze traces and open a PR plus Incident for each of the costliest slow call sites.
+
+    `traces` replaces the configured trace source with an iterable of `(service_name, trace)`
+    pairs (see api.replay). With `dry_run`, no agent sessions are started and no incidents,
+    baselines or carried-over candidates are written; the candidates that would have been
+    worked on are returned, each with the prompt it would have been given.
+
+    `control` bounds the run and its stages in time and carries its cancel flag; when a
+    limit is hit the run stops early and returns what it has done (`control.stopped` says why).
+    With a `detection_run`, the analyzed candidates and their progress are checkpointed
+    for `resume_detection_run`.
+    """
+    run_id = run_id or uuid.uuid4().hex[:12]
+    log_event = RunLogger(run_id)
+    control = control if control is not None else RunControl.from_env()
+    try:
+        return _detect_incidents(log_event, traces=traces, dry_run=dry_run, control=control, detection_run=detection_run)
+    finally:
+        log_event.flush()
+
+
+def resume_incidents(checkpoint: RunCheckpoint, control: RunControl | None = None):
+    """Agent sessions for the checkpointed candidates of a run that are not done yet."""
+    log_event = RunLogger(checkpoint.detection_run.runId)
+    control = control if control is not None else RunControl.from_env()
+    try:
+        groups = checkpoint.resumable_groups()
+        log_event(
+            "resume",
+            "Resuming detection run from its checkpoint.",
+            context={
+                "group_count": len(groups),
+                "candidate_count": sum(len(group) for group in groups),
+                "statuses": checkpoint.counts(),
+            },
+        )
+        created_incident_candidates = _run_agent_sessions(log_event, groups, RunBudget.from_env(), control, checkpoint)
+        log_event(
+            "complete",
+            "Resumed detection run completed.",
+            context={
+                "created_incident_candidates": len(created_incident_candidates),
+                "stopped": control.stopped,
+                "statuses": checkpoint.counts(),
+            },
+        )
+        return created_incident_candidates
+    finally:
+        log_event.flush()
+
+
+def _iter_jaeger_traces(log_event):
+    """Yield `(service_name, trace)` for every trace the Jaeger query API returns, service by service."""
 
     jaeger_base_url = os.getenv("JAEGER_BASE_URL", "http://localhost:16686").rstrip("/")
     log_event("config", "Using Jaeger base URL.", context={"jaeger_base_url": jaeger_base_url})
@@ -305,7 +680,6 @@ def detect_incidents(runType: str = "manual"):
     else:
         log_event("fetch_services", "Fetched services from Jaeger.", context={"service_count": len(services)})
 
-    all_traces = []
     for service_name in services:
         traces_response = requests.get(
             f"{jaeger_base_url}/api/traces",
@@ -331,12 +705,13 @@ def detect_incidents(runType: str = "manual"):
         traces_payload = traces_response.json()
         traces = traces_payload.get("data", []) if isinstance(traces_payload, dict) else []
         if isinstance(traces, list):
-            all_traces.extend(traces)
             log_event(
                 "fetch_traces",
                 "Fetched traces for service.",
                 context={"service_name": service_name, "trace_count": len(traces)},
             )
+            for trace in traces:
+                yield service_name, trace
         else:
             log_event(
                 "fetch_traces",
@@ -345,18 +720,115 @@ def detect_incidents(runType: str = "manual"):
                 context={"service_name": service_name},
             )
 
-    log_event("fetch_traces", "Completed Jaeger trace fetch for all services.", context={"total_trace_count": len(all_traces)})
 
-    incidents = {}
+def _stop_early(control, stop_reason, log_event, step, message, context):
+    """Log why a stage stops early and return the reason; None while it may go on."""
+    reason = stop_reason()
+    if reason:
+        log_event(step, message, level="warning", context={"reason": reason, "elapsed_seconds": round(control.elapsed, 1), **context})
+    return reason
+
+
+def _detect_incidents(log_event, traces=None, dry_run=False, control=None, detection_run=None):
+    started_at = time.monotonic()
+    log_event("start", "Starting incident detection run.")
+    if not dry_run and os.getenv("GITHUB_LINK"):
+        # Clone and install in the background while the traces are analyzed.
+        warm_workspaces(os.getenv("GITHUB_LINK"))
+
+    # TRACE_SOURCE=store re-analyzes the local trace store instead of querying Jaeger,
+    # TRACE_SOURCE=live takes the traces pushed to the OTLP receiver since the last run;
+    # TRACE_STORE_RECORD=1 keeps a copy of everything fetched from Jaeger for the store.
+    trace_source = "replay" if traces is not None else os.getenv("TRACE_SOURCE", "jaeger").strip().lower()
+    record_traces = os.getenv("TRACE_STORE_RECORD", "").strip().lower() in {"1", "true", "yes", "on"}
+    store = TraceStore.from_env() if trace_source == "store" or (record_traces and trace_source == "jaeger") else None
+    if traces is not None:
+        source = traces
+    elif trace_source == "live":
+        source = live_analyzer.take_traces()
+        log_event("config", "Reading traces pushed to the OTLP receiver.", context={"trace_count": len(source)})
+    elif trace_source == "store":
+        log_event("config", "Reading traces from the local trace store.", context={"path": str(store.path), "trace_count": len(store)})
+        source = store.iter_traces()
+    else:
+        source = _iter_jaeger_traces(log_event)
+
+    # Keep every slow trace but only a bounded uniform sample of the fast bulk per service and route.
+    reservoir_size = int(os.getenv("TRACE_SAMPLE_RESERVOIR_SIZE", "200"))
+    sampler = StratifiedTraceSampler(
+        reservoir_size=reservoir_size,
+        tail_quantile=float(os.getenv("TRACE_SAMPLE_TAIL_QUANTILE", "0.9")),
+        warmup=int(os.getenv("TRACE_SAMPLE_WARMUP", "50")),
+    )
+    all_traces = []
+    fetched_trace_count = 0
+    stored_trace_count = 0
+    control.begin("fetch")
+    try:
+        for service_name, trace in source:
+            if _stop_early(control, control.stop_reason, log_event, "fetch_traces",
+                           "Stopped fetching traces early; analyzing the traces fetched so far.",
+                           {"fetched_trace_count": fetched_trace_count}):
+                break
+            fetched_trace_count += 1
+            spans = trace.get("spans") if isinstance(trace, dict) else None
+            if store is not None and trace_source != "store" and isinstance(spans, list):
+                stored_trace_count += store.put(trace, service=service_name)
+            if reservoir_size <= 0 or not isinstance(spans, list):
+                all_traces.append((trace, 1))
+                continue
+            route, duration = trace_profile(spans)
+            sampler.offer((service_name, route), duration, trace)
+
+        if store is not None and trace_source != "store":
+            dropped_segments = store.enforce_retention()
+            log_event(
+                "store_traces",
+                "Recorded fetched traces in the local trace store.",
+                context={"stored_trace_count": stored_trace_count, "dropped_segments": dropped_segments},
+            )
+    finally:
+        if store is not None:
+            store.close()
+
+    log_event(
+        "fetch_traces",
+        "Completed trace fetch for all services.",
+        context={"source": trace_source, "total_trace_count": fetched_trace_count},
+    )
+
+    all_traces.extend(sampler.sample())
+    log_event(
+        "sample_traces",
+        "Sampled traces for analysis.",
+        context={
+            "fetched_trace_count": fetched_trace_count,
+            "sampled_trace_count": len(all_traces),
+            "strata": sampler.stats()[:50],
+        },
+    )
+
+    n_plus_one_min_repeats = int(os.getenv("N_PLUS_ONE_MIN_REPEATS", "3"))
+    # Until a route has a baseline, fall back to an absolute cutoff.
+    cold_start_threshold = float(os.getenv("LATENCY_COLD_START_THRESHOLD_MS", "2000")) * 1000
+    impacts = {}
+    # Latency per code.stacktrace over all slow traces, and per call site for its incident.
+    hotspots = HotspotTree()
+    call_site_hotspots = {}
+    candidate_count = 0
     created_incident_candidates = {}
     skipped_missing_structure = 0
     skipped_fast = 0
-    for trace in all_traces:
-        # getSpan = None
-        callOperations = {}
-        # dbQuerySpan = None
-        callOperationSpans = defaultdict(list)
 
+    # First pass: record this run's latencies per route and call site.
+    analyzable = []
+    run_sketches = {}
+    post_merge = PostMergeTracker.from_env()
+    control.begin("analyze")
+    for trace, weight in all_traces:
+        if _stop_early(control, control.run_stop_reason, log_event, "analyze_trace",
+                       "Run stopped while recording latencies.", {"recorded_trace_count": len(analyzable)}):
+            break
         spans = trace.get("spans") or []
         if not isinstance(spans, list):
             log_event(
@@ -368,76 +840,111 @@ def detect_incidents(runType: str = "manual"):
             skipped_missing_structure += 1
             continue
 
-        duration = 0
-        for span in spans:
-            if span.get("duration") > duration:
-                duration = span.get("duration")
-            # if not span.get("references"):
-            #     rootSpan = span
-            # if span.get("operationName") == "GET":
-            #     getSpan = span
+        tree = SpanTree(spans)
+        callOperations = {}
+        for span_id, span in tree.spans.items():
             if span.get("operationName") == "prisma:call-operation":
-                callOperations[span.get("spanID")] = span
-            # if span.get("operationName") == "prisma:client:db_query":
-            #     dbQuerySpan = span
-            #     references = dbQuerySpan.get("references") or []
-            #     if not references:
-            #         continue
-            #     firstReference = references[0]
-            #     spanId = firstReference.get("spanID")
-                
-            #     for tag in dbQuerySpan.get("tags"):
-            #         if tag.get("key") == "db.query.text":
-            #             callOperationSpans[spanId].append(tag.get("value"))
+                callOperations[span_id] = span
 
         if len(callOperations) == 0:
             skipped_missing_structure += 1
             continue
 
-        # duration = rootSpan.get("duration")
+        route = trace_route(tree)
+        record_latency(run_sketches, route, REQUEST, tree.duration, weight)
+        call_sites = {}
+        for span in callOperations.values():
+            call_site = span_tags(span).get("prisma.frame")
+            if call_site:
+                record_latency(run_sketches, route, call_site, span.get("duration") or 0, weight)
+                post_merge.record(call_site, span.get("startTime"), span.get("duration"), weight)
+                call_sites[call_site] = max(call_sites.get(call_site, 0), span.get("duration") or 0)
+
+        analyzable.append((trace, weight, tree, callOperations, route, call_sites))
+
+    comparison = compare_and_update_baselines(
+        run_sketches,
+        tolerance=float(os.getenv("LATENCY_REGRESSION_TOLERANCE", "0.2")),
+        min_samples=int(os.getenv("LATENCY_MIN_SAMPLES", "10")),
+        save=not dry_run,
+    )
+    log_event(
+        "baselines",
+        "Updated per-route latency baselines.",
+        context={
+            "route_count": len({route for route, _call_site in run_sketches}),
+            "sketch_count": len(run_sketches),
+            "regression_count": len(comparison.regressions),
+            "regressions": list(comparison.regressions.values())[:20],
+        },
+    )
+
+    if post_merge.sketches:
+        updated_fixes = [] if dry_run else post_merge.save()
+        log_event(
+            "post_merge",
+            "Compared merged call sites against their pre-merge latency.",
+            context={"fix_count": len(post_merge.sketches), "fixes": updated_fixes[:20]},
+        )
 
-        if duration < 2 * 10**6:
+    # Second pass: analyze the traces that are slow relative to their route.
+    for trace, weight, tree, callOperations, route, call_sites in analyzable:
+        if _stop_early(control, control.stop_reason, log_event, "analyze_trace",
+                       "Stopped analyzing traces early; scheduling the candidates found so far.",
+                       {"candidate_count": candidate_count}):
+            break
+        duration = tree.duration
+        regressions = comparison.route_regressions(route, call_sites)
+
+        if comparison.is_mature(route):
+            # Only regressed routes qualify, and only the requests in their slow tail.
+            slow = False
+            for regression in regressions:
+                if regression["callSite"] == REQUEST:
+                    slow = slow or duration > regression["baselineP95"]
+                else:
+                    slow = slow or call_sites[regression["callSite"]] > regression["baselineP95"]
+        else:
+            slow = duration >= cold_start_threshold
+
+        if not slow:
             skipped_fast += 1
             continue
 
-        # httpTarget = None
-        # stacktrace = None
-        # for tag in getSpan.get("tags"):
-        #     if tag.get("key") == "http.target":
-        #         httpTarget = tag
-        #     if tag.get("key") == "code.stacktrace":
-        #         stacktrace = tag
-
-        for span_id in callOperations:
-            curr = {"duration": callOperations[span_id].get("duration")}
-            for tag in callOperations[span_id].get("tags"):
-                if tag.get("key") == "prisma.args":
-                    curr["args"] = tag.get("value")
-                if tag.get("key") == "prisma.frame":
-                    curr["tag"] = tag.get("value")
-                
-            callOperations[span_id] = curr
-
-        # if httpTarget.get("value") == "/matches":
-        #     continue
-        
-        incidents[trace.get("traceID")] = {
-            # "httpTarget": httpTarget.get("value") if httpTarget else None,
-            # "stacktrace": stacktrace.get("value"),
-            "duration": duration,
-            "callOperations": sorted([{
-                "callOperation": callOperations[span_id],
-            } for span_id in callOperations], key=lambda co: co.get("callOperation").get("duration"), reverse=True)
-        }
-        
+        trace_id = trace.get("traceID")
+        incident = analyze_trace(trace, tree, callOperations, route, regressions, n_plus_one_min_repeats)
+        n_plus_one = incident["nPlusOne"]
+        candidate_count += 1
+
+        # Fold the trace into its call site's totals; only the worst example is kept whole.
+        key = incident_call_site(incident)
+        if key not in impacts:
+            impacts[key] = CallSiteImpact(key)
+        added_micros = call_site_latency(incident)
+        impacts[key].add(trace_id, incident, added_micros, rank=incident_rank(incident), weight=weight)
+        if key not in call_site_hotspots:
+            call_site_hotspots[key] = HotspotTree()
+        for stacktrace, micros in stack_latency(tree).items():
+            hotspots.add(stacktrace, micros, weight)
+            call_site_hotspots[key].add(stacktrace, micros, weight)
+
         log_event(
             "analyze_trace_output",
             "Detected slow trace candidate.",
             context={
-                "trace_id": trace.get("traceID"),
-                # "http_target": httpTarget.get("value") if httpTarget else None,
+                "trace_id": trace_id,
+                "http_target": route,
                 "duration_micros": duration,
                 "call_operation_count": len(callOperations),
+                "call_site": key,
+                "call_site_critical_micros": added_micros,
+                "regression_count": len(regressions),
+                "n_plus_one_count": len(n_plus_one),
+                "top_n_plus_one": (
+                    {key: n_plus_one[0][key] for key in ("fingerprint", "callSite", "repeatCount", "totalDuration")}
+                    if n_plus_one
+                    else None
+                ),
             },
         )
 
@@ -445,133 +952,503 @@ def detect_incidents(runType: str = "manual"):
         "analyze_trace",
         "Finished analyzing traces.",
         context={
-            "candidate_count": len(incidents),
+            "candidate_count": candidate_count,
+            "call_site_count": len(impacts),
             "skipped_missing_structure": skipped_missing_structure,
             "skipped_fast": skipped_fast,
         },
     )
+    if hotspots.total_micros:
+        log_event("hotspots", "Aggregated slow-trace latency by call stack.", context=hotspots.summary(10))
+
+    fresh_candidates = []
+    for impact in impacts.values():
+        candidate = dict(impact.incident, impact=impact.summary())
+        candidate["callSite"] = impact.call_site or ""
+        candidate["traceId"] = impact.trace_id
+        call_site_hotspot = call_site_hotspots[impact.call_site]
+        candidate["hotspot"] = call_site_hotspot.dominant_frame()
+        candidate["hotspotStack"] = call_site_hotspot.render()
+        candidate["latencySketch"] = call_site_sketch(run_sketches, impact.call_site).to_dict()
+        fresh_candidates.append(candidate)
+
+    # Spend the run's agent sessions on the candidates that cost the most latency.
+    deferred_candidates = load_deferred_candidates(purge=not dry_run)
+    scheduled = schedule_candidates(fresh_candidates, deferred_candidates)
+    budget = RunBudget.from_env(started_at)
+    log_event(
+        "schedule",
+        "Ranked incident candidates by estimated impact.",
+        context={
+            "fresh_count": len(fresh_candidates),
+            "carried_over_count": len(deferred_candidates),
+            "scheduled_count": len(scheduled),
+            "max_sessions": budget.max_sessions,
+            "max_seconds": budget.max_seconds,
+            "order": [
+                {key: candidate.get(key) for key in ("callSite", "traceId", "severity", "score", "deferrals")}
+                for candidate in scheduled[:20]
+            ],
+        },
+    )
+
+    # Precomputed source context, so the agent does not have to search the repository for it.
+    try:
+        code_index = CodeIndex.from_env()
+    except (OSError, RuntimeError) as exc:
+        code_index = None
+        log_event(
+            "code_index",
+            "Could not load the code index; prompts will not include source context.",
+            level="warning",
+            context={"error": str(exc)},
+        )
+    if code_index is not None:
+        max_lines = int(os.getenv("CODE_INDEX_MAX_EXCERPT_LINES", "80"))
+        for candidate in scheduled:
+            candidate["sourceContext"] = candidate_contexts(code_index, candidate, max_lines=max_lines)
+        log_event(
+            "code_index",
+            "Attached source context from the code index.",
+            context={
+                "commit": code_index.sha,
+                "file_count": len(code_index.files),
+                "reparsed_file_count": code_index.reparsed,
+                "candidates_with_context": sum(1 for candidate in scheduled if candidate["sourceContext"]),
+            },
+        )
+
+    # Candidates in the same file (or module) share one clone, agent session and PR.
+    groups = group_candidates(
+        scheduled,
+        group_by=os.getenv("PR_GROUP_BY", "file").strip().lower(),
+        max_size=int(os.getenv("PR_GROUP_MAX_SIZE", "5")),
+    )
+    log_event(
+        "group",
+        "Grouped incident candidates into agent sessions.",
+        context={
+            "candidate_count": len(scheduled),
+            "group_count": len(groups),
+            "groups": [[candidate["callSite"] for candidate in group] for group in groups[:20]],
+        },
+    )
+
+    checkpoint = RunCheckpoint(None) if dry_run else RunCheckpoint.save_groups(detection_run, groups)
+    created_incident_candidates.update(
+        _run_agent_sessions(log_event, groups, budget, control, checkpoint, dry_run=dry_run)
+    )
+
+    log_event(
+        "complete",
+        "Incident detection run completed.",
+        context={
+            "candidate_count": candidate_count,
+            "created_incident_candidates": len(created_incident_candidates),
+            "stopped": control.stopped,
+            "elapsed_seconds": round(control.elapsed, 1),
+        },
+    )
+
+    return created_incident_candidates
 
-    deduplicated_incidents = {}
-    for trace_id in incidents:
-        incident = incidents[trace_id]
-        slowCallOperation = incident.get("callOperations")[0]
-        deduplicated_incidents[slowCallOperation.get("callOperation").get("tag")] = {
-            "incident": incident,
-            "trace_id": trace_id,
-        }
 
-    for key in deduplicated_incidents:
-        incident_data = deduplicated_incidents[key]
-        incident = incident_data.get("incident")
-        trace_id = incident_data.get("trace_id")
+def _run_agent_sessions(log_event, groups, budget, control, checkpoint, dry_run=False):
+    """One agent session (and PR) per group, in order, until the budget runs out or the run stops.
+
+    A failing session is recorded on its candidates in `checkpoint` and the run goes on
+    with the next group. With AGENT_QUEUE=db the sessions are queued as AgentJobs instead.
+    Returns the candidates incidents were created for, by trace id.
+    """
+    created_incident_candidates = {}
+
+    for position, group in enumerate(groups):
+        reason = control.run_stop_reason()
+        if reason:
+            remaining = [candidate for later in groups[position:] for candidate in later]
+            if not dry_run:
+                defer_candidates(remaining, log_event.run_id)
+                checkpoint.mark(remaining, "deferred")
+            log_event(
+                "schedule",
+                "Run stopped; carrying remaining candidates over to the next run.",
+                level="warning",
+                context={"reason": reason, "elapsed_seconds": round(control.elapsed, 1), "deferred_count": len(remaining)},
+            )
+            break
+        reason = budget.exhausted()
+        if reason:
+            remaining = [candidate for later in groups[position:] for candidate in later]
+            if not dry_run:
+                defer_candidates(remaining, log_event.run_id)
+                checkpoint.mark(remaining, "deferred")
+            log_event(
+                "schedule",
+                "Run budget exhausted; carrying remaining candidates over to the next run.",
+                level="warning",
+                context={
+                    "reason": reason,
+                    "sessions": budget.sessions,
+                    "elapsed_seconds": round(budget.elapsed, 1),
+                    "deferred_count": len(remaining),
+                },
+            )
+            break
+        budget.spend()
+
+        trace_id = group[0]["traceId"]
+        trace_ids = [incident_data["traceId"] for incident_data in group]
+        prompt = create_prompt_from_incidents(group)
+        if dry_run:
+            log_event(
+                "generate_pr",
+                "Dry run; skipping pull request generation.",
+                context={
+                    "trace_ids": trace_ids,
+                    "call_sites": [incident_data["callSite"] for incident_data in group],
+                    "score": sum(incident_data["score"] for incident_data in group),
+                },
+            )
+            for incident_data in group:
+                created_incident_candidates[incident_data["traceId"]] = dict(
+                    incident_data, prompt=prompt, groupSize=len(group),
+                )
+            continue
+        for incident_data in group:
+            mark_started(incident_data)
 
-        incident_data = incidents[trace_id]
-        prompt = create_prompt_from_incident(incident_data)
         log_event(
             "generate_prompt",
             "Created PR-generation prompt for incident candidate.",
-            context={"trace_id": trace_id, "http_target": incident_data.get("httpTarget")},
+            context={
+                "trace_id": trace_id,
+                "trace_ids": trace_ids,
+                "http_target": group[0].get("httpTarget"),
+                "score": sum(incident_data["score"] for incident_data in group),
+                "deferrals": max(incident_data.get("deferrals", 0) for incident_data in group),
+            },
         )
         print("GENERATING PR")
+        log_event.flush()
+        # What a BENCHMARK_CMD needs to replay the slow requests of this group.
+        benchmark_env = {
+            "INCIDENT_TRACE_ID": trace_id,
+            "INCIDENT_TRACE_IDS": ",".join(
+                dict.fromkeys(example for data in group for example in data["impact"]["exampleTraceIds"])
+            ),
+            "INCIDENT_ROUTES": ",".join(
+                dict.fromkeys(route for data in group for route in data["impact"]["affectedRoutes"])
+            ),
+            "INCIDENT_CALL_SITES": "\n".join(data["callSite"] for data in group),
+        }
+        if queue_enabled():
+            # A run_agent_worker process on any machine picks the session up and reports back.
+            job = enqueue(checkpoint.detection_run, log_event.run_id, position, group, prompt, benchmark_env)
+            log_event(
+                "generate_pr",
+                "Queued agent session for a worker.",
+                context={"job_id": job.id, "trace_ids": trace_ids},
+            )
+            continue
+        checkpoint.start(group)
         try:
-            pull_request = generate_pr(os.getenv("GITHUB_LINK"), prompt=prompt)
+            with control.stage("agent_session"):
+                pull_request = generate_pr(
+                    os.getenv("GITHUB_LINK"),
+                    prompt=prompt,
+                    benchmark_env=benchmark_env,
+                    incident_prompts=_incident_prompts(group, prompt),
+                )
+        except ProcessStopped as exc:
+            # The agent's process group was killed; a stopped run also carries the later groups over.
+            run_stopped = control.run_stop_reason()
+            remaining = group + ([candidate for later in groups[position + 1:] for candidate in later] if run_stopped else [])
+            defer_candidates(remaining, log_event.run_id)
+            checkpoint.mark(remaining, "deferred", error=str(exc))
+            log_event(
+                "generate_pr",
+                "Agent session stopped; carrying its candidates over to the next run.",
+                level="warning",
+                context={"trace_ids": trace_ids, "reason": exc.reason, "deferred_count": len(remaining)},
+            )
+            if run_stopped:
+                break
+            continue
         except Exception as exc:
+            # Only this group fails; resuming the run retries it.
+            checkpoint.mark(group, "failed", error=str(exc))
             log_event(
                 "generate_pr",
                 "Failed to generate pull request suggestion.",
                 level="error",
-                context={"trace_id": trace_id, "error": str(exc)},
+                context={"trace_id": trace_id, "trace_ids": trace_ids, "error": str(exc)},
             )
-            raise
- 
+            continue
+
+        created_incident_candidates.update(_record_session_result(log_event, group, prompt, pull_request, checkpoint))
+
+    return created_incident_candidates
+
+
+def _incident_prompts(group, prompt):
+    """Detection prompt per trace id that the incident text is generated from."""
+    # Incident text is generated per call site, from that call site's own prompt.
+    return {
+        incident_data["traceId"]: prompt if len(group) == 1 else create_prompt_from_incident(incident_data)
+        for incident_data in group
+    }
+
+
+def _record_session_result(log_event, group, prompt, pull_request, checkpoint):
+    """Incidents (or the reason there are none) for the `generate_pr` result of one group's session."""
+    trace_id = group[0]["traceId"]
+    trace_ids = [incident_data["traceId"] for incident_data in group]
+    log_event(
+        "generate_pr",
+        "Pull request suggestion generation completed.",
+        context={
+            "trace_id": trace_id,
+            "trace_ids": trace_ids,
+            "pull_request_id": pull_request.get("id") if isinstance(pull_request, dict) else None,
+            "verification": pull_request.get("verification") if isinstance(pull_request, dict) else None,
+            "stage_timings": pull_request.get("stageTimings") if isinstance(pull_request, dict) else None,
+        },
+    )
+
+    created_incident_candidates = {}
+    if isinstance(pull_request, dict) and pull_request.get("id"):
+        incident_prompts = _incident_prompts(group, prompt)
+        for incident_data in group:
+            _create_incident(log_event, incident_data, pull_request, incident_prompts[incident_data["traceId"]])
+            created_incident_candidates[incident_data["traceId"]] = incident_data
+        checkpoint.mark(group, "generated", pull_request_id=pull_request["id"])
+    elif isinstance(pull_request, dict) and pull_request.get("rejected"):
+        checkpoint.mark(group, "rejected")
         log_event(
-            "generate_pr",
-            "Pull request suggestion generation completed.",
+            "verify_pr",
+            "Benchmark did not confirm the change improves latency; no pull request was opened.",
+            level="warning",
             context={
                 "trace_id": trace_id,
-                "pull_request_id": pull_request.get("id") if isinstance(pull_request, dict) else None,
+                "trace_ids": trace_ids,
+                "reason": pull_request["rejected"],
+                "verification": pull_request.get("verification"),
             },
         )
- 
-        if isinstance(pull_request, dict) and pull_request.get("id"):
-            http_target = incident_data.get("httpTarget") or "unknown target"
-            duration_micros = incident_data.get("duration") or 0
-            call_ops = incident_data.get("callOperations") or []
-            top_queries = []
-            if call_ops and isinstance(call_ops, list):
-                top_queries = call_ops[0].get("queries") or []
- 
-            incident_fields = {}
-            try:
-                incident_fields = generate_incident_fields(
-                    detection_prompt=prompt,
-                    pull_request_title=str(pull_request.get("title") or ""),
-                    pull_request_description=str(pull_request.get("body") or ""),
-                )
-            except Exception as exc:
-                print(f"Failed to generate incident text via Claude; using fallback text. Error: {exc}")
-                log_event(
-                    "generate_incident_text",
-                    "Failed to generate incident text via Claude; using fallback text.",
-                    level="warning",
-                    context={"trace_id": trace_id, "pull_request_id": pull_request["id"], "error": str(exc)},
-                )
+    else:
+        checkpoint.mark(group, "skipped")
+        log_event(
+            "generate_pr",
+            "PR generation returned no PullRequest record id; skipping incident creation.",
+            level="warning",
+            context={"trace_id": trace_id, "trace_ids": trace_ids},
+        )
+    return created_incident_candidates
+
+
+def run_agent_job(job, worker_id: str, lease_seconds: float) -> str | None:
+    """Run one claimed AgentJob: its agent session, then incidents for the result.
+
+    The lease is renewed in the background while the agent works. The session's result
+    is kept on the job as soon as it is back, and a later attempt adopts it instead of
+    opening another PR. Incidents are only recorded while the worker still holds the
+    lease, so a job that was given up on and re-claimed elsewhere is not reported twice.
+    The job's run is finished once its last job is done. Returns the job's new status.
+    """
+    job_status = _run_agent_job(job, worker_id, lease_seconds)
+    settle_run(job.detectionRun_id)
+    return job_status
 
-            ai_title = str(incident_fields.get("title") or "").strip()
-            if ai_title and not ai_title.lower().startswith("for "):
-                log_event(
-                    "generate_incident_text",
-                    "AI returned incident title in unexpected format; using fallback title.",
-                    level="warning",
-                    context={"trace_id": trace_id, "pull_request_id": pull_request["id"], "title": ai_title},
+
+def _run_agent_job(job, worker_id: str, lease_seconds: float) -> str | None:
+    log_event = RunLogger(job.runId or f"job-{job.id}")
+    checkpoint = RunCheckpoint(job.detectionRun)
+    group = job.candidates
+    trace_ids = [incident_data["traceId"] for incident_data in group]
+    control = RunControl.from_env(job.detectionRun_id)
+    checkpoint.start(group)
+
+    lease_lost = threading.Event()
+    stop_heartbeat = threading.Event()
+
+    def renew_lease():
+        try:
+            while not stop_heartbeat.wait(max(1.0, lease_seconds / 3)):
+                if not heartbeat(job, worker_id, lease_seconds):
+                    lease_lost.set()
+                    return
+        finally:
+            connections.close_all()
+
+    adopted = "session" in (job.result or {})
+    renewer = threading.Thread(target=renew_lease, name=f"agent-job-{job.id}-heartbeat", daemon=True)
+    renewer.start()
+    log_event(
+        "generate_pr",
+        "Adopting the agent session of an earlier attempt." if adopted else "Worker started agent session.",
+        context={"job_id": job.id, "worker": worker_id, "attempt": job.attempts, "trace_ids": trace_ids},
+    )
+    try:
+        if adopted:
+            pull_request = job.result["session"]
+        else:
+            if control.cancelled():
+                # The run was cancelled while this job waited in the queue.
+                raise ProcessStopped("cancelled")
+            with control.stage("agent_session"):
+                pull_request = generate_pr(
+                    os.getenv("GITHUB_LINK"),
+                    prompt=job.prompt,
+                    benchmark_env=job.benchmarkEnv,
+                    incident_prompts=_incident_prompts(group, job.prompt),
                 )
-                ai_title = ""
- 
-            created_incident = Incident.objects.create(
-                pullRequest_id=pull_request["id"],
-                url=str(incident_data.get("httpTarget") or ""),
-                title=ai_title or "For relevant page caused by slow database queries",
-                problemDescription=incident_fields.get("problemDescription") or (
-                    f"Slow HTTP request detected for '{http_target}' in trace {trace_id}. "
-                    f"Observed duration: {duration_micros / 1_000_000:.3f} seconds."
-                ),
-                solutionDescription=incident_fields.get("solutionDescription") or (
-                    "A pull request was generated to improve performance. "
-                    + (f"Primary related queries: {', '.join(top_queries)}" if top_queries else "No query details captured.")
-                ),
-                severity=incident_fields.get("severity") or "medium",
-                timeImpact=round(float(duration_micros) / 1_000_000, 2),
-                impactCount=len(call_ops),
+            record_session(job, pull_request)
+    except Exception as exc:
+        cancelled = isinstance(exc, ProcessStopped) and exc.reason == "cancelled"
+        status_after = finish(job, worker_id, error=str(exc), retry=not cancelled)
+        if cancelled:
+            defer_candidates(group, job.runId)
+            checkpoint.mark(group, "deferred", error=str(exc))
+        elif status_after == "failed":
+            checkpoint.mark(group, "failed", error=str(exc))
+        log_event(
+            "generate_pr",
+            "Agent job failed.",
+            level="error",
+            context={"job_id": job.id, "trace_ids": trace_ids, "error": str(exc), "status": status_after},
+        )
+        return status_after
+    finally:
+        stop_heartbeat.set()
+        renewer.join()
+        log_event.flush()
+
+    try:
+        if lease_lost.is_set() or not heartbeat(job, worker_id, lease_seconds):
+            log_event(
+                "generate_pr",
+                "Lost the job lease before reporting; leaving the result to the worker that holds it.",
+                level="warning",
+                context={"job_id": job.id, "trace_ids": trace_ids},
             )
-            linked_pull_request = PullRequest.objects.filter(id=pull_request["id"]).first()
- 
+            return None
+        try:
+            created = _record_session_result(log_event, group, job.prompt, pull_request, checkpoint)
+        except Exception as exc:
+            # The session is kept on the job, so the retry only records its result.
+            status_after = finish(job, worker_id, error=f"Recording the session result failed: {exc}")
+            if status_after == "failed":
+                checkpoint.mark(group, "failed", error=str(exc))
             log_event(
                 "create_incident",
-                "Created incident linked to suggested pull request.",
-                context={
-                    "trace_id": trace_id,
-                    "http_target": http_target,
-                    "duration_micros": duration_micros,
-                 },
-                incident=created_incident,
-                pull_request=linked_pull_request,
-             )
-            created_incident_candidates[trace_id] = incident_data
-        else:
-           log_event(
-               "generate_pr",
-               "PR generation returned no PullRequest record id; skipping incident creation.",
-               level="warning",
-               context={"trace_id": trace_id},
-           )
-    
+                "Failed to record the agent session result.",
+                level="error",
+                context={"job_id": job.id, "trace_ids": trace_ids, "error": str(exc), "status": status_after},
+            )
+            return status_after
+        if created and job.detectionRun_id:
+            # A queryset update skips auto_now and post_save: bump updated_at for the list ETag
+            # and invalidate the dashboard stats by hand.
+            DetectionRun.objects.filter(id=job.detectionRun_id).update(
+                incidentCount=F("incidentCount") + len(created), updated_at=timezone.now(),
+            )
+            invalidate_stats()
+        return finish(job, worker_id, result={
+            "session": pull_request,
+            "pullRequestId": pull_request.get("id") if isinstance(pull_request, dict) else None,
+            "rejected": pull_request.get("rejected") if isinstance(pull_request, dict) else None,
+            "incidentTraceIds": list(created),
+        })
+    finally:
+        log_event.flush()
+
+
+def _create_incident(log_event, incident_data, pull_request, prompt):
+    """Incident row for one candidate, linked to the PR generated for its group."""
+    trace_id = incident_data["traceId"]
+    impact = incident_data["impact"]
+    http_target = incident_data.get("httpTarget") or "unknown target"
+    duration_micros = incident_data.get("duration") or 0
+    total_added_micros = impact["totalAddedMicros"] or duration_micros
+    n_plus_one = incident_data.get("nPlusOne") or []
+    top_queries = [pattern["fingerprint"] for pattern in n_plus_one[:3]]
+
+    # generate_pr drafts the text while it pushes and opens the PR; older results lack it.
+    incident_fields = (pull_request.get("incidentFields") or {}).get(trace_id)
+    try:
+        if incident_fields is None:
+            incident_fields = generate_incident_fields(
+                detection_prompt=prompt,
+                pull_request_title=str(pull_request.get("title") or ""),
+                pull_request_description=str(pull_request.get("body") or ""),
+            )
+        elif incident_fields.get("error"):
+            raise RuntimeError(incident_fields["error"])
+    except Exception as exc:
+        incident_fields = {}
+        print(f"Failed to generate incident text via Claude; using fallback text. Error: {exc}")
+        log_event(
+            "generate_incident_text",
+            "Failed to generate incident text via Claude; using fallback text.",
+            level="warning",
+            context={"trace_id": trace_id, "pull_request_id": pull_request["id"], "error": str(exc)},
+        )
+
+    ai_title = str(incident_fields.get("title") or "").strip()
+    if ai_title and not ai_title.lower().startswith("for "):
+        log_event(
+            "generate_incident_text",
+            "AI returned incident title in unexpected format; using fallback title.",
+            level="warning",
+            context={"trace_id": trace_id, "pull_request_id": pull_request["id"], "title": ai_title},
+        )
+        ai_title = ""
+
+    created_incident = Incident.objects.create(
+        pullRequest_id=pull_request["id"],
+        url=str(incident_data.get("httpTarget") or ""),
+        title=ai_title or "For relevant page caused by slow database queries",
+        problemDescription=incident_fields.get("problemDescription") or (
+            f"Slow HTTP request detected for '{http_target}' in trace {trace_id}. "
+            f"Observed duration: {duration_micros / 1_000_000:.3f} seconds. "
+            f"The same call site was slow in {round(impact['occurrences'])} request(s), "
+            f"adding {impact['meanAddedMicros'] / 1_000_000:.3f} seconds on average."
+        ),
+        solutionDescription=incident_fields.get("solutionDescription") or (
+            "A pull request was generated to improve performance. "
+            + (f"Primary related queries: {', '.join(top_queries)}" if top_queries else "No query details captured.")
+        ),
+        severity=incident_fields.get("severity") or incident_data["severity"],
+        timeImpact=round(float(total_added_micros) / 1_000_000, 2),
+        impactCount=round(impact["occurrences"]),
+        sampleRate=round(impact["sampledOccurrences"] / impact["occurrences"], 4) if impact["occurrences"] else 1.0,
+        meanAddedLatency=round(impact["meanAddedMicros"] / 1_000_000, 3),
+        callSite=impact["callSite"] or "",
+        hotspot=(
+            f"{incident_data['hotspot']['function']} ({incident_data['hotspot']['location']})"
+            if incident_data.get("hotspot")
+            else ""
+        ),
+        hotspotStack=incident_data.get("hotspotStack") or "",
+        verifiedSpeedup=(pull_request.get("verification") or {}).get("speedup"),
+        latencySketch=incident_data.get("latencySketch") or {},
+        exampleTraceIds=impact["exampleTraceIds"],
+        affectedRoutes=impact["affectedRoutes"],
+        queryPattern=n_plus_one[0]["fingerprint"] if n_plus_one else "",
+        repeatCount=n_plus_one[0]["repeatCount"] if n_plus_one else 0,
+    )
+    linked_pull_request = PullRequest.objects.filter(id=pull_request["id"]).first()
+
     log_event(
-        "complete",
-        "Incident detection run completed.",
+        "create_incident",
+        "Created incident linked to suggested pull request.",
         context={
-            "candidate_count": len(incidents),
-            "created_incident_candidates": len(created_incident_candidates),
+            "trace_id": trace_id,
+            "http_target": http_target,
+            "duration_micros": duration_micros,
+            "occurrences": impact["occurrences"],
+            "total_added_micros": impact["totalAddedMicros"],
         },
+        incident=created_incident,
+        pull_request=linked_pull_request,
     )
-
-    return created_incident_candidates
@@ -87,6 +87,29 @@ DATABASES = {
     }
 }
 
+# The hourly scheduler thread writes logs/incidents while API requests read them.
+# "tuned" switches SQLite to WAL so readers never block on the writer, waits on
+# locks instead of failing with "database is locked", and takes the write lock up
+# front (BEGIN IMMEDIATE) so transactions cannot deadlock upgrading it.
+# Set DJANGO_SQLITE_MODE=default for the stock SQLite configuration.
+SQLITE_MODE = os.getenv('DJANGO_SQLITE_MODE', 'tuned').strip().lower()
+
+SQLITE_TUNED_OPTIONS = {
+    'timeout': 20,
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA busy_timeout=20000;'
+        'PRAGMA mmap_size=268435456;'
+    ),
+}
+
+if SQLITE_MODE == 'tuned':
+    DATABASES['default']['OPTIONS'] = SQLITE_TUNED_OPTIONS
+elif SQLITE_MODE != 'default':
+    raise RuntimeError(f"Invalid DJANGO_SQLITE_MODE '{SQLITE_MODE}'. Expected 'tuned' or 'default'.")
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -123,3 +146,14 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
@@ -1,5 +1,5 @@
 import { useEffect, useMemo, useState } from 'react'
-import { get_detection_runs, get_logs } from '../services/api'
+import { get_detection_runs, get_logs, stream_logs } from '../services/api'
 import type { DetectionRun } from '../types/DetectionRun'
 import type { LogEntry, LogLevel } from '../types/Log'
 
@@ -83,6 +83,27 @@ export default function LogPage() {
     }
   }, [])
 
+  const runningRunId = useMemo(
+    () => detectionRuns.find((run) => run.status === 'running' && run.runId)?.runId ?? null,
+    [detectionRuns],
+  )
+
+  useEffect(() => {
+    if (!runningRunId) {
+      return
+    }
+
+    return stream_logs(
+      runningRunId,
+      (log) => setLogs((prev) => (prev.some((l) => l.id === log.id) ? prev : [log, ...prev])),
+      () => {
+        get_detection_runs()
+          .then(setDetectionRuns)
+          .catch(() => undefined)
+      },
+    )
+  }, [runningRunId])
+
   const filteredLogs = useMemo(
     () => (selectedLevel === 'all' ? logs : logs.filter((log) => log.level === selectedLevel)),
     [logs, selectedLevel],
@@ -3,6 +3,7 @@ import type { PullRequest } from '../types/PullRequest'
 import type { Incident } from '../types/Incident'
 import type { LogEntry } from '../types/Log'
 import type { DetectionRun } from '../types/DetectionRun'
+import type { DashboardStats } from '../types/Stats'
 
 export async function get_services() {
   const response = await fetch('/jaeger-api/api/services')
@@ -88,6 +89,27 @@ export async function get_logs(): Promise<LogEntry[]> {
   return Array.isArray(result) ? result : []
 }
 
+export function stream_logs(
+  run_id: string,
+  onLog: (log: LogEntry) => void,
+  onEnd: (status: DetectionRun['status'] | null) => void,
+): () => void {
+  const params = new URLSearchParams({ run_id })
+  // EventSource resends Last-Event-ID on reconnect, so the server resumes where it left off.
+  const source = new EventSource(`/backend-api/logs/stream/?${params.toString()}`)
+
+  source.addEventListener('log', (event) => {
+    onLog(JSON.parse((event as MessageEvent).data) as LogEntry)
+  })
+  source.addEventListener('end', (event) => {
+    source.close()
+    const result = JSON.parse((event as MessageEvent).data) as { status: DetectionRun['status'] | null }
+    onEnd(result.status)
+  })
+
+  return () => source.close()
+}
+
 export async function get_detection_runs(): Promise<DetectionRun[]> {
   const response = await fetch('/backend-api/detection-runs/?limit=12')
   if (!response.ok) {
@@ -98,6 +120,15 @@ export async function get_detection_runs(): Promise<DetectionRun[]> {
   return Array.isArray(result) ? result : []
 }
 
+export async function get_stats(): Promise<DashboardStats> {
+  const response = await fetch('/backend-api/stats/')
+  if (!response.ok) {
+    throw new Error(`Failed to fetch stats: ${response.status} ${response.statusText}`)
+  }
+
+  return response.json() as Promise<DashboardStats>
+}
+
 export async function delete_incident(id: number) {
   const response = await fetch(`/backend-api/incidents/${id}/`, {
     method: 'DELETE',
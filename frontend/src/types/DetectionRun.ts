@@ -1,8 +1,11 @@
 export type DetectionRun = {
   id: number
   date: string
+  runId: string
   runType: 'manual' | 'automatic'
-  status: 'success' | 'failure'
+  status: 'running' | 'success' | 'failure' | 'cancelled' | 'timeout' | 'partial' | 'queued'
   incidentCount: number
   errorMessage: string
+  cancelRequested: boolean
+  updated_at: string
 }
@@ -8,4 +8,15 @@ export type Incident = {
   solutionDescription: string
   timeImpact: number
   impactCount: number
+  queryPattern: string
+  repeatCount: number
+  callSite: string
+  hotspot: string
+  hotspotStack: string
+  verifiedSpeedup: number | null
+  meanAddedLatency: number
+  sampleRate: number
+  exampleTraceIds: string[]
+  affectedRoutes: string[]
+  updated_at: string
 }
@@ -0,0 +1,23 @@
+export type MergedFix = {
+  id: number
+  callSite: string
+  routes: string[]
+  incidentTitle: string
+  pullRequestTitle: string
+  repo: string
+  headBranch: string
+  mergeSha: string
+  mergedAt: string
+  verifiedSpeedup: number | null
+  beforeCount: number
+  afterCount: number
+  beforeP50: number | null
+  beforeP95: number | null
+  afterP50: number | null
+  afterP95: number | null
+  p50Change: number | null
+  p95Change: number | null
+  status: 'pending' | 'improved' | 'unchanged' | 'regressed'
+  checkedAt: string | null
+  updated_at: string
+}
@@ -8,6 +8,9 @@ export type PullRequest = {
   title: string
   body: string
   compare_url: string
+  benchmark_base_ms: number | null
+  benchmark_head_ms: number | null
+  speedup: number | null
   created_at: string
   updated_at: string
 }
@@ -0,0 +1,14 @@
+export type RunCandidate = {
+  id: number
+  detectionRun: number
+  position: number
+  groupIndex: number
+  callSite: string
+  traceId: string
+  score: number
+  status: 'pending' | 'generated' | 'failed' | 'rejected' | 'skipped' | 'deferred'
+  attempts: number
+  errorMessage: string
+  pullRequest: number | null
+  updated_at: string
+}
@@ -0,0 +1,40 @@
+import type { Incident } from './Incident'
+
+export type SeverityStats = {
+  count: number
+  timeImpact: number
+}
+
+export type DashboardStats = {
+  incidents: {
+    total: number
+    totalTimeImpact: number
+    bySeverity: Record<Incident['severity'], SeverityStats>
+    byDay: { date: string; count: number; timeImpact: number }[]
+  }
+  detectionRuns: {
+    total: number
+    success: number
+    failure: number
+    cancelled: number
+    timeout: number
+    partial: number
+    running: number
+    queued: number
+    incidentCount: number
+    // success / (success + failure + timeout + partial); cancelled runs are left out.
+    successRate: number | null
+    byDay: {
+      date: string
+      total: number
+      success: number
+      failure: number
+      cancelled: number
+      timeout: number
+      partial: number
+      incidentCount: number
+    }[]
+  }
+  trendDays: number
+  computedAt: string
+}